@@ -0,0 +1,148 @@
+"""Non-blocking JSON logging and sampled per-request access records."""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+access_logger = logging.getLogger("access")
+
+
+class RequestContext:
+    __slots__ = ("request_id", "mongo_ms", "mongo_commands")
+
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        self.mongo_ms = 0.0
+        self.mongo_commands = 0
+
+
+# Motor copies the context into its executor threads, so command listeners see it too
+current_request: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar("current_request", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from ``extra={"fields": {...}}``"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        elif getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Tag application log records with the id of the request that emitted them"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = current_request.get()
+        record.request_id = ctx.request_id if ctx is not None else None
+        return True
+
+
+def configure_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Route all records through a queue so the event loop never blocks on I/O.
+
+    The returned listener owns the real stream handler on a background thread;
+    stop it on shutdown to flush what is still queued.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class MongoTimingListener(monitoring.CommandListener):
+    """Accumulate server time of every Mongo command into the current request"""
+
+    def _record(self, event) -> None:
+        ctx = current_request.get()
+        if ctx is not None:
+            ctx.mongo_ms += event.duration_micros / 1000
+            ctx.mongo_commands += 1
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+class AccessLogMiddleware:
+    """Emit one JSON access record per request.
+
+    Errors (status >= 400) and requests slower than ``slow_ms`` are always logged,
+    other successful requests with probability ``sample_rate``.
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float = 1.0, slow_ms: float = 1000.0) -> None:
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id") or uuid.uuid4().hex
+        ctx = RequestContext(request_id)
+        token = current_request.set(ctx)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            latency_ms = (time.perf_counter() - started) * 1000
+            if status >= 400 or latency_ms >= self.slow_ms or random.random() < self.sample_rate:
+                route = scope.get("route")
+                access_logger.info("request", extra={"fields": {
+                    "request_id": request_id,
+                    "method": scope["method"],
+                    "route": getattr(route, "path", scope["path"]),
+                    "user_id": QueryParams(scope.get("query_string", b"")).get("user_id", "anonymous"),
+                    "status": status,
+                    "latency_ms": round(latency_ms, 3),
+                    "mongo_ms": round(ctx.mongo_ms, 3),
+                    "mongo_commands": ctx.mongo_commands,
+                    "sampled": status < 400 and latency_ms < self.slow_ms,
+                }})
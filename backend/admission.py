@@ -0,0 +1,349 @@
+"""Per-client admission control and priority load shedding in front of Mongo."""
+import asyncio
+import bisect
+import ipaddress
+import itertools
+import json
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from pymongo import monitoring
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower value is shed first
+LOW = 0
+NORMAL = 1
+HIGH = 2
+
+
+def classify_request(method: str, path: str) -> int:
+    """Map a request to its shedding priority"""
+    if path.startswith("/api/analytics"):
+        return LOW
+    if method in ("POST", "PUT", "DELETE") and path.startswith(("/api/cbt-sessions", "/api/zen-sessions")):
+        return HIGH
+    # Diagnostics are most needed exactly when the worker is overloaded
+    if path.startswith("/api/admin/"):
+        return HIGH
+    return NORMAL
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    rate: float  # tokens per second
+    burst: float  # bucket capacity
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float) -> None:
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, limit: RateLimit, now: float) -> float:
+        """Take one token, returning 0 on success or the seconds until one is available"""
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / limit.rate
+
+
+class PoolWaitMonitor(monitoring.ConnectionPoolListener):
+    """Track how many operations are queued waiting for a pooled connection"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def _adjust(self, delta: int) -> None:
+        with self._lock:
+            self.waiting = max(0, self.waiting + delta)
+
+    def connection_check_out_started(self, event):
+        self._adjust(1)
+
+    def connection_checked_out(self, event):
+        self._adjust(-1)
+
+    def connection_check_out_failed(self, event):
+        self._adjust(-1)
+
+    # The remaining pool events are not needed for admission control
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
+
+
+# Upper bounds, in seconds, of the scheduling-delay histogram buckets
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, math.inf)
+
+
+class LoopLagProbe:
+    """Measure event-loop scheduling delay by timing a periodic sleep.
+
+    Every tick's delay goes into a histogram. A watchdog thread notices
+    when the loop has not ticked for ``slow_threshold`` past its interval
+    and captures the loop thread's stack while it is still blocked, so the
+    callback responsible is logged (once the loop is back) along with how
+    long it held the loop, and kept in ``slow_callbacks``.
+    """
+
+    def __init__(self, interval: float = 0.1, slow_threshold: float = 0.1, max_slow_callbacks: int = 50) -> None:
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lag = 0.0
+        self.bucket_counts = [0] * len(LAG_BUCKETS)
+        self.samples = 0
+        self.total = 0.0
+        self.slow_callbacks: "deque[Dict[str, Any]]" = deque(maxlen=max_slow_callbacks)
+        self._beat = 0.0
+        self._loop_thread: Optional[int] = None
+        # (beat, stack) captured by the watchdog during the current stall
+        self._stall: Optional[Tuple[float, List[str]]] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(self, sample: float) -> None:
+        # Exponential smoothing so a single slow tick doesn't flap shedding
+        self.lag = 0.7 * self.lag + 0.3 * sample
+        self.bucket_counts[bisect.bisect_left(LAG_BUCKETS, sample)] += 1
+        self.samples += 1
+        self.total += sample
+
+    def histogram(self) -> Dict[str, Any]:
+        """Cumulative bucket counts, Prometheus style, plus count and sum in seconds"""
+        cumulative = list(itertools.accumulate(self.bucket_counts))
+        return {
+            "buckets": [{"le": "+Inf" if bound == math.inf else bound, "count": n} for bound, n in zip(LAG_BUCKETS, cumulative)],
+            "count": self.samples,
+            "sum": round(self.total, 6),
+        }
+
+    def _slow(self, beat: float, sample: float) -> None:
+        stall = self._stall
+        stack = stall[1] if stall is not None and stall[0] == beat else None
+        self._stall = None
+        entry = {"at": time.time(), "blocked_ms": round(sample * 1000, 1), "stack": stack}
+        self.slow_callbacks.append(entry)
+        logger.warning(
+            f"Event loop blocked for {entry['blocked_ms']}ms",
+            extra={"fields": {"blocked_ms": entry["blocked_ms"], "stack": stack}},
+        )
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.slow_threshold / 2):
+            beat = self._beat
+            # Read once: the loop thread may clear it between two reads
+            stall = self._stall
+            if stall is not None and stall[0] == beat:
+                continue
+            if time.monotonic() - beat - self.interval > self.slow_threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._stall = (beat, traceback.format_stack(frame))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            sample = max(0.0, loop.time() - started - self.interval)
+            self.observe(sample)
+            if sample > self.slow_threshold:
+                self._slow(self._beat, sample)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._loop_thread = threading.get_ident()
+            self._beat = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+@dataclass(frozen=True)
+class AdmissionConfig:
+    limits: Dict[int, RateLimit]
+    max_concurrency: int = 200
+    high_reserve: int = 20  # slots only HIGH priority may use
+    lag_soft: float = 0.05  # seconds, shed LOW above this
+    lag_hard: float = 0.25  # seconds, shed NORMAL above this
+    pool_wait_soft: int = 10
+    pool_wait_hard: int = 50
+    retry_after: int = 2  # seconds, for overload (503) responses
+    max_clients: int = 50000  # bounded bucket table
+    long_lived_paths: Tuple[str, ...] = ()  # streaming routes kept out of the concurrency cap
+    long_lived_suffixes: Tuple[str, ...] = ()  # same, for streaming routes under a resource path
+    trusted_proxies: Tuple[Network, ...] = ()  # peers whose X-Forwarded-For is believed
+
+
+def parse_networks(value: str) -> Tuple[Network, ...]:
+    """Comma-separated addresses or CIDR ranges, as in TRUSTED_PROXIES"""
+    return tuple(ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip())
+
+
+def is_trusted(address: str, proxies: Tuple[Network, ...]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+def client_key(scope: Scope, trusted_proxies: Tuple[Network, ...] = ()) -> str:
+    """Identify the caller by the address that connected.
+
+    user_id is chosen by the client, so it can't key a rate limit. X-Forwarded-For
+    is only read when the peer is a trusted proxy, and then from the right: the
+    first hop not itself a trusted proxy is the client, since anything to the
+    left of it was written by the client.
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if not is_trusted(address, trusted_proxies):
+        return f"ip:{address}"
+    forwarded = Headers(scope=scope).get("x-forwarded-for")
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()] if forwarded else []
+    for hop in reversed(hops):
+        if not is_trusted(hop, trusted_proxies):
+            return f"ip:{hop}"
+    return f"ip:{hops[0] if hops else address}"
+
+
+class AdmissionMiddleware:
+    """Token buckets per client and priority, a global concurrency cap and
+    lag/pool-pressure based shedding of low-priority routes."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        config: AdmissionConfig,
+        lag_probe: LoopLagProbe,
+        pool_monitor: PoolWaitMonitor,
+        classify: Callable[[str, str], int] = classify_request,
+        clock: Callable[[], float] = time.monotonic,
+        buckets: "Optional[OrderedDict[Tuple[str, int], TokenBucket]]" = None,
+    ) -> None:
+        self.app = app
+        self.config = config
+        self.lag_probe = lag_probe
+        self.pool_monitor = pool_monitor
+        self.classify = classify
+        self.clock = clock
+        self.in_flight = 0
+        # Shared with other instances (batch sub-requests) to charge the same client budget
+        self.buckets: "OrderedDict[Tuple[str, int], TokenBucket]" = OrderedDict() if buckets is None else buckets
+
+    def pressure_floor(self) -> int:
+        """Lowest priority still admitted given current loop lag and pool queue"""
+        lag = self.lag_probe.lag
+        waiting = self.pool_monitor.waiting
+        if lag >= self.config.lag_hard or waiting >= self.config.pool_wait_hard:
+            return HIGH
+        if lag >= self.config.lag_soft or waiting >= self.config.pool_wait_soft:
+            return NORMAL
+        return LOW
+
+    def check_rate(self, key: str, priority: int) -> float:
+        limit = self.config.limits.get(priority)
+        if limit is None:
+            return 0.0
+        now = self.clock()
+        bucket = self.buckets.get((key, priority))
+        if bucket is None:
+            bucket = TokenBucket(limit.burst, now)
+            self.buckets[(key, priority)] = bucket
+            if len(self.buckets) > self.config.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end((key, priority))
+        return bucket.take(limit, now)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        priority = self.classify(scope["method"], scope["path"])
+
+        wait = self.check_rate(client_key(scope, self.config.trusted_proxies), priority)
+        if wait > 0:
+            await self.reject(send, 429, "Too many requests", math.ceil(wait))
+            return
+
+        if priority < self.pressure_floor():
+            logger.warning(
+                f"Shedding {scope['method']} {scope['path']}: loop lag {self.lag_probe.lag:.3f}s, "
+                f"pool waiters {self.pool_monitor.waiting}"
+            )
+            await self.reject(send, 503, "Server busy", self.config.retry_after)
+            return
+
+        if scope["path"].startswith(self.config.long_lived_paths) or (
+            scope["method"] == "POST" and scope["path"].endswith(self.config.long_lived_suffixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.config.max_concurrency
+        if priority < HIGH:
+            limit -= self.config.high_reserve
+        if self.in_flight >= limit:
+            await self.reject(send, 503, "Server busy", self.config.retry_after)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def reject(self, send: Send, status: int, detail: str, retry_after: int) -> None:
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
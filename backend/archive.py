@@ -0,0 +1,315 @@
+"""Background archival of old CBT and zen sessions into a compressed cold collection."""
+import asyncio
+import logging
+import os
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import bson
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Archive kind -> hot collection name
+SESSION_KINDS = {"cbt": "cbt_sessions", "zen": "zen_sessions"}
+
+ARCHIVE_COLLECTION = "session_archive"
+STATE_COLLECTION = "archive_state"
+# storage.SEARCH_TERMS_FIELD (storage imports this module); a bucket carries the union of its sessions' terms
+TERMS_FIELD = "search_terms"
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def as_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Match the naive UTC datetimes Motor returns by default"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def pack_sessions(sessions: List[Dict[str, Any]]) -> bytes:
+    return zlib.compress(bson.encode({"sessions": sessions}), 6)
+
+
+def unpack_sessions(payload: bytes) -> List[Dict[str, Any]]:
+    return bson.decode(zlib.decompress(payload))["sessions"]
+
+
+def bucket_terms(sessions: List[Dict[str, Any]]) -> List[str]:
+    return sorted({term for session in sessions for term in session.get(TERMS_FIELD) or ()})
+
+
+class SessionArchiver:
+    """Move sessions older than ``max_age_days`` into per-user compressed buckets.
+
+    Each bucket holds a slice of one user's sessions as zlib-compressed BSON plus
+    the uncompressed ids, date range and search terms, so reads, searches and
+    deletes can find it without unpacking. Batches run at a bounded duty cycle and pause while ``is_busy``
+    reports pressure from live traffic. Only the worker holding the lease archives; it renews
+    the lease before every batch and stops if another worker has taken it over.
+    """
+
+    def __init__(
+        self,
+        db,
+        max_age_days: float,
+        batch_size: int = 500,
+        duty_cycle: float = 0.2,
+        interval: float = 3600.0,
+        is_busy: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.db = db
+        self.max_age = timedelta(days=max_age_days)
+        self.batch_size = batch_size
+        self.duty_cycle = duty_cycle
+        self.interval = interval
+        self.is_busy = is_busy or (lambda: False)
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def archive(self):
+        return self.db[ARCHIVE_COLLECTION]
+
+    def cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - self.max_age
+
+    def reaches_archive(self, since: Optional[datetime]) -> bool:
+        """Whether a read starting at ``since`` may need archived sessions"""
+        return since is None or as_utc(since) < self.cutoff()
+
+    async def ensure_indexes(self) -> None:
+        await self.archive.create_index([("kind", ASCENDING), ("user_id", ASCENDING), ("period_end", ASCENDING)])
+        await self.archive.create_index([("kind", ASCENDING), ("ids", ASCENDING)])
+        await self.archive.create_index([("kind", ASCENDING), ("user_id", ASCENDING), (TERMS_FIELD, ASCENDING)])
+        for collection in SESSION_KINDS.values():
+            await self.db[collection].create_index([("created_at", ASCENDING)])
+
+    # Reads
+
+    async def fetch_archived(
+        self,
+        kind: str,
+        user_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 1000,
+    ) -> List[Dict[str, Any]]:
+        """The newest ``limit`` archived sessions in the range, oldest first"""
+        since, until = as_naive_utc(since), as_naive_utc(until)
+        query: Dict[str, Any] = {"kind": kind, "user_id": user_id}
+        if since is not None:
+            query["period_end"] = {"$gte": since}
+        if until is not None:
+            query["period_start"] = {"$lte": until}
+        sessions: List[Dict[str, Any]] = []
+        # Buckets hold disjoint, ordered slices of the user's history, so unpack newest first until there are enough
+        async for bucket in self.archive.find(query, {"payload": 1}).sort("period_end", DESCENDING):
+            kept = []
+            for session in unpack_sessions(bucket["payload"]):
+                created_at = session.get("created_at")
+                if since is not None and created_at is not None and created_at < since:
+                    continue
+                if until is not None and created_at is not None and created_at > until:
+                    continue
+                session.pop(TERMS_FIELD, None)
+                kept.append(session)
+            sessions = kept + sessions
+            if len(sessions) >= limit:
+                break
+        return sessions[max(0, len(sessions) - limit):]
+
+    async def search_archived(
+        self,
+        kind: str,
+        user_id: str,
+        terms: List[str],
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500,
+    ) -> List[Dict[str, Any]]:
+        """Up to ``limit`` archived sessions indexed under any of ``terms``, newest first"""
+        if not terms:
+            return []
+        since, until = as_naive_utc(since), as_naive_utc(until)
+        query: Dict[str, Any] = {"kind": kind, "user_id": user_id, TERMS_FIELD: {"$in": terms}}
+        if since is not None:
+            query["period_end"] = {"$gte": since}
+        if until is not None:
+            query["period_start"] = {"$lte": until}
+        wanted = set(terms)
+        found: List[Dict[str, Any]] = []
+        # Buckets hold disjoint, ordered slices of the user's history, so newest buckets first
+        async for bucket in self.archive.find(query, {"payload": 1}).sort("period_end", DESCENDING):
+            matches = []
+            for session in unpack_sessions(bucket["payload"]):
+                created_at = session.get("created_at")
+                if since is not None and created_at is not None and created_at < since:
+                    continue
+                if until is not None and created_at is not None and created_at > until:
+                    continue
+                if wanted.intersection(session.pop(TERMS_FIELD, None) or ()):
+                    matches.append(session)
+            found += sorted(matches, key=lambda session: session.get("created_at") or datetime.min, reverse=True)
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
+    async def reindex_batch(
+        self, kind: str, terms_for: Callable[[List[Dict[str, Any]]], Awaitable[List[List[str]]]], limit: int = 50
+    ) -> int:
+        """Add search terms to up to ``limit`` buckets archived before search existed; returns how many"""
+        buckets = await self.archive.find({"kind": kind, TERMS_FIELD: {"$exists": False}}).limit(limit).to_list(limit)
+        for bucket in buckets:
+            sessions = unpack_sessions(bucket["payload"])
+            for session, terms in zip(sessions, await terms_for(sessions)):
+                session[TERMS_FIELD] = terms
+            await self.archive.update_one(
+                {"_id": bucket["_id"], "ids": bucket["ids"]},
+                {"$set": {"payload": pack_sessions(sessions), TERMS_FIELD: bucket_terms(sessions)}},
+            )
+        return len(buckets)
+
+    async def is_archived(self, kind: str, session_id: str) -> bool:
+        return await self.archive.find_one({"kind": kind, "ids": session_id}, {"_id": 1}) is not None
+
+    async def delete_archived(self, kind: str, user_id: str, session_id: str) -> bool:
+        """Remove one session from its bucket, returning False if it isn't archived"""
+        bucket = await self.archive.find_one({"kind": kind, "user_id": user_id, "ids": session_id})
+        if bucket is None:
+            return False
+        remaining = [s for s in unpack_sessions(bucket["payload"]) if s.get("id") != session_id]
+        if not remaining:
+            await self.archive.delete_one({"_id": bucket["_id"]})
+            return True
+        await self.archive.update_one(
+            {"_id": bucket["_id"]},
+            {"$set": {
+                "payload": pack_sessions(remaining),
+                "ids": [s.get("id") for s in remaining],
+                "count": len(remaining),
+                # Buckets not reindexed yet keep no terms, so the search backfill still finds them
+                **({TERMS_FIELD: bucket_terms(remaining)} if TERMS_FIELD in bucket else {}),
+            }},
+        )
+        return True
+
+    async def delete_user_batch(self, user_id: str, limit: int) -> int:
+        """Drop up to ``limit`` of the user's buckets, for account erasure; returns sessions removed"""
+        buckets = await self.archive.find({"user_id": user_id}, {"_id": 1, "count": 1}).limit(limit).to_list(limit)
+        if not buckets:
+            return 0
+        await self.archive.delete_many({"_id": {"$in": [bucket["_id"] for bucket in buckets]}})
+        return sum(bucket.get("count", 0) for bucket in buckets)
+
+    # Archival
+
+    async def archive_batch(self, kind: str, cutoff: datetime) -> int:
+        """Archive up to batch_size expired sessions, returning how many were moved"""
+        hot = self.db[SESSION_KINDS[kind]]
+        docs = await hot.find({"created_at": {"$lt": cutoff}}).sort("created_at", ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+        if not docs:
+            return 0
+
+        by_user: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for doc in docs:
+            by_user[doc.get("user_id", "anonymous")].append(doc)
+
+        writes = []
+        for user_id, sessions in by_user.items():
+            # Deterministic bucket id so re-running a batch after a crash overwrites instead of duplicating
+            bucket_id = f"{kind}:{user_id}:{sessions[0]['_id']}"
+            writes.append(ReplaceOne({"_id": bucket_id}, {
+                "_id": bucket_id,
+                "kind": kind,
+                "user_id": user_id,
+                "period_start": sessions[0]["created_at"],
+                "period_end": sessions[-1]["created_at"],
+                "count": len(sessions),
+                "ids": [s.get("id") for s in sessions],
+                TERMS_FIELD: bucket_terms(sessions),
+                "payload": pack_sessions([{k: v for k, v in s.items() if k != "_id"} for s in sessions]),
+            }, upsert=True))
+
+        await self.archive.bulk_write(writes, ordered=False)
+        await hot.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        return len(docs)
+
+    async def throttle(self, elapsed: float) -> None:
+        """Sleep so archival uses at most duty_cycle of wall time, and wait out busy periods"""
+        await asyncio.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+        while self.is_busy():
+            await asyncio.sleep(1.0)
+
+    async def run_once(self) -> Dict[str, int]:
+        cutoff = self.cutoff()
+        moved = {}
+        for kind in SESSION_KINDS:
+            moved[kind] = 0
+            while True:
+                # Renewed per batch, since a large backlog can take longer than the interval it was taken for
+                if not await self.acquire_lease():
+                    logger.warning("Archival lease taken over by another worker, stopping")
+                    return moved
+                started = time.monotonic()
+                count = await self.archive_batch(kind, cutoff)
+                moved[kind] += count
+                if count < self.batch_size:
+                    break
+                await self.throttle(time.monotonic() - started)
+        return moved
+
+    async def acquire_lease(self) -> bool:
+        """Hold the archival lease for one interval so only one worker archives"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db[STATE_COLLECTION].find_one_and_update(
+                {"_id": "archive_lease", "$or": [{"expires_at": {"$lt": now}}, {"owner": self.worker_id}]},
+                {"$set": {"owner": self.worker_id, "expires_at": now + timedelta(seconds=self.interval)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            return False
+        return True
+
+    async def run(self) -> None:
+        indexes_ready = False
+        while True:
+            try:
+                # Retried here so Mongo being unreachable at startup doesn't end the task
+                if not indexes_ready:
+                    await self.ensure_indexes()
+                    indexes_ready = True
+                if await self.acquire_lease():
+                    moved = await self.run_once()
+                    if any(moved.values()):
+                        logger.info(f"Archived sessions older than {self.max_age.days} days: {moved}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session archival failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,101 @@
+"""In-process dispatch of batched API sub-requests."""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from starlette.types import ASGIApp, Message, Scope
+
+logger = logging.getLogger(__name__)
+
+# Sub-requests that must not be nested in a batch
+EXCLUDED_PATHS = ("/api/batch", "/api/events")
+# Start-up reads only: writes belong behind idempotency keys and the access log
+ALLOWED_METHODS = ("GET",)
+
+
+async def dispatch(app: ASGIApp, parent_scope: Scope, method: str, target: str, body: Any = None) -> Dict[str, Any]:
+    """Run one sub-request through the router and return its status and decoded body"""
+    url = urlsplit(target)
+    payload = b"" if body is None else json.dumps(body).encode()
+    headers = [
+        (name, value) for name, value in parent_scope.get("headers", [])
+        if name not in (b"content-length", b"content-type", b"accept-encoding", b"idempotency-key")
+    ]
+    headers += [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    scope = {
+        **{k: v for k, v in parent_scope.items() if k in ("type", "asgi", "http_version", "scheme", "server", "client", "root_path", "app")},
+        "method": method,
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+    }
+
+    sent = False
+
+    async def receive() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        # Sub-requests never disconnect on their own; the batch cancels them on timeout
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    status = 500
+    content_type = ""
+    chunks: List[bytes] = []
+
+    async def send(message: Message) -> None:
+        nonlocal status, content_type
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                if name == b"content-type":
+                    content_type = value.decode()
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    raw = b"".join(chunks)
+    if content_type.startswith("application/json") and raw:
+        decoded: Any = json.loads(raw)
+    else:
+        decoded = raw.decode(errors="replace")
+    return {"status": status, "body": decoded}
+
+
+async def dispatch_batch(app: ASGIApp, parent_scope: Scope, requests: List[Dict[str, Any]], timeout: float) -> List[Dict[str, Any]]:
+    """Run sub-requests concurrently; any still running after ``timeout`` seconds get 504"""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+    tasks = {}
+    for index, sub in enumerate(requests):
+        method = sub["method"].upper()
+        path = urlsplit(sub["path"]).path
+        if method not in ALLOWED_METHODS:
+            results[index] = {"status": 405, "body": {"detail": "Method not allowed in batch"}}
+        elif not path.startswith("/api/") or path.rstrip("/") in EXCLUDED_PATHS:
+            results[index] = {"status": 400, "body": {"detail": "Path not allowed in batch"}}
+        else:
+            task = asyncio.ensure_future(dispatch(app, parent_scope, method, sub["path"], sub.get("body")))
+            tasks[task] = index
+
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+            results[tasks[task]] = {"status": 504, "body": {"detail": "Sub-request timed out"}}
+        for task in done:
+            error = task.exception()
+            if error is not None:
+                logger.error(f"Batch sub-request {requests[tasks[task]]['path']} failed: {str(error)}")
+                results[tasks[task]] = {"status": 500, "body": {"detail": "Internal Server Error"}}
+            else:
+                results[tasks[task]] = task.result()
+
+    return [
+        {"id": sub.get("id"), **result}
+        for sub, result in zip(requests, results)
+    ]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Cross-worker staleness window of the change-stream cache invalidation.
+Two independent clients stand in for two uvicorn workers: one writes,
+the other runs a ChangeStreamInvalidator, and we time write-ack -> eviction.
+
+Needs a replica set (change streams are not available on a standalone mongod):
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017 &
+    mongosh --eval 'rs.initiate()'
+    MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0 python benchmarks/bench_cache_staleness.py
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from cache import ChangeStreamInvalidator, LocalCache  # noqa: E402
+
+
+async def main(writes, db_name):
+    mongo_url = os.environ.get("MONGO_URL", "mongodb://localhost:27017/?replicaSet=rs0")
+    writer = AsyncIOMotorClient(mongo_url)[db_name]
+    reader = AsyncIOMotorClient(mongo_url)[db_name]
+
+    cache = LocalCache()
+    evicted = asyncio.Event()
+    invalidator = ChangeStreamInvalidator(reader, cache, on_invalidate=lambda ns, key: evicted.set())
+    invalidator.start()
+    while not cache.enabled:
+        await asyncio.sleep(0.05)
+
+    windows = []
+    user_id = f"bench-{uuid.uuid4()}"
+    for i in range(writes):
+        cache.set("cbt_sessions", user_id, ["stale"], cache.generation)
+        evicted.clear()
+        await writer.cbt_sessions.insert_one({"id": str(uuid.uuid4()), "user_id": user_id, "negative_thought": f"bench {i}"})
+        acked = time.perf_counter()
+        await asyncio.wait_for(evicted.wait(), timeout=5)
+        windows.append((time.perf_counter() - acked) * 1000)
+        assert cache.get("cbt_sessions", user_id) is None
+
+    await writer.cbt_sessions.delete_many({"user_id": user_id})
+    await invalidator.stop()
+
+    windows.sort()
+    print(f"staleness window over {writes} writes (ms): "
+          f"p50={statistics.median(windows):.2f} "
+          f"p95={windows[int(len(windows) * 0.95) - 1]:.2f} "
+          f"max={windows[-1]:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--db", default="serenity_bench")
+    args = parser.parse_args()
+    asyncio.run(main(args.writes, args.db))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Bytes-on-wire vs CPU trade-off for response compression levels.
+Builds payloads shaped like /api/articles and /api/cbt-sessions and
+compresses them at every gzip level and brotli quality.
+
+Usage: python benchmarks/bench_compression.py [--sessions 500]
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from compression import brotli  # noqa: E402
+
+PARAGRAPH = (
+    "Breathing is something we do automatically, but when we bring conscious attention "
+    "to our breath, it becomes a powerful tool for relaxation and stress relief. "
+)
+
+
+def articles_payload(count):
+    return json.dumps([
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Wellness Article {i}",
+            "content": PARAGRAPH * 4,
+            "category": ["Mindfulness", "Digital Wellbeing", "Wellness"][i % 3],
+            "author": "Serenity Team",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        for i in range(count)
+    ]).encode()
+
+
+def cbt_payload(count):
+    return json.dumps([
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": "anonymous",
+            "negative_thought": f"I'm going to fail presentation number {i}",
+            "questions_and_answers": [
+                {"question": "What evidence do I have against this thought?",
+                 "answer": "I've prepared well and succeeded in presentations before"}
+                for _ in range(6)
+            ],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        for i in range(count)
+    ]).encode()
+
+
+def measure(name, body, compress_fn, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        out = compress_fn(body)
+    cpu_ms = (time.process_time() - start) * 1000 / repeat
+    ratio = len(out) / len(body)
+    print(f"  {name:<12} {len(out):>10,d} B  {ratio:6.1%}  {cpu_ms:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = {
+        f"/api/articles ({args.articles})": articles_payload(args.articles),
+        f"/api/cbt-sessions ({args.sessions})": cbt_payload(args.sessions),
+    }
+    for route, body in payloads.items():
+        print(f"{route}: {len(body):,d} B uncompressed")
+        for level in range(1, 10):
+            measure(f"gzip-{level}", body, lambda b, l=level: gzip.compress(b, compresslevel=l), args.repeat)
+        if brotli is None:
+            print("  (brotli not installed, skipping br)")
+            continue
+        for quality in range(0, 12):
+            measure(f"br-{quality}", body, lambda b, q=quality: brotli.compress(b, quality=q),
+                    max(1, args.repeat // 4) if quality >= 10 else args.repeat)
+
+
+if __name__ == "__main__":
+    main()
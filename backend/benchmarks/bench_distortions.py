@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Distortion classification throughput by pool size.
+Fills SQLite storage with --sessions encrypted CBT sessions spread over 30 days and
+runs DistortionStats.compute over them with each of --workers processes,
+reporting sessions per second end to end (scan, decrypt, classify) and per core
+(sessions per CPU second inside each pool process).
+
+Usage: python benchmarks/bench_distortions.py [--sessions 200000 --workers 1,2,4]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from distortions import DistortionStats, classify_chunk  # noqa: E402
+from encryption import FieldCipher  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+THOUGHTS = [
+    "I always mess things up at work and everyone notices",
+    "Nobody replied to my message so they must be angry with me",
+    "I'm so stupid for forgetting the deadline",
+    "This is impossible, I can't do it",
+    "I feel useless when I can't help",
+    "The meeting went okay I suppose",
+]
+START = datetime(2026, 1, 1)
+DAYS = 30
+
+
+async def fill(storage, cipher, sessions):
+    docs = []
+    for i in range(sessions):
+        docs.append(await cipher.encrypt({
+            "id": str(uuid.uuid4()),
+            "user_id": f"u{i % 1000}",
+            "negative_thought": random.choice(THOUGHTS),
+            "questions_and_answers": [{"question": "What evidence supports this thought?", "answer": "Not much"}],
+            "created_at": START + timedelta(seconds=random.randrange(DAYS * 86400)),
+        }))
+    for doc in docs:
+        await storage.cbt_sessions.insert(doc)
+
+
+async def main(sessions, pool_sizes):
+    random.seed(11)
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    cipher = FieldCipher(os.urandom(32), storage.data_keys, ("negative_thought", "questions_and_answers"))
+    try:
+        await fill(storage, cipher, sessions)
+        print(f"{sessions} sessions over {DAYS} days")
+        print(f"{'workers':>8} {'end to end':>18} {'per core (mean)':>22}")
+        for workers in pool_sizes:
+            stats = DistortionStats(storage, cipher, workers=workers)
+            try:
+                # Start the pool processes first so their start-up is not timed
+                loop = asyncio.get_running_loop()
+                await asyncio.gather(*(loop.run_in_executor(stats.pool(), classify_chunk, []) for _ in range(workers)))
+                _, throughput = await stats.compute(START, START + timedelta(days=DAYS))
+            finally:
+                await stats.stop()
+            per_core = [w["sessions_per_cpu_second"] for w in throughput["workers"] if w["sessions_per_cpu_second"]]
+            print(
+                f"{workers:>8} {throughput['sessions_per_second']:>10,.0f} sess/s "
+                f"{sum(per_core) / len(per_core):>12,.0f} sess/cpu-s"
+            )
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200000)
+    parser.add_argument("--workers", default="1,2,4")
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, [int(n) for n in args.workers.split(",")]))
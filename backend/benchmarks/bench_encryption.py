@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Latency overhead of CBT field encryption on the CBT routes.
+Runs the app in process on SQLite storage twice, without and with
+DATA_ENCRYPTION_KEY, and times POST /api/cbt-sessions and
+GET /api/cbt-sessions for a user with --sessions sessions. The read cache is
+invalidated before every GET so each one decrypts the whole list (the cold
+path); a cached GET costs the same either way.
+
+Usage: python benchmarks/bench_encryption.py [--sessions 500 --iterations 200]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+SESSION = {
+    "negative_thought": "I always mess things up at work and everyone notices",
+    "questions_and_answers": [
+        {"question": "What evidence supports this thought?", "answer": "I missed a deadline last week"},
+        {"question": "What evidence contradicts it?", "answer": "My manager praised the last two projects"},
+        {"question": "What would you tell a friend?", "answer": "One slip does not define your work"},
+    ],
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def measure(sessions, iterations):
+    import httpx
+    import server
+
+    await server.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench") as client:
+            writes = []
+            for i in range(max(sessions, iterations)):
+                started = time.perf_counter()
+                response = await client.post("/api/cbt-sessions", json=SESSION)
+                writes.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+            reads = []
+            for _ in range(iterations):
+                server.cache.invalidate("cbt_sessions", "anonymous")
+                started = time.perf_counter()
+                response = await client.get("/api/cbt-sessions")
+                reads.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+            listed = len(response.json())
+    finally:
+        await server.app.router.shutdown()
+    return {
+        "write_p50": statistics.median(writes) * 1000,
+        "write_p95": percentile(writes, 0.95) * 1000,
+        "read_p50": statistics.median(reads) * 1000,
+        "read_p95": percentile(reads, 0.95) * 1000,
+        "listed": listed,
+    }
+
+
+def run_mode(encrypted, sessions, iterations):
+    env = {
+        **os.environ,
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+        "ACCESS_LOG_SAMPLE_RATE": "0",
+        "RATE_LIMIT_HIGH_RPS": "1000000",
+        "RATE_LIMIT_HIGH_BURST": "1000000",
+        "RATE_LIMIT_RPS": "1000000",
+        "RATE_LIMIT_BURST": "1000000",
+    }
+    env.pop("DATA_ENCRYPTION_KEY", None)
+    if encrypted:
+        env["DATA_ENCRYPTION_KEY"] = base64.urlsafe_b64encode(os.urandom(32)).decode()
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", "--sessions", str(sessions), "--iterations", str(iterations)],
+        env=env, cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(sessions, iterations):
+    plain = run_mode(False, sessions, iterations)
+    encrypted = run_mode(True, sessions, iterations)
+    print(f"{sessions} sessions listed per GET, {iterations} iterations")
+    print(f"{'':<26} {'plaintext':>10} {'encrypted':>10} {'overhead':>10}")
+    for label, key in (("POST /api/cbt-sessions p50", "write_p50"), ("POST /api/cbt-sessions p95", "write_p95"),
+                       ("GET /api/cbt-sessions p50", "read_p50"), ("GET /api/cbt-sessions p95", "read_p95")):
+        print(f"{label:<26} {plain[key]:>8.2f}ms {encrypted[key]:>8.2f}ms {encrypted[key] - plain[key]:>+8.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        import logging
+        logging.disable(logging.WARNING)
+        print(json.dumps(asyncio.run(measure(args.sessions, args.iterations))))
+    else:
+        main(args.sessions, args.iterations)
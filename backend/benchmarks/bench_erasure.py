@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Write latency for other users while a heavy user is erased.
+Fills SQLite storage with --sessions CBT sessions for one heavy user plus a few
+light users, then erases the heavy user twice (refilled in between): once with
+a single unbounded delete and once through AccountEraser's adaptive batches.
+A concurrent writer keeps saving sessions for a light user; its p50/p99/max
+latency during each erasure is reported with the erasure's wall time. (SQLite
+has one writer, so this is where a large delete is felt; WAL readers are not
+blocked. On MongoDB the same batching bounds load on the primary.)
+
+Usage: python benchmarks/bench_erasure.py [--sessions 100000]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from erasure import AccountEraser  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+
+async def fill(storage, user_id, sessions):
+    now = datetime.now(timezone.utc)
+    for i in range(sessions):
+        await storage.cbt_sessions.insert({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "negative_thought": f"I always get this wrong {i}",
+            "questions_and_answers": [],
+            "search_terms": ["always", "wrong"],
+            "created_at": now,
+        })
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def measure(storage, erase):
+    samples = []
+    done = asyncio.Event()
+
+    async def writer():
+        while not done.is_set():
+            started = time.perf_counter()
+            await fill(storage, "light-0", 1)
+            samples.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+
+    task = asyncio.create_task(writer())
+    started = time.perf_counter()
+    await erase()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    return elapsed, statistics.median(samples) * 1000, percentile(samples, 0.99) * 1000, max(samples) * 1000
+
+
+async def main(sessions):
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    try:
+        for i in range(5):
+            await fill(storage, f"light-{i}", 200)
+
+        async def unbounded():
+            await storage.cbt_sessions.delete_user_batch("heavy", sessions)
+
+        eraser = AccountEraser(storage, [("cbt_sessions", storage.cbt_sessions.delete_user_batch)])
+
+        async def batched():
+            await eraser.request("heavy")
+            await eraser.erase(await storage.erasures.claim(eraser.owner, 60))
+
+        print(f"{'erasure':>10} {'wall':>10} {'writer p50':>11} {'p99':>9} {'max':>9}")
+        for label, erase in (("unbounded", unbounded), ("batched", batched)):
+            await fill(storage, "heavy", sessions)
+            elapsed, p50, p99, worst = await measure(storage, erase)
+            print(f"{label:>10} {elapsed:>9.2f}s {p50:>9.2f}ms {p99:>7.2f}ms {worst:>7.2f}ms")
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions))
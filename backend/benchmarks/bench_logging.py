@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Latency cost of access logging under concurrent load.
+Drives a minimal FastAPI app in-process with httpx and compares:
+  none      - no access log
+  blocking  - a plain StreamHandler writing to a file on the event loop
+  queued    - AccessLogMiddleware + the QueueHandler/QueueListener pipeline
+
+Usage: python benchmarks/bench_logging.py [--requests 5000 --concurrency 50]
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import access_log  # noqa: E402
+
+
+def build_app(mode, sample_rate):
+    app = FastAPI()
+
+    @app.get("/api/cbt-sessions")
+    async def sessions(user_id: str = "anonymous"):
+        return [{"id": i, "user_id": user_id} for i in range(5)]
+
+    if mode != "none":
+        app.add_middleware(access_log.AccessLogMiddleware, sample_rate=sample_rate)
+    return app
+
+
+async def drive(app, total, concurrency):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(n):
+            for i in range(n):
+                started = time.perf_counter()
+                await client.get("/api/cbt-sessions", params={"user_id": f"user-{i % 100}"})
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(total // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return elapsed, latencies
+
+
+def configure(mode, log_file):
+    root = logging.getLogger()
+    root.handlers[:] = []
+    if mode == "blocking":
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(access_log.JsonFormatter())
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        return None
+    if mode == "queued":
+        listener = access_log.configure_logging(logging.INFO)
+        listener.handlers[0].setStream(open(log_file, "a"))
+        return listener
+    root.setLevel(logging.WARNING)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("none", "blocking", "queued"):
+            listener = configure(mode, Path(tmp) / f"{mode}.log")
+            app = build_app("none" if mode == "none" else "log", args.sample_rate)
+            elapsed, latencies = asyncio.run(drive(app, args.requests, args.concurrency))
+            if listener is not None:
+                listener.stop()
+            print(f"{mode:<9} {len(latencies) / elapsed:8.0f} req/s  "
+                  f"mean={statistics.mean(latencies):6.2f} ms  "
+                  f"p99={latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Cohort mood trend computation as preference history grows.
+Builds --sizes synthetic mood reports (one user per 20 reports, a year of history)
+plus as many zen and CBT sessions, and times cohort_trends on the arrays. With
+--storage-rows, also loads that many reports through the SQLite scan
+(MoodEvents.load) to time the chunked read that feeds it.
+
+Usage: python benchmarks/bench_moods.py [--sizes 100000,1000000,5000000 --storage-rows 200000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from moods import USAGE_FEATURES, MoodEvents, cohort_trends  # noqa: E402
+from recommendations import MOODS  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+YEAR = 365 * 86400
+START = int(datetime(2025, 1, 1).timestamp())
+
+
+def synthetic(size, rng):
+    n_users = max(1, size // 20)
+    users = rng.integers(0, n_users, size).astype(np.int32)
+    times = START + rng.integers(0, YEAR, size)
+    order = np.lexsort((times, users))
+    events = MoodEvents([str(i) for i in range(n_users)], users[order], times[order], rng.integers(0, len(MOODS), size).astype(np.int8))
+    usage = {feature: (rng.integers(0, n_users, size).astype(np.int32), START + rng.integers(0, YEAR, size)) for feature in USAGE_FEATURES}
+    return events, usage
+
+
+async def load_rate(rows, rng):
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    try:
+        start = datetime(2025, 1, 1)
+        for i in range(rows):
+            await storage.preferences.insert({
+                "id": str(uuid.uuid4()), "user_id": f"u{rng.integers(0, max(1, rows // 20))}", "identity": "Student",
+                "current_mood": MOODS[rng.integers(0, len(MOODS))], "mood_frequency": "This week", "theme_colors": {},
+                "created_at": start + timedelta(seconds=int(rng.integers(0, YEAR))),
+            })
+        started = time.perf_counter()
+        events = await MoodEvents.load(storage.preferences)
+        return events.times.size / (time.perf_counter() - started)
+    finally:
+        await storage.close()
+
+
+def main(sizes, storage_rows):
+    rng = np.random.default_rng(3)
+    print(f"{'reports':>10} {'users':>8} {'cohort_trends':>14} {'reports/s':>14}")
+    for size in sizes:
+        events, usage = synthetic(size, rng)
+        started = time.perf_counter()
+        trends = cohort_trends(events, usage)
+        elapsed = time.perf_counter() - started
+        print(f"{size:>10} {trends['users']:>8} {elapsed * 1000:>12.0f}ms {size / elapsed:>14,.0f}")
+    if storage_rows:
+        print(f"SQLite scan of {storage_rows} reports: {asyncio.run(load_rate(storage_rows, rng)):,.0f} reports/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000,5000000")
+    parser.add_argument("--storage-rows", type=int, default=0)
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes.split(",")], args.storage_rows)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Throughput cost of the on-demand sampling profiler.
+Drives GET /api/ in process on SQLite storage with --concurrency clients and
+compares requests per second with no profile running against a profile of
+the event-loop thread at each --intervals (milliseconds), taken through
+GET /api/admin/profile exactly as an operator would.
+
+Usage: python benchmarks/bench_profiler.py [--seconds 3 --concurrency 20 --intervals 1,5,20 --rounds 3]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+ADMIN_TOKEN = "bench"
+
+
+async def load(client, seconds, concurrency):
+    """Successful requests per second, and how many were shed with a 503"""
+    deadline = time.perf_counter() + seconds
+    done = shed = 0
+
+    async def worker():
+        nonlocal done, shed
+        while time.perf_counter() < deadline:
+            response = await client.get("/api/")
+            if response.status_code == 503:
+                shed += 1
+                continue
+            assert response.status_code == 200, response.text
+            done += 1
+            # The in-process transport never suspends on its own; let the other clients in
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done / (time.perf_counter() - started), shed
+
+
+async def profiled(client, seconds, concurrency, interval_ms):
+    profile = asyncio.create_task(client.get(
+        "/api/admin/profile",
+        params={"seconds": seconds, "interval_ms": interval_ms},
+        headers={"X-Admin-Token": ADMIN_TOKEN},
+    ))
+    rate, shed = await load(client, seconds, concurrency)
+    response = await profile
+    assert response.status_code == 200, response.text
+    return rate, shed, len(response.text.splitlines())
+
+
+async def main(seconds, concurrency, intervals, rounds):
+    import httpx
+    import server
+
+    await server.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench", timeout=None) as client:
+            await load(client, 0.5, concurrency)
+            print(f"{'profile':>14} {'requests/s':>12} {'overhead':>9} {'shed':>6} {'stacks':>7}  (median of {rounds})")
+            for interval_ms in intervals:
+                # Alternate plain and profiled runs so drift on the machine hits both alike
+                plain, runs = [], []
+                for _ in range(rounds):
+                    plain.append((await load(client, seconds, concurrency))[0])
+                    runs.append(await profiled(client, seconds, concurrency, interval_ms))
+                baseline = statistics.median(plain)
+                rate = statistics.median(run[0] for run in runs)
+                shed = sum(run[1] for run in runs)
+                stacks = statistics.median(run[2] for run in runs)
+                print(f"{'none':>14} {baseline:>12,.0f}")
+                print(f"{f'every {interval_ms:g}ms':>14} {rate:>12,.0f} {1 - rate / baseline:>8.1%} {shed:>6} {stacks:>7.0f}")
+    finally:
+        await server.app.router.shutdown()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--intervals", default="1,5,20")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+    os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+    os.environ.setdefault("ACCESS_LOG_SAMPLE_RATE", "0")
+    os.environ.setdefault("ADMIN_TOKEN", ADMIN_TOKEN)
+    for name in ("RATE_LIMIT_RPS", "RATE_LIMIT_BURST", "RATE_LIMIT_HIGH_RPS", "RATE_LIMIT_HIGH_BURST"):
+        os.environ.setdefault(name, "1000000")
+    # The clients share the server's event loop, so loop lag here is the load generator's own
+    for name in ("SHED_LAG_SOFT_MS", "SHED_LAG_HARD_MS"):
+        os.environ.setdefault(name, "1000000")
+    import logging
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args.seconds, args.concurrency, [float(ms) for ms in args.intervals.split(",")], args.rounds))
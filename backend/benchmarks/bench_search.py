@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Journal search latency as a user's journal grows.
+Fills one user's CBT journal on SQLite storage with encrypted, indexed sessions
+(--sizes, e.g. 100,1000,10000) and times JournalSearch.search for a rare word,
+a common word and a two-word query. Latency should track the number of matches,
+capped at max_candidates, not the journal length.
+
+Usage: python benchmarks/bench_search.py [--sizes 100,1000,10000 --iterations 200]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from encryption import FieldCipher  # noqa: E402
+from search import JournalSearch  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+THOUGHTS = [
+    "I always mess things up at work and everyone notices",
+    "Nobody replied to my message so they must be angry with me",
+    "I will never be good enough at this",
+    "My friends are probably tired of me",
+    "I should have done better in the meeting",
+]
+ANSWERS = [
+    "I missed a deadline last week",
+    "My manager praised the last two projects",
+    "One slip does not define me",
+    "They were busy, it is not about me",
+]
+QUERIES = {
+    # the same 10 sessions at every journal size
+    "rare": "exam",
+    # a fifth of all sessions, so capped at max_candidates
+    "common": "work",
+    "two words": "exam results",
+}
+
+
+def journal(size):
+    now = datetime.now(timezone.utc)
+    rare = set(random.sample(range(size), 10))
+    for i in range(size):
+        thought = random.choice(THOUGHTS)
+        if i in rare:
+            thought = "I am going to fail the exam and the results will show it"
+        yield {
+            "id": str(uuid.uuid4()),
+            "user_id": "bench",
+            "negative_thought": thought,
+            "questions_and_answers": [
+                {"question": "What evidence supports this thought?", "answer": random.choice(ANSWERS)},
+                {"question": "What would you tell a friend?", "answer": random.choice(ANSWERS)},
+            ],
+            "created_at": now - timedelta(minutes=size - i),
+        }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def measure(size, iterations):
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    try:
+        cipher = FieldCipher(os.urandom(32), storage.data_keys, ("negative_thought", "questions_and_answers"))
+        search = JournalSearch(storage, cipher)
+        for doc in journal(size):
+            await storage.cbt_sessions.insert(await cipher.encrypt(await search.index(doc)))
+        results = {}
+        for label, query in QUERIES.items():
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                await search.search("bench", query)
+                samples.append(time.perf_counter() - started)
+            results[label] = (statistics.median(samples) * 1000, percentile(samples, 0.99) * 1000)
+        return results
+    finally:
+        await storage.close()
+
+
+async def main(sizes, iterations):
+    random.seed(7)
+    print(f"{'journal size':>12} " + " ".join(f"{label + ' p50/p99':>22}" for label in QUERIES))
+    for size in sizes:
+        results = await measure(size, iterations)
+        print(f"{size:>12} " + " ".join(f"{p50:>9.2f}ms/{p99:>8.2f}ms" for p50, p99 in results.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main([int(size) for size in args.sizes.split(",")], args.iterations))
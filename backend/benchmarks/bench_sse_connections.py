@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Memory per idle SSE connection and fan-out latency of the EventHub.
+Opens N in-process subscribers (the same generator /api/events serves),
+measures allocated bytes per connection, then times one heartbeat sweep
+and one publish to every user.
+
+Usage: python benchmarks/bench_sse_connections.py [--connections 10000]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from events import HEARTBEAT, EventHub  # noqa: E402
+
+
+class NullCollection:
+    """Stands in for user_events; persistence is not what is being measured"""
+
+    async def insert_one(self, document):
+        return None
+
+
+class NullDB:
+    def __getitem__(self, name):
+        return NullCollection()
+
+
+async def consume(hub, user_id, received):
+    async for chunk in hub.stream(user_id):
+        received[0] += 1
+
+
+async def main(connections):
+    hub = EventHub(NullDB(), heartbeat_interval=3600)
+    received = [0]
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tasks = [asyncio.create_task(consume(hub, f"user-{i}", received)) for i in range(connections)]
+    while received[0] < connections:  # every stream has sent its retry: preamble
+        await asyncio.sleep(0.01)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{hub.connection_count:,d} idle connections: {(after - before) / connections:,.0f} B/connection "
+          f"({(after - before) / 2**20:.1f} MiB total)")
+
+    received[0] = 0
+    started = time.perf_counter()
+    for queues in hub.subscribers.values():
+        for queue in queues:
+            queue.put_nowait(HEARTBEAT)
+    while received[0] < connections:
+        await asyncio.sleep(0)
+    print(f"heartbeat sweep: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    received[0] = 0
+    started = time.perf_counter()
+    for i in range(connections):
+        await hub.publish(f"user-{i}", "summary", {"feature": "zen", "action": "complete", "duration": 300})
+    while received[0] < connections:
+        await asyncio.sleep(0)
+    print(f"publish + deliver to {connections:,d} users: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(main(args.connections))
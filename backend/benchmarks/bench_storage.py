@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency of the real API under each storage backend.
+Virtual users replay the app's endpoint mix (start-up reads, session and
+favorite writes, analytics events, the summary) against the FastAPI app in
+process over httpx's ASGI transport, so HTTP parsing and the network are
+excluded but middleware, handlers, caching and storage are not.
+
+One backend per run, since server.py picks its backend at import time:
+
+Usage: python benchmarks/bench_storage.py --backend sqlite [--users 50 --seconds 10]
+       MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_storage.py --backend mongo
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# (weight, method, path) with {user} substituted per virtual user
+MIX = [
+    (20, "GET", "/api/articles"),
+    (15, "GET", "/api/favorites?user_id={user}"),
+    (15, "GET", "/api/cbt-sessions?user_id={user}"),
+    (10, "GET", "/api/zen-sessions?user_id={user}"),
+    (10, "GET", "/api/analytics/summary?user_id={user}"),
+    (15, "POST", "/api/analytics?user_id={user}"),
+    (5, "POST", "/api/cbt-sessions"),
+    (5, "POST", "/api/zen-sessions"),
+    (5, "POST", "/api/favorites?user_id={user}&article_id={article}"),
+]
+
+BODIES = {
+    "/api/analytics": {"feature": "zen", "action": "complete", "duration": 300},
+    "/api/cbt-sessions": {
+        "negative_thought": "I am not good enough",
+        "questions_and_answers": [{"question": "What evidence supports this?", "answer": "Very little"}],
+    },
+    "/api/zen-sessions": {"session_type": "breathing", "duration": 5},
+}
+
+
+async def virtual_user(client, deadline, article_ids, latencies, errors):
+    user = f"bench-{uuid.uuid4().hex[:8]}"
+    weights = [weight for weight, _, _ in MIX]
+    while time.perf_counter() < deadline:
+        _, method, template = random.choices(MIX, weights)[0]
+        path = template.format(user=user, article=random.choice(article_ids))
+        route = template.split("?")[0]
+        started = time.perf_counter()
+        response = await client.request(method, path, json=BODIES.get(route) if method == "POST" else None)
+        latencies[f"{method} {route}"].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[f"{method} {route} {response.status_code}"] += 1
+
+
+async def main(users, seconds):
+    import httpx
+    import server
+
+    await server.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench") as client:
+            article_ids = [article["id"] for article in (await client.get("/api/articles")).json()]
+            latencies = defaultdict(list)
+            errors = defaultdict(int)
+            started = time.perf_counter()
+            deadline = started + seconds
+            await asyncio.gather(*(virtual_user(client, deadline, article_ids, latencies, errors) for _ in range(users)))
+            elapsed = time.perf_counter() - started
+            cache_enabled = server.cache.enabled
+    finally:
+        await server.app.router.shutdown()
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"backend={server.STORAGE_BACKEND} users={users} cache={'on' if cache_enabled else 'off'}")
+    print(f"{total:,d} requests in {elapsed:.1f} s: {total / elapsed:,.0f} req/s")
+    print(f"{'endpoint':<30} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, samples in sorted(latencies.items()):
+        samples.sort()
+        p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+        p99 = samples[int(len(samples) * 0.99) - 1] if len(samples) >= 100 else samples[-1]
+        print(f"{endpoint:<30} {len(samples):>7,d} {statistics.median(samples) * 1000:>8.2f} "
+              f"{p95 * 1000:>8.2f} {p99 * 1000:>8.2f}")
+    for error, count in sorted(errors.items()):
+        print(f"errors: {error} x{count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=("sqlite", "mongo"), default="sqlite")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--sqlite-path", help="defaults to a fresh temporary file")
+    args = parser.parse_args()
+
+    os.environ["STORAGE_BACKEND"] = args.backend
+    # Admission control would shed the synthetic load; measure storage, not the limiter
+    for limit in ("RATE_LIMIT_RPS", "RATE_LIMIT_LOW_RPS", "RATE_LIMIT_HIGH_RPS", "RATE_LIMIT_BURST",
+                  "RATE_LIMIT_LOW_BURST", "RATE_LIMIT_HIGH_BURST", "MAX_CONCURRENT_REQUESTS",
+                  "SHED_LAG_SOFT_MS", "SHED_LAG_HARD_MS", "SHED_POOL_WAIT_SOFT", "SHED_POOL_WAIT_HARD"):
+        os.environ.setdefault(limit, "1000000")
+    os.environ.setdefault("ACCESS_LOG_SAMPLE_RATE", "0")
+    os.environ.setdefault("ARCHIVE_ENABLED", "false")
+    if args.backend == "sqlite":
+        os.environ["SQLITE_PATH"] = args.sqlite_path or os.path.join(tempfile.mkdtemp(), "bench.db")
+    elif "MONGO_URL" not in os.environ:
+        sys.exit("MONGO_URL is required for --backend mongo")
+    else:
+        os.environ.setdefault("DB_NAME", f"bench_{uuid.uuid4().hex[:8]}")
+    asyncio.run(main(args.users, args.seconds))
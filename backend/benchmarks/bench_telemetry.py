@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Breathing telemetry ingestion throughput on one connection.
+Streams --samples synthetic 4-7-8 samples as NDJSON batches of each --batch-sizes
+to POST /api/zen-sessions/{id}/telemetry, in process on SQLite storage, and
+reports samples per second end to end (parse, reduce, checkpoint, save). The
+reducer alone is timed on the same batches for comparison.
+
+Usage: python benchmarks/bench_telemetry.py [--samples 200000 --batch-sizes 50,500,5000]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+PATTERN_478 = (4, 7, 8, 2)
+HZ = 50
+
+
+def synthetic(samples):
+    """``samples`` readings at 50 Hz cycling through the 4-7-8 phases, with a noisy sine signal"""
+    t = np.arange(samples) * 1000 / HZ
+    cycle = sum(PATTERN_478) * 1000
+    bounds = np.cumsum(PATTERN_478) * 1000
+    phase = np.searchsorted(bounds, t % cycle, side="right")
+    value = np.sin(2 * np.pi * t / cycle) + np.random.default_rng(0).normal(0, 0.05, samples)
+    return t, phase, value
+
+
+def lines(samples, batch_size):
+    t, phase, value = synthetic(samples)
+    return [
+        (json.dumps({
+            "t": t[i:i + batch_size].tolist(),
+            "phase": phase[i:i + batch_size].tolist(),
+            "value": np.round(value[i:i + batch_size], 4).tolist(),
+        }) + "\n").encode()
+        for i in range(0, samples, batch_size)
+    ]
+
+
+def reducer_rate(body):
+    from telemetry import BreathTelemetry
+
+    telemetry = BreathTelemetry("478")
+    started = time.perf_counter()
+    for line in body:
+        telemetry.add(json.loads(line))
+    telemetry.to_document()
+    return telemetry.samples / (time.perf_counter() - started)
+
+
+async def endpoint_rate(client, body):
+    created = await client.post("/api/zen-sessions", json={"session_type": "breathing", "duration": 5, "completed": False})
+    session_id = created.json()["id"]
+
+    async def stream():
+        for line in body:
+            yield line
+
+    started = time.perf_counter()
+    response = await client.post(f"/api/zen-sessions/{session_id}/telemetry", content=stream())
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response.text
+    return response.json()["samples"] / elapsed, response.json()["summary"]
+
+
+async def main(samples, batch_sizes):
+    import httpx
+    import server
+
+    await server.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench") as client:
+            print(f"{samples} samples at {HZ} Hz ({samples / HZ / 60:.0f} minutes of breathing) per stream")
+            print(f"{'batch size':>10} {'endpoint':>16} {'reducer only':>16}")
+            for batch_size in batch_sizes:
+                body = lines(samples, batch_size)
+                rate, summary = await endpoint_rate(client, body)
+                print(f"{batch_size:>10} {rate:>10,.0f} samples/s {reducer_rate(body):>10,.0f} samples/s")
+            print(f"summary: {summary}")
+    finally:
+        await server.app.router.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=200000)
+    parser.add_argument("--batch-sizes", default="50,500,5000")
+    args = parser.parse_args()
+    os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+    os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+    os.environ.setdefault("ACCESS_LOG_SAMPLE_RATE", "0")
+    for name in ("RATE_LIMIT_RPS", "RATE_LIMIT_BURST", "RATE_LIMIT_HIGH_RPS", "RATE_LIMIT_HIGH_BURST"):
+        os.environ.setdefault(name, "1000000")
+    import logging
+    logging.disable(logging.WARNING)
+    asyncio.run(main(args.samples, [int(size) for size in args.batch_sizes.split(",")]))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Per-request CPU and allocation cost of the POST write paths, before and after
+validating once. "before" reproduces the old handler bodies
+(input.dict() -> Model(**kwargs) -> .dict()), "after" calls the same steps the
+handlers now use (new_document + model_construct). Both include input
+validation and FastAPI's response validation/serialization; the Mongo insert
+is excluded.
+
+Usage: python benchmarks/bench_write_path.py [--iterations 20000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+from pydantic import TypeAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "serenity_bench")
+import server  # noqa: E402
+
+warnings.simplefilter("ignore", DeprecationWarning)
+
+QA = [{"question": f"Question {i}?", "answer": "A considered, balanced answer to the question."} for i in range(6)]
+
+ROUTES = {
+    "/api/preferences": (
+        server.UserPreferencesCreate, server.UserPreferences,
+        {"identity": "Student", "current_mood": "Anxious", "mood_frequency": "This week"},
+        lambda inp: {"theme_colors": server.generate_theme_colors(inp.current_mood, inp.identity)},
+    ),
+    "/api/cbt-sessions": (
+        server.CBTSessionCreate, server.CBTSession,
+        {"negative_thought": "I'm going to fail this presentation", "questions_and_answers": QA},
+        lambda inp: {"user_id": "anonymous"},
+    ),
+    "/api/zen-sessions": (
+        server.ZenSessionCreate, server.ZenSession,
+        {"session_type": "breathing", "duration": 10, "completed": True},
+        lambda inp: {"user_id": "anonymous"},
+    ),
+    "/api/analytics": (
+        server.UsageAnalyticsCreate, server.UsageAnalytics,
+        {"feature": "zen", "action": "complete", "duration": 300, "metadata": {"source": "bench"}},
+        lambda inp: {"user_id": "user-1"},
+    ),
+}
+
+
+def before(create_model, model, payload, extra):
+    inp = create_model(**payload)
+    fields = inp.dict()
+    fields.update(extra(inp))
+    obj = model(**fields)
+    doc = obj.dict()
+    return obj, doc
+
+
+def after(create_model, model, payload, extra):
+    inp = create_model(**payload)
+    doc = server.new_document(**extra(inp), **inp.model_dump())
+    obj = model.model_construct(**doc)
+    return obj, doc
+
+
+def run(path_fn, route, iterations):
+    create_model, model, payload, extra = route
+    adapter = TypeAdapter(model)
+
+    def request():
+        obj, doc = path_fn(create_model, model, payload, extra)
+        # What FastAPI does with the returned object for response_model
+        return adapter.dump_json(adapter.validate_python(obj))
+
+    for _ in range(200):
+        request()
+    started = time.process_time()
+    for _ in range(iterations):
+        request()
+    cpu_us = (time.process_time() - started) * 1e6 / iterations
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_us, peak - base
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'route':<20} {'before':>18} {'after':>18} {'speedup':>8}")
+    for name, route in ROUTES.items():
+        b_cpu, b_mem = run(before, route, args.iterations)
+        a_cpu, a_mem = run(after, route, args.iterations)
+        print(f"{name:<20} {b_cpu:7.1f} us {b_mem:6d} B {a_cpu:7.1f} us {a_mem:6d} B {b_cpu / a_cpu:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""In-process read cache kept coherent across workers by Mongo change streams."""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Collection name -> cache namespaces it feeds
+WATCHED_COLLECTIONS = {
+    "articles": ("articles",),
+    "favorite_articles": ("favorites",),
+    # The mood timeline correlates moods with session usage
+    "cbt_sessions": ("cbt_sessions", "mood_timeline"),
+    "zen_sessions": ("zen_sessions", "mood_timeline"),
+    "session_archive": ("cbt_sessions", "zen_sessions", "mood_timeline"),
+    "user_preferences": ("mood_timeline",),
+    "mood_trends": ("mood_trends",),
+}
+
+# Server error codes that mean change streams cannot be used or resumed
+CHANGE_STREAMS_UNSUPPORTED = 40573  # not a replica set
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+class LocalCache:
+    """Namespaced key/value cache with a TTL safety net.
+
+    Entries are only served while ``enabled`` is set, which the change-stream
+    listener does once it is watching; without a stream every read goes to Mongo.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = False
+        self._entries: Dict[Tuple[str, Hashable], Tuple[float, Any]] = {}
+        # Bumped on every invalidation so a read that raced a write can't cache stale data
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace: str, key: Hashable = None) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get((namespace, key))
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, namespace: str, key: Hashable, value: Any, generation: int) -> None:
+        """Store a value read while ``generation`` was current"""
+        if not self.enabled or generation != self.generation:
+            return
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries[(namespace, key)] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, namespace: str, key: Hashable = None) -> None:
+        """Drop one key, or the whole namespace when key is None"""
+        self.generation += 1
+        if key is not None:
+            self._entries.pop((namespace, key), None)
+            return
+        for entry_key in [k for k in self._entries if k[0] == namespace]:
+            del self._entries[entry_key]
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+
+class ChangeStreamInvalidator:
+    """Watch the cached collections and evict affected entries on every change.
+
+    The last resume token is kept so a dropped connection resumes exactly where
+    it left off; if the oplog no longer has that point the cache is cleared.
+    Other components can share the stream through ``add_listener``, which
+    receives the full document of every change to that collection, and
+    ``on_write``, which gets the owner (user_id, else the collection name) and
+    cluster time of every change to a cached collection.
+    """
+
+    def __init__(
+        self,
+        db,
+        cache: LocalCache,
+        collections: Dict[str, Tuple[str, ...]] = WATCHED_COLLECTIONS,
+        retry_delay: float = 1.0,
+        on_invalidate: Optional[Callable[[str, Optional[str]], None]] = None,
+        on_write: Optional[Callable[[str, Any], None]] = None,
+    ) -> None:
+        self.db = db
+        self.cache = cache
+        self.collections = collections
+        self.retry_delay = retry_delay
+        self.on_invalidate = on_invalidate
+        self.on_write = on_write
+        self.listeners: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self.resume_token: Optional[Dict[str, Any]] = None
+        self.events = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def add_listener(self, collection: str, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Register a callback for changes to ``collection``; call before start()"""
+        self.listeners.setdefault(collection, []).append(callback)
+
+    def pipeline(self):
+        watched = sorted(set(self.collections) | set(self.listeners))
+        full_documents = sorted(self.listeners)
+        return [
+            {"$match": {"ns.coll": {"$in": watched}}},
+            # Cache invalidation only needs the owner, listeners get the whole document
+            {"$project": {"ns": 1, "operationType": 1, "clusterTime": 1, "fullDocument": {"$cond": [
+                {"$in": ["$ns.coll", full_documents]},
+                "$fullDocument",
+                {"user_id": "$fullDocument.user_id"},
+            ]}}},
+        ]
+
+    def handle(self, change: Dict[str, Any]) -> None:
+        collection = change.get("ns", {}).get("coll")
+        for callback in self.listeners.get(collection, ()):
+            try:
+                callback(change)
+            except Exception as e:
+                logger.error(f"Change stream listener failed: {str(e)}")
+        namespaces = self.collections.get(collection)
+        if namespaces is None:
+            return
+        self.events += 1
+        # Inserts/replaces carry the owner; updates and deletes only carry _id,
+        # so the whole namespace is dropped for those.
+        user_id = (change.get("fullDocument") or {}).get("user_id")
+        # Before evicting, so a read that misses the cache already waits for this write
+        if self.on_write is not None and change.get("clusterTime") is not None:
+            self.on_write(user_id or collection, change["clusterTime"])
+        for namespace in namespaces:
+            key = None if namespace == "articles" else user_id
+            self.cache.invalidate(namespace, key)
+            if self.on_invalidate is not None:
+                self.on_invalidate(namespace, key)
+
+    async def _watch(self) -> None:
+        async with self.db.watch(self.pipeline(), resume_after=self.resume_token) as stream:
+            if self.resume_token is None:
+                # Without a resume point anything cached earlier may already be stale
+                self.cache.clear()
+            else:
+                # Replay changes missed while disconnected before serving from cache again
+                while (change := await stream.try_next()) is not None:
+                    self.handle(change)
+                    self.resume_token = stream.resume_token
+            self.resume_token = stream.resume_token
+            self.cache.enabled = True
+            logger.info("Cache invalidation change stream started")
+            async for change in stream:
+                self.handle(change)
+                self.resume_token = stream.resume_token
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                self.cache.enabled = False
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams unavailable (not a replica set), in-process cache disabled")
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("Resume token no longer in oplog, restarting change stream from now")
+                    self.resume_token = None
+                else:
+                    logger.error(f"Change stream failed: {str(e)}")
+            except PyMongoError as e:
+                self.cache.enabled = False
+                logger.error(f"Change stream disconnected: {str(e)}")
+            await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        self.cache.enabled = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
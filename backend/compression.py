@@ -0,0 +1,158 @@
+"""Response compression middleware with per-route gzip/brotli negotiation."""
+import gzip
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Content types that are already compressed or must not be buffered
+SKIP_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/octet-stream",
+    "text/event-stream",
+)
+
+
+@dataclass(frozen=True)
+class CompressionPolicy:
+    enabled: bool = True
+    minimum_size: int = 1024  # bytes, smaller bodies are sent as-is
+    gzip_level: int = 6
+    brotli_quality: int = 4
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {coding: q}"""
+    codings: Dict[str, float] = {}
+    for part in header.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """Pick the best supported coding for a request, preferring brotli on ties"""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    candidates: List[Tuple[float, int, str]] = []
+    if brotli is not None:
+        candidates.append((codings.get("br", wildcard), 1, "br"))
+    candidates.append((codings.get("gzip", wildcard), 0, "gzip"))
+    q, _, coding = max(candidates)
+    return coding if q > 0 else None
+
+
+def compress(body: bytes, encoding: str, policy: CompressionPolicy) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=policy.brotli_quality)
+    return gzip.compress(body, compresslevel=policy.gzip_level)
+
+
+class CompressionMiddleware:
+    """Compress complete (non-streaming) responses according to Accept-Encoding.
+
+    ``routes`` maps a path prefix to a CompressionPolicy; the longest matching
+    prefix wins and everything else uses ``default``.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        default: CompressionPolicy = CompressionPolicy(),
+        routes: Optional[Dict[str, CompressionPolicy]] = None,
+    ) -> None:
+        self.app = app
+        self.default = default
+        # Longest prefix first so the most specific route wins
+        self.routes = sorted((routes or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def policy_for(self, path: str) -> CompressionPolicy:
+        for prefix, policy in self.routes:
+            if path.startswith(prefix):
+                return policy
+        return self.default
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = self.policy_for(scope["path"])
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not policy.enabled or encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self.app, policy, encoding)
+        await responder(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, policy: CompressionPolicy, encoding: str) -> None:
+        self.app = app
+        self.policy = policy
+        self.encoding = encoding
+        self.send: Send = None
+        self.start_message: Optional[Message] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # Hold the start message until we know whether the body gets compressed
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or content_type.startswith(SKIP_CONTENT_TYPES)
+            )
+            return
+
+        if message["type"] != "http.response.body" or self.start_message is None:
+            await self.send(message)
+            return
+
+        start, self.start_message = self.start_message, None
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        # Streaming responses and small bodies go out untouched
+        if self.passthrough or more_body or len(body) < self.policy.minimum_size:
+            await self.send(start)
+            await self.send(message)
+            self.passthrough = True
+            return
+
+        compressed = compress(body, self.encoding, self.policy)
+        headers = MutableHeaders(raw=start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers["Content-Length"] = str(len(compressed))
+        headers.add_vary_header("Accept-Encoding")
+        await self.send(start)
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": False})
@@ -0,0 +1,256 @@
+"""Cognitive-distortion classification of CBT thoughts and corpus-wide daily counts."""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from pymongo import ASCENDING, DeleteMany, ReadPreference, UpdateOne
+
+from reports import STATE_COLLECTION, day_start
+
+logger = logging.getLogger(__name__)
+
+STATS_COLLECTION = "distortion_stats"
+STATE_ID = "distortions"
+
+# The keyword rules behind the dynamic CBT questions, in the order they are tried there
+RULES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("fear_of_failure", ("fail", "failure")),
+    ("all_or_nothing", ("never", "always")),
+    ("labeling", ("stupid", "dumb", "idiot")),
+    ("self_hatred", ("hate", "terrible", "awful")),
+    ("worthlessness", ("worthless", "useless", "waste")),
+    ("helplessness", ("can't", "impossible", "too hard")),
+    ("loneliness", ("alone", "nobody", "no one")),
+)
+UNCLASSIFIED = "unclassified"
+CATEGORIES = tuple(category for category, _ in RULES) + (UNCLASSIFIED,)
+
+STATS_COLUMNS = ["day", "category", "sessions"]
+
+# (day, thought) pairs in; counts, sessions, worker pid and CPU seconds out
+Counts = Dict[str, Dict[str, int]]
+ChunkResult = Tuple[Counts, int, int, float]
+
+
+def classify(thought: str) -> List[str]:
+    """Every category whose keywords appear in ``thought``"""
+    thought = thought.lower()
+    return [category for category, keywords in RULES if any(keyword in thought for keyword in keywords)]
+
+
+def primary(thought: str) -> Optional[str]:
+    """The first matching category, which picks the dynamic question set"""
+    thought = thought.lower()
+    for category, keywords in RULES:
+        if any(keyword in thought for keyword in keywords):
+            return category
+    return None
+
+
+def classify_chunk(rows: List[Tuple[str, str]]) -> ChunkResult:
+    """Per-day category counts for ``rows``; runs in a pool process.
+
+    A session counts once in every category it matches, or as unclassified.
+    """
+    started = time.process_time()
+    counts: Dict[str, Counter] = defaultdict(Counter)
+    for day, thought in rows:
+        counts[day].update(classify(thought) or (UNCLASSIFIED,))
+    return {day: dict(c) for day, c in counts.items()}, len(rows), os.getpid(), time.process_time() - started
+
+
+class Throughput:
+    """Sessions classified overall and per pool process"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.sessions = 0
+        self.workers: Dict[int, List[float]] = defaultdict(lambda: [0, 0.0])
+
+    def add(self, sessions: int, pid: int, cpu_seconds: float) -> None:
+        self.sessions += sessions
+        self.workers[pid][0] += sessions
+        self.workers[pid][1] += cpu_seconds
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "sessions": self.sessions,
+            "elapsed_seconds": round(elapsed, 3),
+            "sessions_per_second": round(self.sessions / elapsed, 1) if elapsed else None,
+            # Per core: sessions per CPU second each pool process spent classifying
+            "workers": [
+                {
+                    "pid": pid,
+                    "sessions": int(sessions),
+                    "cpu_seconds": round(cpu, 3),
+                    "sessions_per_cpu_second": round(sessions / cpu, 1) if cpu else None,
+                }
+                for pid, (sessions, cpu) in sorted(self.workers.items())
+            ],
+        }
+
+
+class DistortionStats:
+    """Count cognitive distortions per UTC day across every user's CBT sessions.
+
+    Sessions are streamed from storage in ``batch_size`` batches, decrypted,
+    and classified ``chunk_size`` thoughts at a time on a pool of ``workers``
+    processes while the next batch is read. With MongoDB, complete days are
+    classified a few at a time into ``distortion_stats`` and the last
+    classified day is checkpointed in ``report_state`` after each chunk, so a
+    restart resumes where it stopped and only ever redoes one chunk.
+    """
+
+    def __init__(
+        self,
+        storage,
+        cipher,
+        db=None,
+        workers: Optional[int] = None,
+        batch_size: int = 2000,
+        chunk_size: int = 500,
+        chunk_days: int = 7,
+    ) -> None:
+        self.storage = storage
+        self.cipher = cipher
+        self.db = db
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.chunk_days = chunk_days
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned, not forked: the server process has threads (SQLite, logging) a fork would copy mid-flight
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def classify_range(self, since: datetime, until: datetime, throughput: Optional[Throughput] = None) -> Counts:
+        """Counts per day and category for sessions created in [since, until)"""
+        loop = asyncio.get_running_loop()
+        pool = self.pool()
+        throughput = throughput or Throughput()
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        pending: List[asyncio.Future] = []
+
+        async def drain(limit: int) -> None:
+            while len(pending) > limit:
+                chunk_counts, sessions, pid, cpu_seconds = await pending.pop(0)
+                for day, day_counts in chunk_counts.items():
+                    counts[day].update(day_counts)
+                throughput.add(sessions, pid, cpu_seconds)
+
+        async for batch in self.storage.cbt_sessions.scan_range(since, until, self.batch_size):
+            batch = await self.cipher.decrypt_many(batch)
+            rows = [
+                (day_start(doc["created_at"]).date().isoformat(), doc.get("negative_thought") or "")
+                for doc in batch if doc.get("created_at") is not None
+            ]
+            for i in range(0, len(rows), self.chunk_size):
+                pending.append(loop.run_in_executor(pool, classify_chunk, rows[i:i + self.chunk_size]))
+            # Keep every process busy without holding the whole corpus in flight
+            await drain(2 * self.workers)
+        await drain(0)
+        return {day: dict(c) for day, c in counts.items()}
+
+    async def compute(self, since: datetime, until: datetime) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        """On-demand counts for [since, until), for storage without a stats collection"""
+        throughput = Throughput()
+        counts = await self.classify_range(since, until, throughput)
+        return frame(counts), throughput.report()
+
+    def source(self, name: str):
+        return self.db.get_collection(name, read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    async def ensure_indexes(self) -> None:
+        await self.db[STATS_COLLECTION].create_index([("day", ASCENDING), ("category", ASCENDING)])
+
+    async def pending_range(self) -> Optional[Tuple[datetime, datetime]]:
+        """[start, end) of complete days not classified yet"""
+        state = await self.db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        if state is not None:
+            start = state["classified_until"]
+        else:
+            doc = await self.source("cbt_sessions").find_one({}, {"created_at": 1}, sort=[("created_at", ASCENDING)])
+            if doc is None or doc.get("created_at") is None:
+                return None
+            start = day_start(doc["created_at"])
+        end = day_start(datetime.now(timezone.utc))
+        return (start, end) if start < end else None
+
+    async def materialize(self, keep_lease: Optional[Callable[[], Awaitable[bool]]] = None) -> int:
+        """Classify every new complete day, returning how many days were processed.
+
+        ``keep_lease`` is awaited before each chunk is written; once it returns
+        False another worker owns the job, and this run stops without writing.
+        """
+        pending = await self.pending_range()
+        if pending is None:
+            return 0
+        start, end = pending
+        throughput = Throughput()
+        processed = 0
+        while start < end:
+            chunk_end = min(start + timedelta(days=self.chunk_days), end)
+            counts = await self.classify_range(start, chunk_end, throughput)
+            if keep_lease is not None and not await keep_lease():
+                logger.warning("Lost the distortion stats lease, stopping this run")
+                break
+            # Each (day, category) row is set to its final count under a fixed _id, so a redone
+            # or overlapping chunk overwrites rows instead of adding to them
+            rows = frame(counts).to_dict("records")
+            ids = [f"{row['day']}:{row['category']}" for row in rows]
+            days = {"day": {"$gte": start.date().isoformat(), "$lt": chunk_end.date().isoformat()}}
+            # Days whose sessions are all gone since an earlier run
+            writes: List[Any] = [DeleteMany({**days, "_id": {"$nin": ids}})]
+            writes += [UpdateOne({"_id": row_id}, {"$set": row}, upsert=True) for row_id, row in zip(ids, rows)]
+            await self.db[STATS_COLLECTION].bulk_write(writes, ordered=True)
+            await self.db[STATE_COLLECTION].update_one(
+                {"_id": STATE_ID},
+                # Never moved back by a run that overlapped a further-along one
+                {"$max": {"classified_until": chunk_end}, "$set": {"last_run": throughput.report()}},
+                upsert=True,
+            )
+            processed += (chunk_end - start).days
+            start = chunk_end
+        self.last_run = throughput.report()
+        logger.info(
+            f"Classified {processed} days of CBT sessions: {self.last_run['sessions']} sessions, "
+            f"{self.last_run['sessions_per_second']}/s on {len(self.last_run['workers'])} processes"
+        )
+        return processed
+
+    async def load(self, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+        """Stored counts for days in [start, end] (YYYY-MM-DD), with the last run's throughput"""
+        query: Dict[str, Any] = {}
+        if start or end:
+            query["day"] = {k: v for k, v in (("$gte", start), ("$lte", end)) if v}
+        docs = await self.db[STATS_COLLECTION].find(query, {"_id": 0}).sort(
+            [("day", ASCENDING), ("category", ASCENDING)]
+        ).to_list(None)
+        state = await self.db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        return pd.DataFrame(docs, columns=STATS_COLUMNS), (state or {}).get("last_run")
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def frame(counts: Counts) -> pd.DataFrame:
+    """One row per (day, category), zero counts included, sorted by day"""
+    rows = [
+        {"day": day, "category": category, "sessions": int(counts[day].get(category, 0))}
+        for day in sorted(counts) for category in CATEGORIES
+    ]
+    return pd.DataFrame(rows, columns=STATS_COLUMNS)
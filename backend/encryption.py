@@ -0,0 +1,195 @@
+"""Envelope encryption of sensitive document fields with per-user data keys."""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+logger = logging.getLogger(__name__)
+
+ENCRYPTED_FIELD = "enc"
+# Bump when the envelope layout changes; stored as the prefix of every value
+FORMAT = "v1"
+NONCE_SIZE = 12
+# Blind index digests are truncated HMAC-SHA256; 64 bits keeps per-user collisions negligible
+BLIND_TERM_HEX = 16
+
+
+class UserKey(NamedTuple):
+    aead: AESGCM
+    # HMAC key for the blind search index, derived from the data key
+    index: bytes
+
+
+def load_master_key(value: Optional[str]) -> Optional[bytes]:
+    """Decode a base64 256-bit key-encryption key; None leaves encryption off"""
+    if not value:
+        return None
+    key = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    if len(key) != 32:
+        raise ValueError("DATA_ENCRYPTION_KEY must be 32 bytes, base64 encoded")
+    return key
+
+
+class FieldCipher:
+    """Encrypt ``fields`` of a document into one AES-GCM envelope.
+
+    Each user gets a random data key, stored wrapped (encrypted) under the
+    master key; unwrapped keys are kept in a bounded LRU so steady-state reads
+    and writes never touch the key store. All fields of a document are sealed
+    together, so a document costs one AEAD operation, and the user and document
+    ids are bound as associated data so ciphertexts cannot be moved between
+    documents. Documents without the envelope are treated as legacy plaintext.
+
+    The same data key also derives a per-user HMAC key for ``blind``, so a
+    keyword index can be stored next to the ciphertext without revealing words,
+    and erasing the data key makes the index meaningless too.
+    """
+
+    def __init__(
+        self,
+        master_key: Optional[bytes],
+        keys,
+        fields: Tuple[str, ...],
+        cache_size: int = 10000,
+        offload_threshold: int = 256,
+    ) -> None:
+        self.master = AESGCM(master_key) if master_key is not None else None
+        self.keys = keys
+        self.fields = fields
+        self.cache_size = cache_size
+        self.offload_threshold = offload_threshold
+        self._cache: "OrderedDict[str, UserKey]" = OrderedDict()
+        self.key_fetches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.master is not None
+
+    def _remember(self, user_id: str, key: UserKey) -> None:
+        self._cache[user_id] = key
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _unwrap(self, user_id: str, wrapped: bytes) -> UserKey:
+        key = self.master.decrypt(wrapped[:NONCE_SIZE], wrapped[NONCE_SIZE:], user_id.encode())
+        index = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"search-index").derive(key)
+        return UserKey(AESGCM(key), index)
+
+    async def _keys_for(self, user_ids: Iterable[str], create: bool = False) -> Dict[str, UserKey]:
+        found: Dict[str, UserKey] = {}
+        missing = []
+        for user_id in set(user_ids):
+            key = self._cache.get(user_id)
+            if key is not None:
+                self._cache.move_to_end(user_id)
+                found[user_id] = key
+            else:
+                missing.append(user_id)
+        if missing:
+            # One round trip for every user not in the LRU
+            self.key_fetches += 1
+            for user_id, wrapped in (await self.keys.get_many(missing)).items():
+                found[user_id] = self._unwrap(user_id, wrapped)
+                self._remember(user_id, found[user_id])
+        if create:
+            for user_id in missing:
+                if user_id not in found:
+                    nonce = os.urandom(NONCE_SIZE)
+                    wrapped = nonce + self.master.encrypt(nonce, AESGCM.generate_key(bit_length=256), user_id.encode())
+                    wrapped = await self.keys.create(user_id, wrapped)
+                    found[user_id] = self._unwrap(user_id, wrapped)
+                    self._remember(user_id, found[user_id])
+        return found
+
+    def forget(self, user_id: str) -> None:
+        self._cache.pop(user_id, None)
+
+    @staticmethod
+    def _aad(doc: Dict[str, Any]) -> bytes:
+        return f"{doc.get('user_id')}:{doc.get('id')}".encode()
+
+    def _seal(self, key: UserKey, doc: Dict[str, Any]) -> Dict[str, Any]:
+        plaintext = json.dumps({field: doc[field] for field in self.fields if field in doc}, separators=(",", ":"))
+        nonce = os.urandom(NONCE_SIZE)
+        sealed = key.aead.encrypt(nonce, plaintext.encode(), self._aad(doc))
+        encrypted = {k: v for k, v in doc.items() if k not in self.fields}
+        encrypted[ENCRYPTED_FIELD] = f"{FORMAT}:{base64.b64encode(nonce + sealed).decode()}"
+        return encrypted
+
+    def _open(self, key: UserKey, doc: Dict[str, Any]) -> Dict[str, Any]:
+        _, payload = doc[ENCRYPTED_FIELD].split(":", 1)
+        raw = base64.b64decode(payload)
+        fields = json.loads(key.aead.decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], self._aad(doc)))
+        decrypted = {k: v for k, v in doc.items() if k != ENCRYPTED_FIELD}
+        decrypted.update(fields)
+        return decrypted
+
+    async def encrypt(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """A copy of ``doc`` with the sensitive fields sealed; unchanged when encryption is off"""
+        return (await self.encrypt_many([doc]))[0]
+
+    async def encrypt_many(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not self.enabled or not docs:
+            return docs
+        keys = await self._keys_for((doc["user_id"] for doc in docs), create=True)
+        return [self._seal(keys[doc["user_id"]], doc) for doc in docs]
+
+    def _open_all(self, keys: Dict[str, UserKey], docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [self._open(keys[doc["user_id"]], doc) if ENCRYPTED_FIELD in doc else doc for doc in docs]
+
+    async def decrypt_many(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Open every envelope in ``docs`` with one key lookup per batch.
+
+        Large batches are decrypted on a worker thread so a list read of a
+        long history does not stall the event loop.
+        """
+        sealed_users = {doc["user_id"] for doc in docs if ENCRYPTED_FIELD in doc}
+        if not sealed_users:
+            return docs
+        if not self.enabled:
+            raise RuntimeError("Encrypted documents found but DATA_ENCRYPTION_KEY is not set")
+        keys = await self._keys_for(sealed_users)
+        lost = sealed_users - keys.keys()
+        if lost:
+            # The user's key was deleted (erasure); their sealed documents are unreadable
+            docs = [doc for doc in docs if doc.get("user_id") not in lost or ENCRYPTED_FIELD not in doc]
+        if len(docs) >= self.offload_threshold:
+            return await asyncio.to_thread(self._open_all, keys, docs)
+        return self._open_all(keys, docs)
+
+    async def seal_bytes(self, user_id: str, context: str, data: bytes) -> bytes:
+        """``data`` sealed under the user's data key, bound to ``context``"""
+        key = (await self._keys_for([user_id], create=True))[user_id]
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + key.aead.encrypt(nonce, data, f"{user_id}:{context}".encode())
+
+    async def open_bytes(self, user_id: str, context: str, sealed: bytes) -> Optional[bytes]:
+        """What ``seal_bytes`` sealed; None once the user's data key has been erased"""
+        keys = await self._keys_for([user_id])
+        if user_id not in keys:
+            return None
+        return keys[user_id].aead.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], f"{user_id}:{context}".encode())
+
+    async def blind(self, user_id: str, terms: Iterable[str], create: bool = False) -> List[str]:
+        """Keyed digests of search terms for ``user_id``; the terms themselves when encryption is off.
+
+        Returns an empty list when the user has no data key (and ``create`` is
+        false), since nothing of theirs can have been indexed under one.
+        """
+        if not self.enabled:
+            return sorted(set(terms))
+        keys = await self._keys_for([user_id], create=create)
+        if user_id not in keys:
+            return []
+        index = keys[user_id].index
+        return sorted({hmac.new(index, term.encode(), hashlib.sha256).hexdigest()[:BLIND_TERM_HEX] for term in terms})
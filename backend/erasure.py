@@ -0,0 +1,179 @@
+"""Throttled, resumable erasure of everything stored about one user."""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+
+# (name, delete up to ``limit`` of the user's documents and return how many went)
+Step = Tuple[str, Callable[[str, int], Awaitable[int]]]
+
+
+class LeaseLost(Exception):
+    """Another worker took the job over; this one must stop working on it"""
+
+
+class AccountEraser:
+    """Work through queued account erasures in the background.
+
+    The user's data key is deleted first, which makes their encrypted CBT
+    content unreadable at once (crypto-shredding); then each collection is
+    emptied of the user's documents in batches. Batch size follows the
+    observed latency of each delete, halving when a batch takes longer than
+    ``target_latency`` and growing slowly while it stays under, and batches
+    run at a bounded duty cycle and wait out busy periods, so a heavy user's
+    erasure never turns into one large delete on the primary. Progress is
+    saved with the job after every batch under a lease, so after a restart
+    any worker picks the job up at the collection it had reached. Saves are
+    fenced on the lease owner: a worker that stalled past its lease finds
+    its next save refused and abandons the job to the one that took it over.
+    """
+
+    def __init__(
+        self,
+        storage,
+        steps: List[Step],
+        on_key_deleted: Optional[Callable[[str], None]] = None,
+        on_erased: Optional[Callable[[str], None]] = None,
+        min_batch: int = 50,
+        max_batch: int = 2000,
+        target_latency: float = 0.05,
+        duty_cycle: float = 0.5,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 5.0,
+        is_busy: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.storage = storage
+        self.steps = steps
+        self.on_key_deleted = on_key_deleted or (lambda user_id: None)
+        self.on_erased = on_erased or (lambda user_id: None)
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_latency = target_latency
+        self.duty_cycle = duty_cycle
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.is_busy = is_busy or (lambda: False)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def request(self, user_id: str) -> Dict[str, Any]:
+        """Queue an erasure of ``user_id``, or return the one already in progress"""
+        job = await self.storage.erasures.get(user_id)
+        if job is not None and job["status"] != COMPLETED:
+            return job
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "status": QUEUED,
+            "requested_at": datetime.now(timezone.utc),
+            "started_at": None,
+            "completed_at": None,
+            "step": None,
+            "deleted": {},
+            "batch_size": self.min_batch,
+            "owner": None,
+            "lease_until": None,
+        }
+        await self.storage.erasures.save(job)
+        self._wake.set()
+        return job
+
+    def adapt(self, batch_size: int, latency: float) -> int:
+        """Next batch size: halve on a slow batch, else grow by a quarter"""
+        if latency > self.target_latency:
+            return max(self.min_batch, batch_size // 2)
+        return min(self.max_batch, batch_size + max(1, batch_size // 4))
+
+    async def throttle(self, elapsed: float) -> None:
+        """Sleep so erasure uses at most duty_cycle of wall time, and wait out busy periods"""
+        await asyncio.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+        waited = 0.0
+        # Bounded so the lease, renewed after every batch, cannot expire meanwhile
+        while self.is_busy() and waited < self.lease_seconds / 2:
+            await asyncio.sleep(1.0)
+            waited += 1.0
+
+    async def save(self, job: Dict[str, Any]) -> None:
+        """Save the job unless another worker has taken it over"""
+        if not await self.storage.erasures.save(job, owner=self.owner):
+            raise LeaseLost(f"Erasure of user {job['user_id']} was taken over by another worker")
+
+    async def checkpoint(self, job: Dict[str, Any]) -> None:
+        """Save progress and extend this worker's lease on the job"""
+        job.update(owner=self.owner, lease_until=datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds))
+        await self.save(job)
+
+    async def erase(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = job["user_id"]
+        if job["status"] == QUEUED:
+            job.update(status=RUNNING, started_at=datetime.now(timezone.utc))
+            logger.info(f"Erasing user {user_id}")
+        # Crypto-shred before anything else; repeated on resume, it is a no-op once gone
+        await self.storage.data_keys.delete(user_id)
+        self.on_key_deleted(user_id)
+        names = [name for name, _ in self.steps]
+        start = names.index(job["step"]) if job.get("step") in names else 0
+        for name, delete in self.steps[start:]:
+            job["step"] = name
+            await self.checkpoint(job)
+            while True:
+                started = time.monotonic()
+                deleted = await delete(user_id, job["batch_size"])
+                elapsed = time.monotonic() - started
+                job["deleted"][name] = job["deleted"].get(name, 0) + deleted
+                job["batch_size"] = self.adapt(job["batch_size"], elapsed)
+                await self.checkpoint(job)
+                if not deleted:
+                    break
+                await self.throttle(elapsed)
+        # Anything written while the erasure ran may have created a new key
+        await self.storage.data_keys.delete(user_id)
+        self.on_key_deleted(user_id)
+        job.update(status=COMPLETED, completed_at=datetime.now(timezone.utc), step=None, owner=None, lease_until=None)
+        await self.save(job)
+        self.on_erased(user_id)
+        logger.info(f"Erased user {user_id}: {job['deleted']}")
+        return job
+
+    async def run(self) -> None:
+        while True:
+            try:
+                job = await self.storage.erasures.claim(self.owner, self.lease_seconds)
+                if job is not None:
+                    await self.erase(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except LeaseLost as e:
+                logger.warning(str(e))
+                continue
+            except Exception as e:
+                logger.error(f"Account erasure failed: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
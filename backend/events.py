@@ -0,0 +1,169 @@
+"""Per-user Server-Sent Events fan-out hub."""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+
+logger = logging.getLogger(__name__)
+
+EVENTS_COLLECTION = "user_events"
+
+# Sentinels pushed into subscriber queues by the hub itself
+HEARTBEAT = object()
+OVERFLOW = object()
+
+
+def format_event(event_id: str, event_type: str, data: Dict[str, Any]) -> bytes:
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+
+class EventHub:
+    """Fan out small per-user deltas to SSE connections on one event loop.
+
+    Every event is written to ``user_events`` (TTL-expired) with an ObjectId that
+    doubles as the SSE event id, so a client reconnecting to any worker can replay
+    what it missed from ``Last-Event-ID``. Events published on this worker are
+    delivered immediately; events from other workers arrive via the change stream.
+
+    A connection is just a bounded asyncio.Queue in a per-user set, and a single
+    hub task writes heartbeats into all of them, so idle connections cost no timers.
+    With ``db`` set to None, or ``persist=False`` for high-volume hints, events are
+    delivered locally but not kept for replay.
+    """
+
+    def __init__(self, db, heartbeat_interval: float = 15.0, queue_size: int = 64, retention_seconds: int = 86400) -> None:
+        self.db = db
+        self.heartbeat_interval = heartbeat_interval
+        self.queue_size = queue_size
+        self.retention_seconds = retention_seconds
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def collection(self):
+        return self.db[EVENTS_COLLECTION]
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("user_id", ASCENDING), ("_id", ASCENDING)])
+        await self.collection.create_index("created_at", expireAfterSeconds=self.retention_seconds)
+
+    async def delete_user_batch(self, user_id: str, limit: int) -> int:
+        """Drop up to ``limit`` of the user's stored events, for account erasure"""
+        if self.db is None:
+            return 0
+        ids = [doc["_id"] async for doc in self.collection.find({"user_id": user_id}, {"_id": 1}).limit(limit)]
+        if not ids:
+            return 0
+        return (await self.collection.delete_many({"_id": {"$in": ids}})).deleted_count
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        for queue in self.subscribers.get(event["user_id"], ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop it, the client reconnects and replays from Last-Event-ID
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(OVERFLOW)
+
+    async def publish(self, user_id: str, event_type: str, data: Dict[str, Any], persist: bool = True) -> None:
+        """Deliver to this worker's subscribers; unless ``persist`` is off, also store for replay and other workers"""
+        event = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "type": event_type,
+            "data": data,
+            "origin": self.origin,
+            "created_at": datetime.now(timezone.utc),
+        }
+        self.deliver(event)
+        if self.db is None or not persist:
+            return
+        try:
+            await self.collection.insert_one(event)
+        except Exception as e:
+            logger.error(f"Failed to persist event for replay: {str(e)}")
+
+    def handle_change(self, change: Dict[str, Any]) -> None:
+        """Change-stream listener for user_events inserted by other workers"""
+        event = change.get("fullDocument")
+        if change.get("operationType") == "insert" and event and event.get("origin") != self.origin:
+            self.deliver(event)
+
+    async def replay(self, user_id: str, last_event_id: str):
+        if self.db is None:
+            return None
+        try:
+            after = ObjectId(last_event_id)
+        except (InvalidId, TypeError):
+            return None
+        return await self.collection.find({"user_id": user_id, "_id": {"$gt": after}}).sort("_id", ASCENDING).to_list(self.queue_size)
+
+    async def stream(self, user_id: str, last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        # Subscribe before replaying so nothing published in between is lost
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield f"retry: {int(self.heartbeat_interval * 1000)}\n\n".encode()
+            seen = set()
+            if last_event_id:
+                missed = await self.replay(user_id, last_event_id)
+                if missed is None or len(missed) >= self.queue_size:
+                    # Too far behind to replay as deltas, tell the client to refetch
+                    yield format_event(str(ObjectId()), "reset", {})
+                else:
+                    for event in missed:
+                        seen.add(event["_id"])
+                        yield format_event(str(event["_id"]), event["type"], event["data"])
+            while True:
+                event = await queue.get()
+                if event is HEARTBEAT:
+                    yield b": ping\n\n"
+                elif event is OVERFLOW:
+                    return
+                elif event["_id"] not in seen:
+                    yield format_event(str(event["_id"]), event["type"], event["data"])
+        finally:
+            queues = self.subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.subscribers[user_id]
+
+    async def _run(self) -> None:
+        if self.db is not None:
+            try:
+                await self.ensure_indexes()
+            except Exception as e:
+                logger.error(f"Failed to create event indexes: {str(e)}")
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for queues in list(self.subscribers.values()):
+                for queue in queues:
+                    if queue.empty():
+                        queue.put_nowait(HEARTBEAT)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,241 @@
+"""Idempotency-Key support for POST endpoints."""
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """Stored responses in a TTL-indexed collection with a small in-memory LRU in front.
+
+    A claim is only held for ``pending_seconds``: if the worker handling the
+    request dies before completing or releasing it, a retry takes the key over
+    once that lease has run out instead of getting 409 until the TTL expires.
+    """
+
+    def __init__(self, db, ttl_seconds: int = 86400, memory_size: int = 10000, pending_seconds: float = 60.0) -> None:
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.memory_size = memory_size
+        self.pending_seconds = pending_seconds
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @property
+    def collection(self):
+        return self.db[IDEMPOTENCY_COLLECTION]
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        await self.collection.create_index("user_id")
+
+    def _remember(self, key: str, record: Dict[str, Any]) -> None:
+        self._memory[key] = (time.monotonic() + self.ttl_seconds, record)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                self._memory.move_to_end(key)
+                return entry[1]
+            del self._memory[key]
+        record = await self.collection.find_one({"_id": key})
+        if record is not None and record.get("state") == "done":
+            self._remember(key, record)
+        return record
+
+    async def claim(self, key: str, fingerprint: str, user_id: Optional[str] = None) -> bool:
+        """Reserve a key for an in-flight request; False if someone already holds it"""
+        now = datetime.now(timezone.utc)
+        pending_until = now + timedelta(seconds=self.pending_seconds)
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "user_id": user_id,
+                "state": "pending",
+                "fingerprint": fingerprint,
+                "pending_until": pending_until,
+                "created_at": now,
+            })
+        except DuplicateKeyError:
+            # Take over a claim whose request never finished, if it was for the same payload
+            abandoned = await self.collection.find_one_and_update(
+                {"_id": key, "state": "pending", "fingerprint": fingerprint, "pending_until": {"$lte": now}},
+                {"$set": {"pending_until": pending_until, "created_at": now}},
+            )
+            return abandoned is not None
+        return True
+
+    async def complete(
+        self,
+        key: str,
+        fingerprint: str,
+        status: int,
+        content_type: str,
+        body: bytes,
+        sealed: bool = False,
+        user_id: Optional[str] = None,
+    ) -> None:
+        record = {
+            "_id": key,
+            "user_id": user_id,
+            "state": "done",
+            "fingerprint": fingerprint,
+            "status": status,
+            "content_type": content_type,
+            "body": body,
+            "sealed": sealed,
+            "created_at": datetime.now(timezone.utc),
+        }
+        self._remember(key, record)
+        await self.collection.replace_one({"_id": key}, record, upsert=True)
+
+    async def release(self, key: str) -> None:
+        """Drop a claim after a failed request so the client's retry is processed"""
+        self._memory.pop(key, None)
+        await self.collection.delete_one({"_id": key, "state": "pending"})
+
+    def forget_user(self, user_id: str) -> None:
+        """Drop the user's responses from this worker's memory"""
+        for key in [key for key, (_, record) in self._memory.items() if record.get("user_id") == user_id]:
+            del self._memory[key]
+
+    async def delete_user_batch(self, user_id: str, limit: int) -> int:
+        """Drop up to ``limit`` of the user's stored responses, for account erasure"""
+        self.forget_user(user_id)
+        ids = [doc["_id"] async for doc in self.collection.find({"user_id": user_id}, {"_id": 1}).limit(limit)]
+        if not ids:
+            return 0
+        return (await self.collection.delete_many({"_id": {"$in": ids}})).deleted_count
+
+
+def json_response(status: int, detail: str) -> Tuple[int, bytes]:
+    return status, json.dumps({"detail": detail}).encode()
+
+
+class IdempotencyMiddleware:
+    """Replay the stored response for a repeated ``Idempotency-Key``.
+
+    Only POSTs to ``paths`` are considered. The key is scoped by path and user_id,
+    and the request body is fingerprinted so reusing a key for a different payload
+    is rejected with 422. A second request arriving while the first is still
+    running gets 409, unless the first one's claim has expired. 5xx responses
+    are not stored, so the client can retry them.
+
+    Responses from ``sealed_paths`` carry content that is encrypted at rest, so
+    their stored body is sealed with ``cipher`` under the user's data key, both
+    in Mongo and in memory, and erasing that key makes it unreadable.
+    """
+
+    def __init__(
+        self, app: ASGIApp, store: IdempotencyStore, paths: Iterable[str], sealed_paths: Iterable[str] = (), cipher=None
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.paths = frozenset(paths)
+        self.sealed_paths = frozenset(sealed_paths)
+        self.cipher = cipher
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = Headers(scope=scope).get("idempotency-key")
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            await self.respond(send, *json_response(400, "Idempotency-Key too long"))
+            return
+
+        user_id = QueryParams(scope.get("query_string", b"")).get("user_id", "anonymous")
+        key = f"{scope['path']}:{user_id}:{idempotency_key}"
+
+        # Read the body up front to fingerprint it, then hand it to the app unchanged
+        parts = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            parts.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(parts)
+        fingerprint = hashlib.sha256(scope.get("query_string", b"") + b"\0" + body).hexdigest()
+
+        record = await self.store.get(key)
+        if record is None or record["state"] != "done":
+            record = None if await self.store.claim(key, fingerprint, user_id) else await self.store.get(key)
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                await self.respond(send, *json_response(422, "Idempotency-Key reused with a different request"))
+            elif record["state"] != "done":
+                await self.respond(send, *json_response(409, "A request with this Idempotency-Key is in progress"))
+            else:
+                stored = bytes(record["body"])
+                if record.get("sealed"):
+                    stored = await self.cipher.open_bytes(user_id, key, stored)
+                if stored is None:
+                    await self.respond(send, *json_response(410, "The stored response was erased"))
+                else:
+                    await self.respond(send, record["status"], stored, record["content_type"], replayed=True)
+            return
+
+        replayed_body = False
+
+        async def replay_receive() -> Message:
+            nonlocal replayed_body
+            if not replayed_body:
+                replayed_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status = 500
+        content_type = "application/json"
+        chunks = []
+
+        async def capture_send(message: Message) -> None:
+            nonlocal status, content_type
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = Headers(raw=message["headers"]).get("content-type", content_type)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            try:
+                if status < 500:
+                    stored = b"".join(chunks)
+                    sealed = scope["path"] in self.sealed_paths and self.cipher is not None and self.cipher.enabled
+                    if sealed:
+                        stored = await self.cipher.seal_bytes(user_id, key, stored)
+                    await self.store.complete(key, fingerprint, status, content_type, stored, sealed=sealed, user_id=user_id)
+                else:
+                    await self.store.release(key)
+            except Exception as e:
+                logger.error(f"Failed to record idempotent response: {str(e)}")
+
+    async def respond(self, send: Send, status: int, body: bytes, content_type: str = "application/json", replayed: bool = False) -> None:
+        headers = [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        if replayed:
+            headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,278 @@
+"""Mood trajectories from preference history: per-user timelines and cohort trends, in NumPy."""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from archive import as_naive_utc
+from recommendations import MOODS
+
+logger = logging.getLogger(__name__)
+
+TRENDS_COLLECTION = "mood_trends"
+TRENDS_ID = "cohort"
+DAY = 86400
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday; shifting by three days makes weeks start on Monday
+WEEK_OFFSET = 3 * DAY
+# Valence used to turn moods into a score that can improve or worsen
+MOOD_SCORES = np.array([-1.0, -0.5, -1.0, -1.0, 1.0])  # Anxious, Unfocused, Sad, Stressed, Calm
+USAGE_FEATURES = ("zen", "cbt")
+EPOCH = datetime(1970, 1, 1)
+NAT = np.datetime64("NaT").astype(np.int64)
+
+
+def seconds(values: List[Optional[datetime]]) -> np.ndarray:
+    """Datetimes as int64 epoch seconds (UTC), -1 for missing ones"""
+    if any(v is not None and v.tzinfo is not None for v in values):
+        values = [as_naive_utc(v) if v is not None else None for v in values]
+    stamps = np.array(values, dtype="datetime64[s]").astype(np.int64)
+    return np.where(stamps == NAT, -1, stamps)
+
+
+def mood_codes(moods: List[Optional[str]]) -> np.ndarray:
+    """Index into MOODS, -1 for anything else"""
+    return pd.Index(MOODS).get_indexer(moods).astype(np.int8)
+
+
+def one_hot_counts(codes: np.ndarray, buckets: np.ndarray, n_buckets: int) -> np.ndarray:
+    """(n_buckets, len(MOODS)) count matrix of mood codes per bucket"""
+    return np.bincount(buckets * len(MOODS) + codes, minlength=n_buckets * len(MOODS)).reshape(n_buckets, len(MOODS))
+
+
+def rolling_distribution(times: np.ndarray, codes: np.ndarray, ends: np.ndarray, window: int) -> np.ndarray:
+    """Mood counts over the ``window`` seconds before each of ``ends``; ``times`` must be sorted"""
+    cumulative = np.zeros((times.size + 1, len(MOODS)), dtype=np.int64)
+    cumulative[1:] = np.cumsum(np.eye(len(MOODS), dtype=np.int64)[codes], axis=0)
+    return cumulative[np.searchsorted(times, ends, side="right")] - cumulative[np.searchsorted(times, ends - window, side="right")]
+
+
+def shares(counts: np.ndarray) -> List[Optional[Dict[str, float]]]:
+    totals = counts.sum(axis=1)
+    fractions = np.divide(counts, totals[:, None], out=np.zeros(counts.shape), where=totals[:, None] > 0)
+    return [
+        {mood: round(float(f), 4) for mood, f in zip(MOODS, row)} if total else None
+        for row, total in zip(fractions, totals)
+    ]
+
+
+def transitions(users: np.ndarray, codes: np.ndarray) -> Dict[str, Any]:
+    """Counts and row-normalized probabilities of consecutive reports by the same user; rows sorted by user, time"""
+    same = users[1:] == users[:-1]
+    counts = np.bincount(codes[:-1][same] * len(MOODS) + codes[1:][same], minlength=len(MOODS) ** 2)
+    counts = counts.reshape(len(MOODS), len(MOODS))
+    totals = counts.sum(axis=1, keepdims=True)
+    probabilities = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+    return {
+        "moods": list(MOODS),
+        "counts": counts.tolist(),
+        "probabilities": np.round(probabilities, 4).tolist(),
+    }
+
+
+def pearson(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    if x.size < 3 or x.std() == 0 or y.std() == 0:
+        return None
+    return round(float(np.corrcoef(x, y)[0, 1]), 4)
+
+
+def usage_effect(
+    users: np.ndarray, times: np.ndarray, codes: np.ndarray, usage_users: np.ndarray, usage_times: np.ndarray
+) -> Dict[str, Any]:
+    """How the mood score moves between consecutive reports, with and without sessions in between.
+
+    Reports are sorted by (user, time). Sessions are located inside each
+    report interval with one searchsorted over (user, time) keys, so the cost
+    is O((reports + sessions) log sessions) however many users there are.
+    """
+    same = users[1:] == users[:-1]
+    start, end = times[:-1][same], times[1:][same]
+    pair_users = users[1:][same].astype(np.int64)
+    delta = MOOD_SCORES[codes[1:][same]] - MOOD_SCORES[codes[:-1][same]]
+    base = min(int(times.min()) if times.size else 0, int(usage_times.min()) if usage_times.size else 0)
+    keys = np.sort((usage_users.astype(np.int64) << 32) + (usage_times - base))
+    between = (
+        np.searchsorted(keys, (pair_users << 32) + (end - base), side="left")
+        - np.searchsorted(keys, (pair_users << 32) + (start - base), side="left")
+    )
+    used = between > 0
+    return {
+        "intervals": int(delta.size),
+        "intervals_with_usage": int(used.sum()),
+        "mean_change_with_usage": round(float(delta[used].mean()), 4) if used.any() else None,
+        "mean_change_without_usage": round(float(delta[~used].mean()), 4) if (~used).any() else None,
+        "correlation": pearson(between.astype(np.float64), delta),
+    }
+
+
+def valid(times: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    return (times >= 0) & (codes >= 0)
+
+
+def timeline(
+    preferences: List[Dict[str, Any]],
+    usage: Dict[str, List[Optional[datetime]]],
+    now: datetime,
+    days: int = 90,
+    window_days: int = 7,
+) -> Dict[str, Any]:
+    """One user's mood events, daily rolling distribution, transitions and usage correlation"""
+    times = seconds([pref.get("created_at") for pref in preferences])
+    codes = mood_codes([pref.get("current_mood") for pref in preferences])
+    keep = valid(times, codes)
+    order = np.argsort(times[keep], kind="stable")
+    kept = [pref for pref, k in zip(preferences, keep) if k]
+    times, codes = times[keep][order], codes[keep][order]
+    events = [
+        {"created_at": kept[i].get("created_at"), "mood": kept[i].get("current_mood"), "mood_frequency": kept[i].get("mood_frequency")}
+        for i in order
+    ]
+    today = int((as_naive_utc(now) - EPOCH).total_seconds()) // DAY
+    day_ends = (np.arange(today - days + 1, today + 1) + 1) * DAY
+    daily = rolling_distribution(times, codes, day_ends, window_days * DAY)
+
+    # Last reported mood on each day, carried forward, against sessions in the trailing window
+    latest = np.searchsorted(times, day_ends, side="right") - 1
+    known = latest >= 0
+    score = MOOD_SCORES[codes[np.maximum(latest, 0)]] if codes.size else np.zeros(day_ends.size)
+    correlations: Dict[str, Any] = {}
+    users = np.zeros(times.size, dtype=np.int32)
+    for feature in USAGE_FEATURES:
+        usage_times = seconds(usage.get(feature, []))
+        usage_times = np.sort(usage_times[usage_times >= 0])
+        in_window = np.searchsorted(usage_times, day_ends, side="right") - np.searchsorted(
+            usage_times, day_ends - window_days * DAY, side="right"
+        )
+        correlations[feature] = {
+            "daily_correlation": pearson(in_window[known].astype(np.float64), score[known]),
+            **usage_effect(users, times, codes, np.zeros(usage_times.size, dtype=np.int32), usage_times),
+        }
+    return {
+        "events": events,
+        "window_days": window_days,
+        "daily": [
+            {"date": (EPOCH + timedelta(seconds=int(end) - DAY)).date().isoformat(), "distribution": distribution}
+            for end, distribution in zip(day_ends, shares(daily))
+        ],
+        "transitions": transitions(users, codes),
+        "usage": correlations,
+    }
+
+
+class MoodEvents:
+    """Every user's mood reports as parallel arrays, sorted by (user, time)"""
+
+    def __init__(self, user_ids: List[str], users: np.ndarray, times: np.ndarray, codes: np.ndarray) -> None:
+        self.user_ids = user_ids
+        self.users = users
+        self.times = times
+        self.codes = codes
+
+    @classmethod
+    async def load(cls, repository, batch_size: int = 50000) -> "MoodEvents":
+        index: Dict[str, int] = {}
+        users, times, codes = [], [], []
+        async for batch in repository.scan_moods(batch_size):
+            user_ids, created, moods = zip(*batch)
+            users.append(np.fromiter((index.setdefault(u, len(index)) for u in user_ids), dtype=np.int32, count=len(batch)))
+            times.append(seconds(list(created)))
+            codes.append(mood_codes(list(moods)))
+        if not users:
+            empty = np.empty(0, dtype=np.int64)
+            return cls([], empty.astype(np.int32), empty, empty.astype(np.int8))
+        users_arr, times_arr, codes_arr = np.concatenate(users), np.concatenate(times), np.concatenate(codes)
+        keep = valid(times_arr, codes_arr)
+        users_arr, times_arr, codes_arr = users_arr[keep], times_arr[keep], codes_arr[keep]
+        order = np.lexsort((times_arr, users_arr))
+        return cls(list(index), users_arr[order], times_arr[order], codes_arr[order])
+
+    async def activity(self, repository, batch_size: int = 50000) -> Tuple[np.ndarray, np.ndarray]:
+        """(user codes, times) of sessions by users who have mood reports"""
+        index = {user_id: code for code, user_id in enumerate(self.user_ids)}
+        users, times = [], []
+        async for batch in repository.scan_activity(batch_size):
+            user_ids, created = zip(*batch)
+            codes = np.fromiter((index.get(u, -1) for u in user_ids), dtype=np.int32, count=len(batch))
+            stamps = seconds(list(created))
+            keep = (codes >= 0) & (stamps >= 0)
+            users.append(codes[keep])
+            times.append(stamps[keep])
+        if not users:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+        return np.concatenate(users), np.concatenate(times)
+
+
+def cohort_trends(events: MoodEvents, usage: Dict[str, Tuple[np.ndarray, np.ndarray]], window_weeks: int = 4) -> Dict[str, Any]:
+    """Weekly mood shares (and a rolling ``window_weeks`` distribution), transitions and usage effects across all users"""
+    if not events.times.size:
+        return {"users": 0, "reports": 0, "weekly": [], "transitions": transitions(events.users, events.codes), "usage": {}}
+    absolute = (events.times + WEEK_OFFSET) // WEEK
+    first_week = int(absolute.min())
+    weeks = absolute - first_week
+    n_weeks = int(weeks.max()) + 1
+    weekly = one_hot_counts(events.codes.astype(np.int64), weeks, n_weeks)
+    week_ends = (np.arange(n_weeks) + first_week + 1) * WEEK - WEEK_OFFSET
+    ordered = np.argsort(events.times, kind="stable")
+    rolling = rolling_distribution(events.times[ordered], events.codes[ordered], week_ends, window_weeks * WEEK)
+    return {
+        "users": len(events.user_ids),
+        "reports": int(events.times.size),
+        "window_weeks": window_weeks,
+        "weekly": [
+            {
+                "week_start": (EPOCH + timedelta(seconds=int(end) - WEEK)).date().isoformat(),
+                "reports": int(counts.sum()),
+                "distribution": distribution,
+                "rolling_distribution": rolling_share,
+            }
+            for end, counts, distribution, rolling_share in zip(week_ends, weekly, shares(weekly), shares(rolling))
+        ],
+        "transitions": transitions(events.users, events.codes),
+        "usage": {
+            feature: usage_effect(events.users, events.times, events.codes, users, times)
+            for feature, (users, times) in usage.items()
+        },
+    }
+
+
+class MoodTrends:
+    """Cohort mood trends, recomputed by a scheduled job only when new preferences arrived.
+
+    The result is stored as one document in ``mood_trends`` along with the
+    newest preference timestamp it covers, so every worker serves the same
+    snapshot and an unchanged preference history costs one indexed lookup
+    per run instead of a full scan.
+    """
+
+    def __init__(self, storage, db=None, batch_size: int = 50000) -> None:
+        self.storage = storage
+        self.db = db
+        self.batch_size = batch_size
+
+    async def compute(self) -> Dict[str, Any]:
+        events = await MoodEvents.load(self.storage.preferences, self.batch_size)
+        usage = {
+            feature: await events.activity(self.storage.sessions(feature), self.batch_size)
+            for feature in USAGE_FEATURES
+        }
+        # The array work is the bulk of a large run; keep it off the event loop
+        return await asyncio.to_thread(cohort_trends, events, usage)
+
+    async def materialize(self) -> None:
+        latest = await self.storage.preferences.latest()
+        stored = await self.db[TRENDS_COLLECTION].find_one({"_id": TRENDS_ID}, {"source_latest": 1})
+        if stored is not None and stored.get("source_latest") == latest:
+            return
+        trends = await self.compute()
+        await self.db[TRENDS_COLLECTION].replace_one(
+            {"_id": TRENDS_ID},
+            {**trends, "source_latest": latest, "computed_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+        logger.info(f"Mood trends recomputed over {trends['reports']} reports from {trends['users']} users")
+
+    async def load(self) -> Optional[Dict[str, Any]]:
+        return await self.db[TRENDS_COLLECTION].find_one({"_id": TRENDS_ID}, {"_id": 0, "source_latest": 0})
@@ -0,0 +1,102 @@
+"""On-demand sampling profiler producing collapsed stacks for flamegraphs."""
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(";", ":")
+
+
+def collapse(frame, root: Optional[str] = None) -> str:
+    """``root;...;leaf`` for the stack ending at ``frame``"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    if root is not None:
+        labels.append(root)
+    return ";".join(reversed(labels))
+
+
+def folded(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class SamplingProfiler:
+    """Sample thread stacks at a fixed interval.
+
+    Nothing is traced or instrumented, so the cost is one short stack walk
+    per sample whatever the application is doing. The result is in the
+    collapsed format (``root;...;leaf count`` per line) that flamegraph.pl,
+    speedscope and inferno read. Only one profile runs at a time per process.
+
+    ``profile`` reads ``sys._current_frames()`` from a background thread. A
+    busy event loop only hands that thread the GIL when it blocks in
+    ``select``, which skews such samples towards idle, so ``profile_loop``
+    samples the loop from a SIGALRM interval timer instead: the handler runs
+    on the loop's (main) thread between bytecodes and records the frame it
+    interrupted.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, interval: float = 0.005, thread_id: Optional[int] = None) -> str:
+        """Blocking: sample for ``seconds``; only ``thread_id`` if given, else every other thread"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            own = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks: Counter = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or (thread_id is not None and ident != thread_id):
+                        continue
+                    stacks[collapse(frame, None if thread_id is not None else names.get(ident, str(ident)))] += 1
+                samples += 1
+                time.sleep(interval)
+            logger.info(f"Profiled for {seconds}s: {samples} samples, {len(stacks)} distinct stacks")
+            return folded(stacks)
+        finally:
+            self._lock.release()
+
+    async def profile_loop(self, seconds: float, interval: float = 0.005) -> str:
+        """Sample the running event loop for ``seconds`` without blocking it"""
+        if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "setitimer"):
+            # Signals are only delivered to the main thread; fall back to sampling from a thread
+            return await asyncio.to_thread(self.profile, seconds, interval, threading.get_ident())
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        stacks: Counter = Counter()
+
+        def sample(signum, frame) -> None:
+            stacks[collapse(frame)] += 1
+
+        previous = signal.signal(signal.SIGALRM, sample)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, interval, interval)
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+            self._lock.release()
+        logger.info(f"Profiled event loop for {seconds}s: {sum(stacks.values())} samples, {len(stacks)} distinct stacks")
+        return folded(stacks)
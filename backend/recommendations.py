@@ -0,0 +1,208 @@
+"""Precomputed (mood, identity) -> ordered article rankings, served from memory."""
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+logger = logging.getLogger(__name__)
+
+MOODS = ("Anxious", "Unfocused", "Sad", "Stressed", "Calm")
+IDENTITIES = ("Student", "Creative", "Professional", "Other")
+
+# How well each category suits a mood, 0..1; unknown categories score 0
+MOOD_CATEGORY_AFFINITY: Dict[str, Dict[str, float]] = {
+    "Anxious": {"Mental Health": 1.0, "Mindfulness": 0.9, "Therapy": 0.7, "Wellness": 0.5, "Digital Wellbeing": 0.3},
+    "Unfocused": {"Digital Wellbeing": 1.0, "Mindfulness": 0.7, "Personal Growth": 0.5, "Wellness": 0.4},
+    "Sad": {"Personal Growth": 1.0, "Therapy": 0.9, "Mental Health": 0.7, "Wellness": 0.5},
+    "Stressed": {"Mindfulness": 1.0, "Wellness": 0.8, "Therapy": 0.6, "Digital Wellbeing": 0.5, "Mental Health": 0.4},
+    "Calm": {"Personal Growth": 0.8, "Wellness": 0.7, "Mindfulness": 0.6, "Digital Wellbeing": 0.5},
+}
+
+MOOD_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "Anxious": ("anxiety", "anxious", "breathing", "calm", "worry", "nervous"),
+    "Unfocused": ("focus", "attention", "distraction", "screen", "minimalism", "notifications"),
+    "Sad": ("resilience", "emotional", "compassion", "connection", "hope"),
+    "Stressed": ("stress", "breathing", "relaxation", "sleep", "boundaries", "balance"),
+    "Calm": ("growth", "mindful", "gratitude", "habits"),
+}
+
+IDENTITY_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "Student": ("study", "exam", "sleep", "screen", "social media", "focus"),
+    "Creative": ("creative", "creativity", "inspiration", "minimalism", "mindful"),
+    "Professional": ("work", "productivity", "burnout", "boundaries", "balance", "technology"),
+    "Other": (),
+}
+
+CATEGORY_WEIGHT = 3.0
+KEYWORD_WEIGHT = 0.5
+FAVORITE_WEIGHT = 1.0
+
+
+def keyword_hits(text: str, keywords: Tuple[str, ...]) -> int:
+    return sum(1 for keyword in keywords if re.search(rf"\b{re.escape(keyword)}", text))
+
+
+def score(article: Dict[str, Any], mood: Optional[str], identity: Optional[str], favorites: int) -> float:
+    """Category and keyword affinity for the pair plus a log-damped popularity term"""
+    text = f"{article.get('title', '')} {article.get('content', '')}".lower()
+    total = FAVORITE_WEIGHT * math.log1p(favorites)
+    if mood is not None:
+        total += CATEGORY_WEIGHT * MOOD_CATEGORY_AFFINITY.get(mood, {}).get(article.get("category"), 0.0)
+        total += KEYWORD_WEIGHT * keyword_hits(text, MOOD_KEYWORDS.get(mood, ()))
+    if identity is not None:
+        total += KEYWORD_WEIGHT * keyword_hits(text, IDENTITY_KEYWORDS.get(identity, ()))
+    return total
+
+
+def rank(
+    articles: List[Dict[str, Any]], favorite_counts: Dict[str, int], mood: Optional[str], identity: Optional[str]
+) -> List[Dict[str, Any]]:
+    # Ties keep catalog order, so rankings are stable between rebuilds
+    return sorted(
+        articles,
+        key=lambda article: -score(article, mood, identity, favorite_counts.get(article.get("id"), 0)),
+    )
+
+
+class RecommendationTable:
+    """Rankings for every (mood, identity) pair, rebuilt off the request path.
+
+    Each entry holds the already-encoded JSON response, so serving is a dict
+    lookup. ``mark_stale`` (article changes) and ``mark_favorites_stale``
+    (favorite changes), called locally or from the change stream, schedule a
+    rebuild. Catalog changes are picked up within ``min_interval`` seconds;
+    favorites only within ``favorites_interval``, since counting them
+    aggregates the whole collection and favorites churn. A rebuild refreshes
+    only what changed and reuses the other input. Rankings are also fully
+    refreshed every ``refresh_interval`` seconds in case a change was missed.
+
+    ``seed`` fills an empty catalog the same way the article listing does, and
+    ``model`` validates each article into the shape the listing returns.
+    """
+
+    def __init__(
+        self,
+        storage,
+        min_interval: float = 5.0,
+        favorites_interval: float = 60.0,
+        refresh_interval: float = 600.0,
+        seed: Optional[Callable[[], Awaitable[None]]] = None,
+        model: Optional[Callable[..., Any]] = None,
+    ) -> None:
+        self.storage = storage
+        self.min_interval = min_interval
+        self.favorites_interval = favorites_interval
+        self.refresh_interval = refresh_interval
+        self.seed = seed
+        self.model = model
+        self.table: Dict[Tuple[Optional[str], Optional[str]], bytes] = {}
+        self.builds = 0
+        self._articles: Optional[List[Dict[str, Any]]] = None
+        self._favorite_counts: Optional[Dict[str, int]] = None
+        self._articles_stale = True
+        self._favorites_stale = True
+        self._last_build = float("-inf")
+        self._stale = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, mood: Optional[str], identity: Optional[str]) -> Optional[bytes]:
+        """Encoded ranking for the pair; unknown values fall back to popularity order"""
+        if mood not in MOODS:
+            mood = None
+        if identity not in IDENTITIES:
+            identity = None
+        return self.table.get((mood, identity)) or self.table.get((None, None))
+
+    def mark_stale(self, *args: Any) -> None:
+        self._articles_stale = True
+        self._stale.set()
+
+    def mark_favorites_stale(self, *args: Any) -> None:
+        self._favorites_stale = True
+        self._stale.set()
+
+    async def _build(self, articles: bool, favorites: bool) -> None:
+        if articles or self._articles is None:
+            catalog = await self.storage.articles.list()
+            if not catalog and self.seed is not None:
+                await self.seed()
+                catalog = await self.storage.articles.list()
+            self._articles = catalog
+        if favorites or self._favorite_counts is None:
+            self._favorite_counts = await self.storage.favorites.counts_by_article()
+        catalog, favorite_counts = self._articles, self._favorite_counts
+        encoded = jsonable_encoder([self.model(**article) for article in catalog] if self.model else catalog)
+        by_id = {article["id"]: article for article in encoded}
+        table = {}
+        for mood in (None, *MOODS):
+            for identity in (None, *IDENTITIES):
+                ordered = rank(catalog, favorite_counts, mood, identity)
+                table[(mood, identity)] = json.dumps([by_id[article["id"]] for article in ordered]).encode()
+        # Swap in one assignment so readers never see a partial table
+        self.table = table
+        self.builds += 1
+
+    async def rebuild(self, articles: bool = True, favorites: bool = True) -> None:
+        """Rebuild from fresh ``articles`` and/or ``favorites``, reusing the last read of the other"""
+        async with self._lock:
+            await self._build(articles, favorites)
+
+    async def ensure_built(self) -> None:
+        if not self.table:
+            async with self._lock:
+                # Cold-start requests queued on the lock reuse the first one's build
+                if not self.table:
+                    await self._build(True, True)
+
+    async def _throttle(self) -> None:
+        """Wait out the floor for what changed; a catalog change arriving meanwhile shortens it"""
+        while True:
+            floor = self.min_interval if self._articles_stale else self.favorites_interval
+            wait = self._last_build + floor - time.monotonic()
+            if wait <= 0:
+                return
+            self._stale.clear()
+            try:
+                await asyncio.wait_for(self._stale.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._stale.wait(), timeout=self.refresh_interval)
+            except asyncio.TimeoutError:
+                self._articles_stale = self._favorites_stale = True
+            # Changes during the wait fold into this rebuild
+            await self._throttle()
+            self._stale.clear()
+            articles, favorites = self._articles_stale, self._favorites_stale
+            self._articles_stale = self._favorites_stale = False
+            self._last_build = time.monotonic()
+            try:
+                await self.rebuild(articles, favorites)
+            except Exception as e:
+                # Picked up again by the next rebuild
+                self._articles_stale |= articles
+                self._favorites_stale |= favorites
+                logger.error(f"Failed to rebuild article recommendations: {str(e)}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stale.set()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
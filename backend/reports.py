@@ -0,0 +1,157 @@
+"""Incremental materialization and export of global daily usage reports."""
+import io
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from pymongo import ASCENDING, ReadPreference
+
+logger = logging.getLogger(__name__)
+
+REPORTS_COLLECTION = "daily_usage_reports"
+STATE_COLLECTION = "report_state"
+STATE_ID = "daily_usage"
+
+REPORT_COLUMNS = ["day", "source", "feature", "events", "active_users", "total_duration", "avg_duration", "completed"]
+
+
+def day_start(value: datetime) -> datetime:
+    """Midnight UTC of the given instant, as the naive UTC datetime Mongo stores"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def usage_pipeline(start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Daily active users, events and total duration per feature from usage_analytics"""
+    return [
+        {"$match": {"created_at": {"$gte": start, "$lt": end}}},
+        {"$group": {
+            "_id": {"day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "feature": "$feature"},
+            "events": {"$sum": 1},
+            "users": {"$addToSet": "$user_id"},
+            "total_duration": {"$sum": {"$ifNull": ["$duration", 0]}},
+        }},
+        {"$project": {
+            "_id": {"day": "$_id.day", "source": "usage_analytics", "feature": "$_id.feature"},
+            "day": "$_id.day",
+            "source": "usage_analytics",
+            "feature": "$_id.feature",
+            "events": 1,
+            "active_users": {"$size": "$users"},
+            "total_duration": 1,
+            "avg_duration": {"$divide": ["$total_duration", "$events"]},
+        }},
+        {"$merge": {"into": REPORTS_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def zen_pipeline(start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Daily zen session counts, users, average duration and completions per session type"""
+    return [
+        {"$match": {"created_at": {"$gte": start, "$lt": end}}},
+        {"$group": {
+            "_id": {"day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "feature": "$session_type"},
+            "events": {"$sum": 1},
+            "users": {"$addToSet": "$user_id"},
+            "total_duration": {"$sum": "$duration"},
+            "completed": {"$sum": {"$cond": ["$completed", 1, 0]}},
+        }},
+        {"$project": {
+            "_id": {"day": "$_id.day", "source": "zen_sessions", "feature": "$_id.feature"},
+            "day": "$_id.day",
+            "source": "zen_sessions",
+            "feature": "$_id.feature",
+            "events": 1,
+            "active_users": {"$size": "$users"},
+            "total_duration": 1,
+            "avg_duration": {"$divide": ["$total_duration", "$events"]},
+            "completed": 1,
+        }},
+        {"$merge": {"into": REPORTS_COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+class DailyUsageReports:
+    """Materialize complete UTC days into ``daily_usage_reports`` with $merge.
+
+    Only days after the last materialized one are aggregated, a few days per
+    pipeline run, and the source scans read from a secondary when one exists.
+    """
+
+    def __init__(self, db, chunk_days: int = 7) -> None:
+        self.db = db
+        self.chunk_days = chunk_days
+
+    def source(self, name: str):
+        return self.db.get_collection(name, read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    async def ensure_indexes(self) -> None:
+        await self.db[REPORTS_COLLECTION].create_index([("day", ASCENDING), ("source", ASCENDING)])
+
+    async def first_day(self) -> Optional[datetime]:
+        firsts = []
+        for name in ("usage_analytics", "zen_sessions"):
+            doc = await self.source(name).find_one({}, {"created_at": 1}, sort=[("created_at", ASCENDING)])
+            if doc is not None and doc.get("created_at") is not None:
+                firsts.append(day_start(doc["created_at"]))
+        return min(firsts) if firsts else None
+
+    async def pending_range(self) -> Optional[Tuple[datetime, datetime]]:
+        """[start, end) of complete days not materialized yet"""
+        state = await self.db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        if state is not None:
+            start = state["materialized_until"]
+        else:
+            start = await self.first_day()
+            if start is None:
+                return None
+        end = day_start(datetime.now(timezone.utc))
+        return (start, end) if start < end else None
+
+    async def materialize(self, keep_lease: Optional[Callable[[], Awaitable[bool]]] = None) -> int:
+        """Aggregate every new complete day, returning how many days were processed.
+
+        ``keep_lease`` is awaited before each chunk; once it returns False
+        another worker owns the job and this run stops where it is.
+        """
+        pending = await self.pending_range()
+        if pending is None:
+            return 0
+        start, end = pending
+        processed = 0
+        while start < end:
+            if keep_lease is not None and not await keep_lease():
+                logger.warning("Lost the usage reports lease, stopping this run")
+                break
+            chunk_end = min(start + timedelta(days=self.chunk_days), end)
+            await self.source("usage_analytics").aggregate(usage_pipeline(start, chunk_end)).to_list(None)
+            await self.source("zen_sessions").aggregate(zen_pipeline(start, chunk_end)).to_list(None)
+            # Record progress per chunk so a restart resumes where it stopped
+            await self.db[STATE_COLLECTION].update_one(
+                {"_id": STATE_ID}, {"$set": {"materialized_until": chunk_end}}, upsert=True
+            )
+            processed += (chunk_end - start).days
+            start = chunk_end
+        logger.info(f"Materialized {processed} days of usage reports")
+        return processed
+
+    async def load(self, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        query: Dict[str, Any] = {}
+        if start or end:
+            query["day"] = {k: v for k, v in (("$gte", start), ("$lte", end)) if v}
+        docs = await self.db[REPORTS_COLLECTION].find(query, {"_id": 0}).sort(
+            [("day", ASCENDING), ("source", ASCENDING), ("feature", ASCENDING)]
+        ).to_list(None)
+        return pd.DataFrame(docs, columns=REPORT_COLUMNS)
+
+
+def export_frame(frame: pd.DataFrame, fmt: str) -> Tuple[bytes, str]:
+    """Serialize a report frame as CSV or Parquet, returning (body, media type)"""
+    if fmt == "parquet":
+        buffer = io.BytesIO()
+        # Needs pyarrow or fastparquet; pandas raises ImportError otherwise
+        frame.to_parquet(buffer, index=False)
+        return buffer.getvalue(), "application/vnd.apache.parquet"
+    return frame.to_csv(index=False).encode(), "text/csv"
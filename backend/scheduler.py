@@ -0,0 +1,86 @@
+"""Minimal in-process asyncio job scheduler with cross-worker leases."""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+LEASE_COLLECTION = "job_leases"
+
+# Extends the caller's lease; False once another worker has taken it over
+KeepLease = Callable[[], Awaitable[bool]]
+
+
+class JobScheduler:
+    """Run registered coroutines periodically on the event loop.
+
+    Every worker runs the scheduler, but a job only executes on the worker that
+    holds its lease in ``job_leases``, so one run happens per interval.
+
+    A lease lasts one interval. Jobs that can run longer are registered with
+    ``fenced=True`` and called with a ``KeepLease``; they await it before each
+    checkpoint and stop when it returns False, so a run that outlasts its
+    lease never writes alongside the worker that took it over.
+    """
+
+    def __init__(self, db) -> None:
+        self.db = db
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.jobs: List[Tuple[str, float, Callable[..., Awaitable[None]], bool]] = []
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def every(self, name: str, interval: float, job: Callable[..., Awaitable[None]], fenced: bool = False) -> None:
+        self.jobs.append((name, interval, job, fenced))
+
+    async def acquire_lease(self, name: str, duration: float) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db[LEASE_COLLECTION].find_one_and_update(
+                {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=duration)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            return False
+        return True
+
+    async def renew_lease(self, name: str, duration: float) -> bool:
+        """Extend a lease this worker holds by ``duration``; False if another worker owns it now"""
+        result = await self.db[LEASE_COLLECTION].update_one(
+            {"_id": name, "owner": self.owner},
+            {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=duration)}},
+        )
+        return result.matched_count > 0
+
+    async def _loop(self, name: str, interval: float, job: Callable[..., Awaitable[None]], fenced: bool) -> None:
+        while True:
+            try:
+                if await self.acquire_lease(name, interval):
+                    if fenced:
+                        await job(partial(self.renew_lease, name, interval))
+                    else:
+                        await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduled job {name} failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        for name, interval, job, fenced in self.jobs:
+            if name not in self._tasks:
+                self._tasks[name] = loop.create_task(self._loop(name, interval, job, fenced))
+
+    async def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
@@ -0,0 +1,305 @@
+"""Keyword search over a user's own CBT journal through a blind term index."""
+import base64
+import binascii
+import html
+import json
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from storage import SEARCH_TERMS_FIELD
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset(
+    "a am an and are as at be but by for from had has have he her him his i if in into is it its me my myself "
+    "no not of on or our she so than that the their them then there they this to too was we were what when "
+    "which who will with you your".split()
+)
+# Matches in the negative thought count more than matches in the answers
+FIELD_WEIGHTS = {"negative_thought": 2.0, "answer": 1.0}
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+SNIPPET_CHARS = 80
+MAX_SNIPPETS = 2
+
+BACKFILL_STATE = "search_backfill"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def stem(word: str) -> str:
+    """Light suffix stripping so "exams", "studied" and "worrying" match "exam", "study" and "worry" """
+    for suffix, replacement in (("ies", "y"), ("ied", "y"), ("ing", ""), ("ed", ""), ("s", "")):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                break
+            return word[: -len(suffix)] + replacement
+    return word
+
+
+def normalize(word: str) -> Optional[str]:
+    word = word.lower()
+    if len(word) < 2 or word in STOPWORDS:
+        return None
+    return stem(word)
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in (normalize(match.group()) for match in WORD.finditer(text)) if term]
+
+
+def session_texts(doc: Dict[str, Any]) -> Iterator[Tuple[str, str]]:
+    """(field, text) pairs that are searchable: the thought and every answer"""
+    if doc.get("negative_thought"):
+        yield "negative_thought", doc["negative_thought"]
+    for qa in doc.get("questions_and_answers") or []:
+        if isinstance(qa, dict) and qa.get("answer"):
+            yield "answer", str(qa["answer"])
+
+
+def index_terms(doc: Dict[str, Any]) -> Set[str]:
+    return {term for _, text in session_texts(doc) for term in tokenize(text)}
+
+
+def highlight(text: str, terms: Set[str]) -> Optional[str]:
+    """A window of ``text`` around its first matching word, HTML-escaped, with matches in <mark>"""
+    matches = [m for m in WORD.finditer(text) if normalize(m.group()) in terms]
+    if not matches:
+        return None
+    start = max(0, matches[0].start() - SNIPPET_CHARS // 4)
+    end = min(len(text), start + SNIPPET_CHARS)
+    if start > 0:
+        # Don't open the snippet mid-word
+        space = text.find(" ", start, matches[0].start())
+        start = space + 1 if space != -1 else start
+    parts = ["…" if start > 0 else ""]
+    position = start
+    for match in matches:
+        if match.start() >= end:
+            break
+        parts += [html.escape(text[position:match.start()]), f"<mark>{html.escape(match.group())}</mark>"]
+        position = match.end()
+    parts += [html.escape(text[position:max(end, position)]), "…" if max(end, position) < len(text) else ""]
+    return "".join(parts)
+
+
+def encode_cursor(score: float, session_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([score, session_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        score, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), str(session_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid search cursor")
+
+
+def rank(docs: List[Dict[str, Any]], terms: Set[str]) -> List[Tuple[float, Dict[str, Any]]]:
+    """BM25 over the candidate set, with field weights; ordered by score, then id"""
+    frequencies = []
+    for doc in docs:
+        counts: Counter = Counter()
+        length = 0
+        for field, text in session_texts(doc):
+            tokens = tokenize(text)
+            length += len(tokens)
+            for token in tokens:
+                if token in terms:
+                    counts[token] += FIELD_WEIGHTS[field]
+        frequencies.append((counts, length))
+    if not docs:
+        return []
+    average = sum(length for _, length in frequencies) / len(docs) or 1.0
+    # Document frequencies within the candidates, which are every indexed session containing a term
+    df = Counter(term for counts, _ in frequencies for term in counts)
+    idf = {term: math.log(1 + (len(docs) - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+    ranked = []
+    for doc, (counts, length) in zip(docs, frequencies):
+        if not counts:
+            continue
+        norm = K1 * (1 - B + B * length / average)
+        total = sum(idf[term] * tf * (K1 + 1) / (tf + norm) for term, tf in counts.items())
+        # Rounded so the score survives the cursor roundtrip exactly
+        ranked.append((round(total, 6), doc))
+    ranked.sort(key=lambda item: (-item[0], item[1].get("id", "")))
+    return ranked
+
+
+class JournalSearch:
+    """Ranked, paginated search within one user's CBT sessions.
+
+    Sessions carry the keyword terms of their thought and answers, blinded
+    with the user's index key when encryption is on, in an indexed field. A
+    query looks up the newest ``max_candidates`` sessions containing any query
+    term, decrypts just those, and ranks, pages and highlights them in memory,
+    so its cost follows the number of matches rather than the journal length.
+    Older matches are not ranked at all; the response says so with
+    ``truncated`` and the caller can narrow ``since``/``until`` to reach them.
+    With an ``archive``, archived sessions are candidates too, when the
+    newest hot matches don't already fill the candidate set.
+    """
+
+    def __init__(self, storage, cipher, max_candidates: int = 500, archive=None) -> None:
+        self.storage = storage
+        self.cipher = cipher
+        self.max_candidates = max_candidates
+        self.archive = archive
+
+    async def index(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """A copy of the (plaintext) session carrying its search terms"""
+        terms = await self.cipher.blind(doc["user_id"], index_terms(doc), create=True)
+        return {**doc, SEARCH_TERMS_FIELD: terms}
+
+    async def terms_for(self, docs: List[Dict[str, Any]]) -> List[List[str]]:
+        """Search terms of each stored (possibly sealed) session; none for sessions that can't be read"""
+        readable = {doc.get("id"): doc for doc in await self.cipher.decrypt_many(docs)}
+        terms = []
+        for doc in docs:
+            plain = readable.get(doc.get("id"))
+            terms.append(await self.cipher.blind(doc["user_id"], index_terms(plain), create=True) if plain else [])
+        return terms
+
+    async def search(
+        self,
+        user_id: str,
+        query: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        terms = set(tokenize(query))
+        after = decode_cursor(cursor) if cursor else None
+        if not terms:
+            return {"results": [], "next_cursor": None, "truncated": False}
+        blinded = await self.cipher.blind(user_id, terms)
+        # One more than is ranked, to tell whether anything was left out
+        wanted = self.max_candidates + 1
+        candidates = await self.storage.cbt_sessions.search(user_id, blinded, since, until, limit=wanted)
+        if self.archive is not None and len(candidates) < wanted and self.archive.reaches_archive(since):
+            candidates += await self.archive.search_archived("cbt", user_id, blinded, since, until, limit=wanted - len(candidates))
+        truncated = len(candidates) > self.max_candidates
+        candidates = await self.cipher.decrypt_many(candidates[:self.max_candidates])
+        ranked = rank(candidates, terms)
+        if after is not None:
+            # Keyset: everything strictly after the last result of the previous page
+            ranked = [(score, doc) for score, doc in ranked if (-score, doc.get("id", "")) > (-after[0], after[1])]
+        page = ranked[:limit]
+        results = []
+        for score, doc in page:
+            snippets = []
+            for field, text in session_texts(doc):
+                snippet = highlight(text, terms)
+                if snippet is not None:
+                    snippets.append({"field": field, "text": snippet})
+                if len(snippets) == MAX_SNIPPETS:
+                    break
+            results.append({"session": doc, "score": score, "snippets": snippets})
+        next_cursor = encode_cursor(page[-1][0], page[-1][1].get("id", "")) if len(ranked) > limit else None
+        return {"results": results, "next_cursor": next_cursor, "truncated": truncated}
+
+
+class SearchBackfill:
+    """Index the CBT sessions written before search existed.
+
+    Sessions created before the first run are streamed oldest first, decrypted
+    and given their search terms a batch at a time, at a bounded duty cycle
+    and pausing while ``is_busy``; the last indexed ``created_at`` is saved in
+    job state after every batch, so the backfill resumes where it stopped.
+    Archived buckets are reindexed after the hot collection. Each
+    ``run_once`` returns after ``budget_seconds``, so a scheduler lease
+    covers it; the next run continues.
+    """
+
+    def __init__(
+        self,
+        storage,
+        search: JournalSearch,
+        archive=None,
+        batch_size: int = 500,
+        duty_cycle: float = 0.5,
+        budget_seconds: float = 300.0,
+        is_busy: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.storage = storage
+        self.search = search
+        self.archive = archive
+        self.batch_size = batch_size
+        self.duty_cycle = duty_cycle
+        self.budget_seconds = budget_seconds
+        self.is_busy = is_busy or (lambda: False)
+        self._task: Optional[asyncio.Task] = None
+
+    async def throttle(self, elapsed: float) -> None:
+        await asyncio.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+        while self.is_busy():
+            await asyncio.sleep(1.0)
+
+    async def run_once(self) -> bool:
+        """Index for up to ``budget_seconds``; True once everything is indexed"""
+        state = await self.storage.job_state.get(BACKFILL_STATE)
+        if state is None:
+            # Sessions written from now on are indexed on insert
+            state = {"until": datetime.now(timezone.utc), "indexed_until": None, "sessions": 0, "buckets": 0, "completed_at": None}
+            await self.storage.job_state.save(BACKFILL_STATE, state)
+        if state.get("completed_at") is not None:
+            return True
+        deadline = time.monotonic() + self.budget_seconds
+        since = state["indexed_until"] or EPOCH
+        async for batch in self.storage.cbt_sessions.scan_range(since, state["until"], self.batch_size):
+            started = time.monotonic()
+            terms = await self.search.terms_for(batch)
+            await self.storage.cbt_sessions.set_search_terms({doc["id"]: t for doc, t in zip(batch, terms)})
+            state["indexed_until"] = batch[-1]["created_at"]
+            state["sessions"] += len(batch)
+            await self.storage.job_state.save(BACKFILL_STATE, state)
+            if time.monotonic() >= deadline:
+                return False
+            await self.throttle(time.monotonic() - started)
+        while self.archive is not None:
+            started = time.monotonic()
+            reindexed = await self.archive.reindex_batch("cbt", self.search.terms_for)
+            if not reindexed:
+                break
+            state["buckets"] = state.get("buckets", 0) + reindexed
+            await self.storage.job_state.save(BACKFILL_STATE, state)
+            if time.monotonic() >= deadline:
+                return False
+            await self.throttle(time.monotonic() - started)
+        state["completed_at"] = datetime.now(timezone.utc)
+        await self.storage.job_state.save(BACKFILL_STATE, state)
+        logger.info(f"Search backfill complete: {state['sessions']} sessions, {state.get('buckets', 0)} archived buckets")
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Search backfill failed: {str(e)}")
+                await asyncio.sleep(60)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
@@ -1,24 +1,261 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Header, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.exceptions import ExceptionMiddleware
+from starlette.requests import ClientDisconnect
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import json
 import logging
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+from collections import OrderedDict
+from compression import CompressionMiddleware, CompressionPolicy
+from cache import LocalCache, ChangeStreamInvalidator
+from archive import SessionArchiver
+from events import EventHub, EVENTS_COLLECTION
+from access_log import AccessLogMiddleware, MongoTimingListener, configure_logging
+from batch import dispatch_batch
+from reports import DailyUsageReports, export_frame
+from moods import MoodTrends, timeline as mood_timeline
+from distortions import DistortionStats, primary as primary_distortion
+from erasure import AccountEraser
+from profiler import SamplingProfiler
+from scheduler import JobScheduler
+from encryption import FieldCipher, load_master_key
+from recommendations import RecommendationTable
+from search import JournalSearch, SearchBackfill
+from telemetry import BreathTelemetry, decode as decode_telemetry
+from storage import MongoStorage, SQLiteStorage, read_preference
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from tracing import BatchExporter, MongoSpanListener, TailSampler, Tracer, TracingMiddleware
+from admission import (
+    AdmissionConfig, AdmissionMiddleware, LoopLagProbe, PoolWaitMonitor, RateLimit, LOW, NORMAL, HIGH, parse_networks
+)
+from datetime import datetime, timedelta, timezone
 # from emergentintegrations.llm.chat import LlmChat, UserMessage
 import asyncio
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging: JSON lines written by a background listener thread
+log_listener = configure_logging(logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tracing is enabled by TRACE_EXPORT: a file path or an OTLP/HTTP collector URL
+trace_export = os.environ.get('TRACE_EXPORT')
+trace_exporter = BatchExporter(trace_export) if trace_export else None
+tracer = Tracer(
+    TailSampler(
+        keep_ratio=float(os.environ.get('TRACE_KEEP_SLOWEST', '0.05')),
+        baseline_rate=float(os.environ.get('TRACE_BASELINE_RATE', '0.01')),
+    ),
+    trace_exporter,
+)
+
+# STORAGE_BACKEND=sqlite keeps the handlers' data in one local file and needs no
+# MongoDB server; the Mongo-only features below (cross-worker cache invalidation,
+# event replay, archival, idempotency keys, reports) are then switched off
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+use_mongo = STORAGE_BACKEND != 'sqlite'
+
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+mongo_url = os.environ['MONGO_URL'] if use_mongo else os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+pool_monitor = PoolWaitMonitor()
+mongo_listeners = [pool_monitor, MongoTimingListener()]
+if trace_exporter is not None:
+    mongo_listeners.append(MongoSpanListener())
+client = AsyncIOMotorClient(mongo_url, event_listeners=mongo_listeners)
+db = client[os.environ['DB_NAME'] if use_mongo else os.environ.get('DB_NAME', 'serenity')]
+
+if use_mongo:
+    # List and analytics reads follow MONGO_READ_PREFERENCE; writes and
+    # read-your-writes reads stay consistent through causal sessions
+    storage = MongoStorage(
+        db,
+        read_pref=read_preference(
+            os.environ.get('MONGO_READ_PREFERENCE', 'secondaryPreferred'),
+            int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '-1')),
+        ),
+        causal_ttl=float(os.environ.get('CAUSAL_TOKEN_TTL_SECONDS', '300')),
+    )
+else:
+    storage = SQLiteStorage(
+        os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'serenity.db')),
+        readers=int(os.environ.get('SQLITE_READERS', '4')),
+    )
+
+# CBT content is sealed with per-user data keys wrapped by DATA_ENCRYPTION_KEY;
+# without the key sessions are stored in plaintext as before
+CBT_ENCRYPTED_FIELDS = ("negative_thought", "questions_and_answers")
+cbt_cipher = FieldCipher(
+    load_master_key(os.environ.get('DATA_ENCRYPTION_KEY')),
+    storage.data_keys,
+    fields=CBT_ENCRYPTED_FIELDS,
+    cache_size=int(os.environ.get('DATA_KEY_CACHE_SIZE', '10000')),
+)
+if not cbt_cipher.enabled:
+    logger.warning("DATA_ENCRYPTION_KEY not set, CBT sessions are stored unencrypted")
+
+# Per-worker read cache, invalidated across workers by a change stream
+cache = LocalCache(ttl=float(os.environ.get('CACHE_TTL_SECONDS', '300')))
+
+# Article rankings per (mood, identity), rebuilt when articles or favorites change
+recommendations = RecommendationTable(
+    storage,
+    min_interval=float(os.environ.get('RECOMMENDATIONS_MIN_INTERVAL_SECONDS', '5')),
+    favorites_interval=float(os.environ.get('RECOMMENDATIONS_FAVORITES_INTERVAL_SECONDS', '60')),
+    refresh_interval=float(os.environ.get('RECOMMENDATIONS_REFRESH_SECONDS', '600')),
+    # Both are defined further down; an empty catalog is seeded like the listing does
+    seed=lambda: seed_articles(),
+    model=lambda **article: Article(**article),
+)
+
+def invalidate_sessions(kind: str, user_id: str) -> None:
+    """Evict what a session write changes here; other workers hear it from the change stream"""
+    cache.invalidate(f"{kind}_sessions", user_id)
+    cache.invalidate("mood_timeline", user_id)
+
+def on_cache_invalidate(namespace: str, key: Optional[str]) -> None:
+    if namespace == "articles":
+        recommendations.mark_stale()
+    elif namespace == "favorites":
+        recommendations.mark_favorites_stale()
+
+cache_invalidator = ChangeStreamInvalidator(
+    db,
+    cache,
+    on_invalidate=on_cache_invalidate,
+    on_write=storage.causal.observe if storage.causal is not None else None,
+)
+
+# SSE fan-out; events from other workers arrive over the same change stream
+event_hub = EventHub(db if use_mongo else None, heartbeat_interval=float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15')))
+cache_invalidator.add_listener(EVENTS_COLLECTION, event_hub.handle_change)
+
+# Sessions older than ARCHIVE_AFTER_DAYS move to compressed cold storage; archival
+# backs off whenever live traffic shows loop lag or Mongo pool waiters
+session_archiver = SessionArchiver(
+    db,
+    max_age_days=float(os.environ.get('ARCHIVE_AFTER_DAYS', '180')),
+    batch_size=int(os.environ.get('ARCHIVE_BATCH_SIZE', '500')),
+    duty_cycle=float(os.environ.get('ARCHIVE_DUTY_CYCLE', '0.2')),
+    interval=float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600')),
+    is_busy=lambda: loop_lag_probe.lag > 0.02 or pool_monitor.waiting > 0,
+)
+
+# Keyword search within a user's journal over a blind term index kept with each session
+# (and each archive bucket); sessions from before the index existed are backfilled
+journal_search = JournalSearch(
+    storage,
+    cbt_cipher,
+    max_candidates=int(os.environ.get('SEARCH_MAX_CANDIDATES', '500')),
+    archive=session_archiver if use_mongo else None,
+)
+SEARCH_BACKFILL_INTERVAL_SECONDS = float(os.environ.get('SEARCH_BACKFILL_INTERVAL_SECONDS', '600'))
+search_backfill = SearchBackfill(
+    storage,
+    journal_search,
+    archive=session_archiver if use_mongo else None,
+    batch_size=int(os.environ.get('SEARCH_BACKFILL_BATCH_SIZE', '500')),
+    # Within the scheduler lease, which lasts one interval
+    budget_seconds=SEARCH_BACKFILL_INTERVAL_SECONDS / 2,
+    is_busy=lambda: loop_lag_probe.lag > 0.02 or pool_monitor.waiting > 0,
+)
+
+# Stored responses for retried POSTs carrying an Idempotency-Key
+idempotency_store = IdempotencyStore(
+    db,
+    ttl_seconds=int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400')),
+    pending_seconds=float(os.environ.get('IDEMPOTENCY_PENDING_SECONDS', '60')),
+)
+
+# Account erasure: crypto-shred the data key, then delete the user's documents in
+# latency-adaptive batches, backing off under the same pressure signals as archival
+def on_user_erased(user_id: str) -> None:
+    for namespace in ("cbt_sessions", "zen_sessions", "favorites", "mood_timeline"):
+        cache.invalidate(namespace, user_id)
+    cache.invalidate("mood_trends")
+    recommendations.mark_favorites_stale()
+
+erasure_steps = [
+    ("user_preferences", storage.preferences.delete_user_batch),
+    ("cbt_sessions", storage.cbt_sessions.delete_user_batch),
+    ("zen_sessions", storage.zen_sessions.delete_user_batch),
+    ("favorite_articles", storage.favorites.delete_user_batch),
+    ("usage_analytics", storage.analytics.delete_user_batch),
+]
+if use_mongo:
+    erasure_steps += [
+        ("session_archive", session_archiver.delete_user_batch),
+        ("user_events", event_hub.delete_user_batch),
+        ("idempotency_keys", idempotency_store.delete_user_batch),
+    ]
+account_eraser = AccountEraser(
+    storage,
+    erasure_steps,
+    on_key_deleted=cbt_cipher.forget,
+    on_erased=on_user_erased,
+    max_batch=int(os.environ.get('ERASURE_MAX_BATCH', '2000')),
+    target_latency=float(os.environ.get('ERASURE_TARGET_LATENCY_MS', '50')) / 1000,
+    is_busy=lambda: loop_lag_probe.lag > 0.02 or pool_monitor.waiting > 0,
+)
+
+def on_erasure_change(change: Dict[str, Any]) -> None:
+    # Other workers drop their cached copy of an erased user's data key and stored responses
+    user_id = (change.get("fullDocument") or {}).get("user_id")
+    if user_id:
+        cbt_cipher.forget(user_id)
+        idempotency_store.forget_user(user_id)
+
+cache_invalidator.add_listener("erasure_jobs", on_erasure_change)
+
+# Periodic jobs; each runs on whichever worker holds its lease
+job_scheduler = JobScheduler(db)
+daily_usage_reports = DailyUsageReports(db)
+job_scheduler.every(
+    "daily_usage_reports",
+    float(os.environ.get('REPORTS_INTERVAL_SECONDS', '3600')),
+    daily_usage_reports.materialize,
+    fenced=True,
+)
+# Cohort mood trends; each run is a no-op unless new preferences arrived
+mood_trends = MoodTrends(storage, db, batch_size=int(os.environ.get('MOOD_TRENDS_BATCH_SIZE', '50000')))
+job_scheduler.every(
+    "mood_trends",
+    float(os.environ.get('MOOD_TRENDS_INTERVAL_SECONDS', '900')),
+    mood_trends.materialize,
+)
+# Daily cognitive-distortion counts over all CBT sessions, classified on a process pool
+distortion_stats = DistortionStats(
+    storage,
+    cbt_cipher,
+    db,
+    workers=int(os.environ.get('DISTORTION_WORKERS', '0')) or None,
+    batch_size=int(os.environ.get('DISTORTION_BATCH_SIZE', '2000')),
+)
+job_scheduler.every(
+    "distortion_stats",
+    float(os.environ.get('DISTORTION_INTERVAL_SECONDS', '3600')),
+    distortion_stats.materialize,
+    fenced=True,
+)
+# Search terms for sessions written before journal search; a no-op once complete
+job_scheduler.every("search_backfill", SEARCH_BACKFILL_INTERVAL_SECONDS, search_backfill.run_once)
+
+# Breathing telemetry streamed during zen sessions, reduced to packed arrays on the session
+TELEMETRY_RESOLUTION_MS = int(os.environ.get('TELEMETRY_RESOLUTION_MS', '250'))
+TELEMETRY_MAX_SAMPLES = int(os.environ.get('TELEMETRY_MAX_SAMPLES', '1000000'))
+TELEMETRY_MAX_LINE_BYTES = int(os.environ.get('TELEMETRY_MAX_LINE_BYTES', '1048576'))
+TELEMETRY_CHECKPOINT_SECONDS = float(os.environ.get('TELEMETRY_CHECKPOINT_SECONDS', '30'))
+# Sessions with a telemetry stream open on this worker
+streaming_sessions: set = set()
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -29,6 +266,7 @@ api_router = APIRouter(prefix="/api")
 # Define Models
 class UserPreferences(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = Field(default="anonymous")
     identity: str  # Student, Creative, Professional, Other
     current_mood: str  # Anxious, Unfocused, Sad, Stressed, Calm
     mood_frequency: str  # Just today, This week, For a while
@@ -51,6 +289,21 @@ class CBTSessionCreate(BaseModel):
     negative_thought: str
     questions_and_answers: List[Dict[str, str]]
 
+class CBTSearchSnippet(BaseModel):
+    field: str  # negative_thought, answer
+    text: str  # HTML-escaped, matches wrapped in <mark>
+
+class CBTSearchResult(BaseModel):
+    session: CBTSession
+    score: float
+    snippets: List[CBTSearchSnippet]
+
+class CBTSearchResponse(BaseModel):
+    results: List[CBTSearchResult]
+    next_cursor: Optional[str] = None
+    # More sessions matched than SEARCH_MAX_CANDIDATES; only the newest were ranked
+    truncated: bool = False
+
 class ZenSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str = Field(default="anonymous")
@@ -97,6 +350,25 @@ class UsageAnalyticsCreate(BaseModel):
     duration: Optional[int] = None
     metadata: Optional[Dict[str, Any]] = None
 
+class AccountErasure(BaseModel):
+    id: str
+    user_id: str
+    status: str  # 'queued', 'running', 'completed'
+    requested_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    step: Optional[str] = None  # collection being erased
+    deleted: Dict[str, int] = {}
+
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str  # e.g. /api/favorites?user_id=abc
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
 # Basic endpoints
 @api_router.get("/")
 async def root():
@@ -104,41 +376,91 @@ async def root():
 
 # User Preferences
 @api_router.post("/preferences", response_model=UserPreferences)
-async def create_user_preferences(input: UserPreferencesCreate):
+async def create_user_preferences(input: UserPreferencesCreate, user_id: str = "anonymous"):
     # Generate theme colors based on mood
     theme_colors = generate_theme_colors(input.current_mood, input.identity)
     
-    prefs_dict = input.dict()
-    prefs_dict['theme_colors'] = theme_colors
-    prefs_obj = UserPreferences(**prefs_dict)
+    prefs = new_document(user_id=user_id, **input.model_dump(), theme_colors=theme_colors)
+    prefs_obj = UserPreferences.model_construct(**prefs)
     
-    await db.user_preferences.insert_one(prefs_obj.dict())
+    await storage.preferences.insert(prefs)
+    cache.invalidate("mood_timeline", user_id)
+    cache.invalidate("mood_trends")
     return prefs_obj
 
 @api_router.get("/preferences", response_model=List[UserPreferences])
-async def get_user_preferences():
-    preferences = await db.user_preferences.find().to_list(1000)
+async def get_user_preferences(user_id: Optional[str] = None):
+    if user_id is not None:
+        preferences = await storage.preferences.find_by_user(user_id)
+    else:
+        preferences = await storage.preferences.list()
     return [UserPreferences(**pref) for pref in preferences]
 
+@api_router.get("/preferences/timeline")
+async def get_mood_timeline(user_id: str = "anonymous", days: int = 90, window_days: int = 7):
+    """Mood reports over time with rolling distribution, transitions and zen/CBT usage correlation"""
+    if not 1 <= days <= 730 or not 1 <= window_days <= 90:
+        raise HTTPException(status_code=400, detail="days must be 1-730 and window_days 1-90")
+    # Cached until the user's preferences or sessions change or the UTC day rolls
+    # over (the daily series ends today); only the default view is cached
+    default_view = days == 90 and window_days == 7
+    now = datetime.now(timezone.utc)
+    if default_view:
+        cached = cache.get("mood_timeline", user_id)
+        if cached is not None and cached[0] == now.date():
+            return cached[1]
+    generation = cache.generation
+    preferences = await storage.preferences.find_by_user(user_id)
+    since = now - timedelta(days=days + window_days)
+    # Only the timestamps: sessions carry encrypted CBT content and packed zen telemetry
+    usage = {kind: await storage.sessions(kind).created_at_by_user(user_id, since) for kind in ("zen", "cbt")}
+    result = jsonable_encoder(mood_timeline(preferences, usage, now, days, window_days))
+    if default_view:
+        cache.set("mood_timeline", user_id, (now.date(), result), generation)
+    return result
+
 # CBT Sessions
 @api_router.post("/cbt-sessions", response_model=CBTSession)
 async def create_cbt_session(input: CBTSessionCreate):
-    session_dict = input.dict()
-    session_obj = CBTSession(**session_dict)
-    await db.cbt_sessions.insert_one(session_obj.dict())
+    session = new_document(user_id="anonymous", **input.model_dump())
+    session_obj = CBTSession.model_construct(**session)
+    await storage.cbt_sessions.insert(await cbt_cipher.encrypt(await journal_search.index(session)))
+    invalidate_sessions("cbt", session_obj.user_id)
+    # The event log is kept in user_events, so it only carries content that is stored in the clear
+    published = jsonable_encoder(session_obj, exclude=set(CBT_ENCRYPTED_FIELDS) if cbt_cipher.enabled else None)
+    await event_hub.publish(session_obj.user_id, "cbt_sessions", {"op": "created", "session": published})
     return session_obj
 
 @api_router.get("/cbt-sessions", response_model=List[CBTSession])
-async def get_cbt_sessions(user_id: str = "anonymous"):
-    sessions = await db.cbt_sessions.find({"user_id": user_id}).to_list(1000)
+async def get_cbt_sessions(user_id: str = "anonymous", since: Optional[datetime] = None, until: Optional[datetime] = None):
+    sessions = await find_sessions("cbt", user_id, since, until)
     return [CBTSession(**session) for session in sessions]
 
+@api_router.get("/cbt-sessions/search", response_model=CBTSearchResponse)
+async def search_cbt_sessions(
+    q: str,
+    user_id: str = "anonymous",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+):
+    """Rank a user's sessions by relevance to ``q``; pass ``next_cursor`` back as ``cursor`` for the next page"""
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    try:
+        return await journal_search.search(user_id, q, since, until, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.delete("/cbt-sessions/{session_id}")
 async def delete_cbt_session(session_id: str, user_id: str = "anonymous"):
     """Delete a CBT session"""
-    result = await db.cbt_sessions.delete_one({"id": session_id, "user_id": user_id})
-    if result.deleted_count == 0:
+    deleted = await storage.cbt_sessions.delete(user_id, session_id)
+    if not deleted and not (use_mongo and await session_archiver.delete_archived("cbt", user_id, session_id)):
         raise HTTPException(status_code=404, detail="Session not found")
+    invalidate_sessions("cbt", user_id)
+    await event_hub.publish(user_id, "cbt_sessions", {"op": "deleted", "id": session_id})
     return {"message": "Session deleted successfully"}
 
 @api_router.post("/cbt-sessions/sync")
@@ -149,18 +471,29 @@ async def sync_cbt_sessions(sessions_data: Dict[str, Any], user_id: str = "anony
         synced_count = 0
         
         for session_data in sessions:
-            # Check if session already exists
-            existing = await db.cbt_sessions.find_one({"id": session_data.get("id")})
-            if not existing:
-                # Create new session
-                session_data["user_id"] = user_id
-                if "created_at" in session_data and isinstance(session_data["created_at"], str):
-                    session_data["created_at"] = datetime.fromisoformat(session_data["created_at"].replace('Z', '+00:00'))
-                
-                session_obj = CBTSession(**session_data)
-                await db.cbt_sessions.insert_one(session_obj.dict())
-                synced_count += 1
+            with tracer.span("sync.item") as item_span:
+                inserted = False
+                # Check if session already exists
+                existing = await storage.cbt_sessions.get(session_data.get("id"))
+                if not existing and not (use_mongo and await session_archiver.is_archived("cbt", session_data.get("id"))):
+                    # Create new session
+                    with tracer.span("sync.validate"):
+                        session_data["user_id"] = user_id
+                        if "created_at" in session_data and isinstance(session_data["created_at"], str):
+                            session_data["created_at"] = datetime.fromisoformat(session_data["created_at"].replace('Z', '+00:00'))
+                        
+                        session_obj = CBTSession(**session_data)
+                    indexed = await journal_search.index(session_obj.dict())
+                    await storage.cbt_sessions.insert(await cbt_cipher.encrypt(indexed))
+                    synced_count += 1
+                    inserted = True
+                if item_span is not None:
+                    # Not just "not existing": an archived session is skipped too
+                    item_span.attributes["inserted"] = inserted
         
+        if synced_count:
+            invalidate_sessions("cbt", user_id)
+            await event_hub.publish(user_id, "cbt_sessions", {"op": "synced", "count": synced_count})
         return {"message": f"Synced {synced_count} sessions successfully"}
     except Exception as e:
         logger.error(f"Error syncing sessions: {str(e)}")
@@ -213,10 +546,10 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
     """Generate personalized CBT questions using AI based on the user's negative thought"""
     
     # Analyze the negative thought and create specific questions
-    thought = request.negative_thought.lower()
+    distortion = primary_distortion(request.negative_thought)
     
     # Different question sets based on thought patterns
-    if "fail" in thought or "failure" in thought:
+    if distortion == "fear_of_failure":
         return {
             "questions": [
                 {"id": 1, "question": f"Think of your biggest 'failure' that later led to something good. What did that teach you about the word 'failure'?", "type": "text"},
@@ -227,7 +560,7 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
                 {"id": 6, "question": f"What if '{request.negative_thought}' is your mind trying to keep you safe from something that might actually be worth the risk?", "type": "text"}
             ]
         }
-    elif "never" in thought or "always" in thought:
+    elif distortion == "all_or_nothing":
         return {
             "questions": [
                 {"id": 1, "question": f"Your brain is using absolute words like 'always' or 'never' - what is it trying to protect you from feeling?", "type": "text"},
@@ -238,7 +571,7 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
                 {"id": 6, "question": f"What would become possible in your life if '{request.negative_thought}' was only true 70% of the time instead of 100%?", "type": "text"}
             ]
         }
-    elif "stupid" in thought or "dumb" in thought or "idiot" in thought:
+    elif distortion == "labeling":
         return {
             "questions": [
                 {"id": 1, "question": f"Who first taught you that making mistakes meant you were stupid? What did that person gain by making you believe this?", "type": "text"},
@@ -249,7 +582,7 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
                 {"id": 6, "question": f"What if your inner critic calling you stupid is actually terrified that you're about to outgrow the small story it's been telling about you?", "type": "text"}
             ]
         }
-    elif "hate" in thought or "terrible" in thought or "awful" in thought:
+    elif distortion == "self_hatred":
         return {
             "questions": [
                 {"id": 1, "question": f"This intense self-hatred - what is it trying to protect you from? What would happen if you stopped hating yourself?", "type": "text"},
@@ -260,7 +593,7 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
                 {"id": 6, "question": f"What if the part of you that thinks '{request.negative_thought}' is actually the part that cares most deeply about your wellbeing, but doesn't know how to help?", "type": "text"}
             ]
         }
-    elif "worthless" in thought or "useless" in thought or "waste" in thought:
+    elif distortion == "worthlessness":
         return {
             "questions": [
                 {"id": 1, "question": f"If your worth was determined by your impact on just one person's life, whose life have you touched in a way that mattered?", "type": "text"},
@@ -271,7 +604,7 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
                 {"id": 6, "question": f"What if '{request.negative_thought}' is the voice of a system that profits from your self-doubt, not the voice of truth?", "type": "text"}
             ]
         }
-    elif "can't" in thought or "impossible" in thought or "too hard" in thought:
+    elif distortion == "helplessness":
         return {
             "questions": [
                 {"id": 1, "question": f"What would you attempt if you knew that 'I can't' was just your current skill level, not your permanent identity?", "type": "text"},
@@ -282,7 +615,7 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
                 {"id": 6, "question": f"What if '{request.negative_thought}' is your mind's way of avoiding the discomfort of growth?", "type": "text"}
             ]
         }
-    elif "alone" in thought or "nobody" in thought or "no one" in thought:
+    elif distortion == "loneliness":
         return {
             "questions": [
                 {"id": 1, "question": f"When you feel most alone, what are you really longing for - connection, understanding, or acceptance?", "type": "text"},
@@ -309,29 +642,114 @@ async def generate_dynamic_cbt_questions(request: DynamicQuestionRequest):
 # Zen Sessions
 @api_router.post("/zen-sessions", response_model=ZenSession)
 async def create_zen_session(input: ZenSessionCreate):
-    session_dict = input.dict()
-    session_obj = ZenSession(**session_dict)
-    await db.zen_sessions.insert_one(session_obj.dict())
+    session = new_document(user_id="anonymous", **input.model_dump())
+    session_obj = ZenSession.model_construct(**session)
+    await storage.zen_sessions.insert(session)
+    invalidate_sessions("zen", session_obj.user_id)
+    await event_hub.publish(session_obj.user_id, "zen_sessions", {"op": "created", "session": jsonable_encoder(session_obj)})
     return session_obj
 
 @api_router.get("/zen-sessions", response_model=List[ZenSession])
-async def get_zen_sessions(user_id: str = "anonymous"):
-    sessions = await db.zen_sessions.find({"user_id": user_id}).to_list(1000)
+async def get_zen_sessions(user_id: str = "anonymous", since: Optional[datetime] = None, until: Optional[datetime] = None):
+    sessions = await find_sessions("zen", user_id, since, until)
     return [ZenSession(**session) for session in sessions]
 
+@api_router.post("/zen-sessions/{session_id}/telemetry")
+async def ingest_zen_telemetry(session_id: str, request: Request, user_id: str = "anonymous", pattern: str = "478"):
+    """Stream breathing samples for an active zen session.
+
+    The body is NDJSON, one batch per line: {"t": [ms...], "phase": [0-3...], "value": [...]}.
+    Batches are folded in as they arrive and the packed result is saved every
+    TELEMETRY_CHECKPOINT_SECONDS and at the end; a later stream for the same
+    session continues where the stored telemetry left off.
+    """
+    session = await storage.zen_sessions.get(session_id)
+    if session is None or session.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if session_id in streaming_sessions:
+        raise HTTPException(status_code=409, detail="A telemetry stream is already open for this session")
+    try:
+        telemetry = BreathTelemetry.resume(
+            session.get("telemetry"), pattern,
+            resolution_ms=TELEMETRY_RESOLUTION_MS, max_samples=TELEMETRY_MAX_SAMPLES,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def save() -> None:
+        await storage.zen_sessions.update(user_id, session_id, {"telemetry": telemetry.to_document()})
+        cache.invalidate("zen_sessions", user_id)
+
+    streaming_sessions.add(session_id)
+    try:
+        buffer = b""
+        saved_at = time.monotonic()
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            if len(buffer) > TELEMETRY_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail="Telemetry batch too large")
+            for line in lines:
+                if line.strip():
+                    telemetry.add(json.loads(line))
+            if time.monotonic() - saved_at >= TELEMETRY_CHECKPOINT_SECONDS:
+                await save()
+                saved_at = time.monotonic()
+        if buffer.strip():
+            telemetry.add(json.loads(buffer))
+    except ClientDisconnect:
+        # Keep what arrived; the client resumes with a new stream
+        await save()
+        raise
+    except OverflowError as e:
+        await save()
+        raise HTTPException(status_code=413, detail=str(e))
+    except (ValueError, TypeError, AttributeError) as e:
+        await save()
+        raise HTTPException(status_code=400, detail=f"Invalid telemetry batch: {str(e)}")
+    finally:
+        streaming_sessions.discard(session_id)
+    await save()
+    return {"samples": telemetry.samples, "summary": telemetry.summary()}
+
+@api_router.get("/zen-sessions/{session_id}/telemetry")
+async def get_zen_telemetry(session_id: str, user_id: str = "anonymous"):
+    """The session's downsampled breathing signal, phase runs and summary"""
+    session = await storage.zen_sessions.get(session_id)
+    if session is None or session.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not session.get("telemetry"):
+        raise HTTPException(status_code=404, detail="No telemetry recorded for this session")
+    return decode_telemetry(session["telemetry"])
+
 # Articles
 @api_router.get("/articles", response_model=List[Article])
 async def get_articles():
-    articles = await db.articles.find().to_list(1000)
-    if not articles:
-        # Seed some default articles
-        await seed_articles()
-        articles = await db.articles.find().to_list(1000)
+    articles = cache.get("articles")
+    if articles is None:
+        generation = cache.generation
+        articles = await storage.articles.list()
+        if not articles:
+            # Seed some default articles
+            await seed_articles()
+            generation = cache.generation
+            articles = await storage.articles.list()
+        cache.set("articles", None, articles, generation)
     return [Article(**article) for article in articles]
 
+@api_router.get("/articles/recommended", responses={200: {"model": List[Article]}})
+async def get_recommended_articles(mood: Optional[str] = None, identity: Optional[str] = None):
+    """Catalog ranked for a mood and identity, served from the precomputed table.
+
+    The table holds articles already validated as Article and encoded, so the
+    bytes are returned as they are; the schema is documented, not re-checked.
+    """
+    await recommendations.ensure_built()
+    return Response(recommendations.get(mood, identity), media_type="application/json")
+
 @api_router.get("/articles/{article_id}", response_model=Article)
 async def get_article(article_id: str):
-    article = await db.articles.find_one({"id": article_id})
+    article = await storage.articles.get(article_id)
     if not article:
         raise HTTPException(status_code=404, detail="Article not found")
     return Article(**article)
@@ -340,35 +758,50 @@ async def get_article(article_id: str):
 @api_router.post("/favorites", response_model=FavoriteArticle)
 async def add_favorite_article(article_id: str, user_id: str = "anonymous"):
     # Check if already favorited
-    existing = await db.favorite_articles.find_one({"user_id": user_id, "article_id": article_id})
+    existing = await storage.favorites.get(user_id, article_id)
     if existing:
         return FavoriteArticle(**existing)
     
     favorite = FavoriteArticle(user_id=user_id, article_id=article_id)
-    await db.favorite_articles.insert_one(favorite.dict())
+    await storage.favorites.insert(favorite.dict())
+    cache.invalidate("favorites", user_id)
+    recommendations.mark_favorites_stale()
+    await event_hub.publish(user_id, "favorites", {"op": "added", "article_id": article_id})
     return favorite
 
 @api_router.get("/favorites", response_model=List[str])
 async def get_favorite_articles(user_id: str = "anonymous"):
-    favorites = await db.favorite_articles.find({"user_id": user_id}).to_list(1000)
+    favorites = cache.get("favorites", user_id)
+    if favorites is None:
+        generation = cache.generation
+        favorites = await storage.favorites.list(user_id)
+        cache.set("favorites", user_id, favorites, generation)
     return [fav["article_id"] for fav in favorites]
 
 @api_router.delete("/favorites/{article_id}")
 async def remove_favorite_article(article_id: str, user_id: str = "anonymous"):
     """Remove an article from favorites"""
-    result = await db.favorite_articles.delete_one({"user_id": user_id, "article_id": article_id})
-    if result.deleted_count == 0:
+    if not await storage.favorites.delete(user_id, article_id):
         raise HTTPException(status_code=404, detail="Favorite not found")
+    cache.invalidate("favorites", user_id)
+    recommendations.mark_favorites_stale()
+    await event_hub.publish(user_id, "favorites", {"op": "removed", "article_id": article_id})
     return {"message": "Favorite removed successfully"}
 
 # Usage Analytics
 @api_router.post("/analytics", response_model=UsageAnalytics)
 async def track_usage(input: UsageAnalyticsCreate, user_id: str = "anonymous"):
     """Track user interactions for analytics"""
-    analytics_dict = input.dict()
-    analytics_dict['user_id'] = user_id
-    analytics_obj = UsageAnalytics(**analytics_dict)
-    await db.usage_analytics.insert_one(analytics_obj.dict())
+    analytics = new_document(user_id=user_id, **input.model_dump())
+    analytics_obj = UsageAnalytics.model_construct(**analytics)
+    await storage.analytics.insert(analytics)
+    # A hint to refresh the summary, sent on every analytics POST: not worth a second
+    # insert per request, so only this worker's connections get it and it isn't replayed
+    await event_hub.publish(user_id, "summary", {
+        "feature": analytics_obj.feature,
+        "action": analytics_obj.action,
+        "duration": analytics_obj.duration,
+    }, persist=False)
     return analytics_obj
 
 @api_router.get("/analytics/summary")
@@ -376,24 +809,14 @@ async def get_usage_summary(user_id: str = "anonymous"):
     """Get usage analytics summary for a user"""
     try:
         # Get total sessions by feature
-        pipeline = [
-            {"$match": {"user_id": user_id}},
-            {"$group": {
-                "_id": "$feature",
-                "total_sessions": {"$sum": 1},
-                "total_duration": {"$sum": "$duration"}
-            }}
-        ]
-        
-        feature_stats = await db.usage_analytics.aggregate(pipeline).to_list(100)
+        with tracer.span("summary.feature_stats"):
+            feature_stats = await storage.analytics.feature_stats(user_id)
         
         # Get recent activity (last 7 days)
         from datetime import timedelta
         week_ago = datetime.now(timezone.utc) - timedelta(days=7)
-        recent_activity = await db.usage_analytics.find({
-            "user_id": user_id,
-            "created_at": {"$gte": week_ago}
-        }).sort("created_at", -1).limit(20).to_list(20)
+        with tracer.span("summary.recent_activity"):
+            recent_activity = await storage.analytics.recent(user_id, week_ago, 20)
         
         return {
             "feature_stats": feature_stats,
@@ -412,7 +835,225 @@ async def get_usage_summary(user_id: str = "anonymous"):
         logger.error(f"Error getting usage summary: {str(e)}")
         return {"feature_stats": [], "recent_activity": [], "total_sessions": 0}
 
+# Batched requests
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '20'))
+BATCH_TIMEOUT_SECONDS = float(os.environ.get('BATCH_TIMEOUT_SECONDS', '10'))
+
+@api_router.post("/batch")
+async def batch_requests(input: BatchRequest, request: Request):
+    """Run several API calls in one round trip, concurrently and in process"""
+    if len(input.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    responses = await dispatch_batch(
+        batch_app,
+        request.scope,
+        [sub.model_dump() for sub in input.requests],
+        timeout=BATCH_TIMEOUT_SECONDS,
+    )
+    return {"responses": responses}
+
+# Live updates
+@api_router.get("/events")
+async def stream_events(user_id: str = "anonymous", last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events stream of the user's session, favorite and summary changes"""
+    return StreamingResponse(
+        event_hub.stream(user_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Global reports
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def require_admin(x_admin_token: Optional[str]) -> None:
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@api_router.get("/reports/daily-usage")
+async def get_daily_usage_report(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    format: str = "json",
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Materialized daily usage per feature; ``start``/``end`` are YYYY-MM-DD, inclusive"""
+    require_admin(x_admin_token)
+    if not use_mongo:
+        raise HTTPException(status_code=501, detail="Reports need the MongoDB storage backend")
+    if format not in ("json", "csv", "parquet"):
+        raise HTTPException(status_code=400, detail="format must be json, csv or parquet")
+    frame = await daily_usage_reports.load(start, end)
+    if format == "json":
+        return {"reports": jsonable_encoder(frame.astype(object).where(frame.notna(), None).to_dict("records"))}
+    try:
+        body, media_type = export_frame(frame, format)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed")
+    return Response(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="daily-usage.{format}"'},
+    )
+
+@api_router.get("/reports/mood-trends")
+async def get_mood_trends(x_admin_token: Optional[str] = Header(None)):
+    """Cohort mood distribution per week, transitions and zen/CBT usage effects"""
+    require_admin(x_admin_token)
+    trends = cache.get("mood_trends")
+    if trends is not None:
+        return trends
+    generation = cache.generation
+    if use_mongo:
+        # Materialized by the scheduled job
+        trends = await mood_trends.load()
+        if trends is None:
+            raise HTTPException(status_code=503, detail="Mood trends have not been computed yet")
+    else:
+        trends = await mood_trends.compute()
+    trends = jsonable_encoder(trends)
+    cache.set("mood_trends", None, trends, generation)
+    return trends
+
+@api_router.get("/reports/distortions")
+async def get_distortion_report(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    format: str = "json",
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Sessions per cognitive-distortion category and day; ``start``/``end`` are YYYY-MM-DD, inclusive"""
+    require_admin(x_admin_token)
+    if format not in ("json", "csv", "parquet"):
+        raise HTTPException(status_code=400, detail="format must be json, csv or parquet")
+    try:
+        since = datetime.fromisoformat(start) if start else datetime(1970, 1, 1)
+        until = datetime.fromisoformat(end) + timedelta(days=1) if end else datetime.now(timezone.utc).replace(tzinfo=None)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD")
+    if use_mongo:
+        # Complete days, materialized by the scheduled job
+        frame, throughput = await distortion_stats.load(start, end)
+    else:
+        frame, throughput = await distortion_stats.compute(since, until)
+    if format == "json":
+        return {"stats": frame.to_dict("records"), "throughput": throughput}
+    try:
+        body, media_type = export_frame(frame, format)
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed")
+    return Response(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="distortions.{format}"'},
+    )
+
+# Diagnostics
+profiler = SamplingProfiler()
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+
+@api_router.get("/admin/loop-lag")
+async def get_loop_lag(format: str = "json", x_admin_token: Optional[str] = Header(None)):
+    """This worker's event-loop scheduling delay histogram and its recent slow callbacks with stacks"""
+    require_admin(x_admin_token)
+    histogram = loop_lag_probe.histogram()
+    if format == "prometheus":
+        lines = [
+            "# HELP event_loop_lag_seconds Event-loop scheduling delay per probe tick",
+            "# TYPE event_loop_lag_seconds histogram",
+        ]
+        lines += [f'event_loop_lag_seconds_bucket{{le="{b["le"]}"}} {b["count"]}' for b in histogram["buckets"]]
+        lines += [f"event_loop_lag_seconds_sum {histogram['sum']}", f"event_loop_lag_seconds_count {histogram['count']}"]
+        return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or prometheus")
+    return {
+        "pid": os.getpid(),
+        "lag_ms": round(loop_lag_probe.lag * 1000, 3),
+        "slow_threshold_ms": loop_lag_probe.slow_threshold * 1000,
+        "histogram": histogram,
+        "slow_callbacks": list(loop_lag_probe.slow_callbacks),
+    }
+
+@api_router.get("/admin/profile")
+async def profile_worker(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    threads: str = "loop",
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Sample this worker for ``seconds`` and return collapsed stacks (flamegraph.pl, speedscope)"""
+    require_admin(x_admin_token)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    if threads not in ("loop", "all"):
+        raise HTTPException(status_code=400, detail="threads must be loop or all")
+    try:
+        if threads == "loop":
+            body = await profiler.profile_loop(seconds, interval_ms / 1000)
+        else:
+            body = await asyncio.to_thread(profiler.profile, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(
+        body,
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="profile-{os.getpid()}.folded"'},
+    )
+
+# Account erasure
+@api_router.delete("/users/{user_id}", response_model=AccountErasure, status_code=202)
+async def erase_user(user_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Queue erasure of everything stored about the user; poll the status endpoint for completion"""
+    require_admin(x_admin_token)
+    return await account_eraser.request(user_id)
+
+@api_router.get("/users/{user_id}/erasure", response_model=AccountErasure)
+async def get_user_erasure(user_id: str, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    job = await storage.erasures.get(user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No erasure requested for this user")
+    return job
+
 # Helper functions
+def new_document(**fields) -> Dict[str, Any]:
+    """Add server-generated fields to already validated input.
+
+    Handlers build the response with Model.model_construct(**doc), so the handler
+    itself doesn't validate the body a second time and the same dict is inserted
+    as-is. FastAPI still validates the returned model against ``response_model``
+    while serializing it, so a response is checked once on the way out as well.
+    """
+    return {"id": str(uuid.uuid4()), **fields, "created_at": datetime.now(timezone.utc)}
+
+async def find_sessions(kind: str, user_id: str, since: Optional[datetime], until: Optional[datetime]) -> List[Dict[str, Any]]:
+    """Load a user's sessions in a date range, reading the archive only when the range reaches it"""
+    namespace = f"{kind}_sessions"
+    full_history = since is None and until is None
+    if full_history:
+        cached = cache.get(namespace, user_id)
+        if cached is not None:
+            return cached
+    generation = cache.generation
+
+    sessions = await storage.sessions(kind).find_by_user(user_id, since, until)
+
+    if use_mongo and session_archiver.reaches_archive(since):
+        # A crash between archiving and deleting can leave a session in both places
+        hot_ids = {session.get("id") for session in sessions}
+        archived = await session_archiver.fetch_archived(kind, user_id, since, until)
+        sessions = [session for session in archived if session.get("id") not in hot_ids] + sessions
+
+    if kind == "cbt":
+        # One key lookup for the whole list; cached entries are already decrypted
+        sessions = await cbt_cipher.decrypt_many(sessions)
+
+    if full_history:
+        cache.set(namespace, user_id, sessions, generation)
+    return sessions
+
 def generate_theme_colors(mood: str, identity: str) -> Dict[str, str]:
     """Generate theme colors based on user's mood and identity"""
     base_themes = {
@@ -460,8 +1101,11 @@ def generate_theme_colors(mood: str, identity: str) -> Dict[str, str]:
     
     return base_themes.get(mood, base_themes["Calm"])
 
+# The article listing and the recommendation table may both find the catalog empty
+seed_lock = asyncio.Lock()
+
 async def seed_articles():
-    """Seed the database with sample wellness articles"""
+    """Seed the database with sample wellness articles, unless another caller just did"""
     sample_articles = [
         {
             "title": "Understanding Anxiety: A Gentle Guide",
@@ -530,11 +1174,103 @@ async def seed_articles():
         article = Article(**article_data)
         articles_to_insert.append(article.dict())
     
-    await db.articles.insert_many(articles_to_insert)
+    async with seed_lock:
+        if await storage.articles.list(limit=1):
+            return
+        await storage.articles.insert_many(articles_to_insert)
+    cache.invalidate("articles")
+    recommendations.mark_stale()
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Admission control: per-client token buckets and shedding of analytics before CBT writes
+loop_lag_probe = LoopLagProbe(slow_threshold=float(os.environ.get('LOOP_SLOW_CALLBACK_MS', '100')) / 1000)
+admission_config = AdmissionConfig(
+    limits={
+        LOW: RateLimit(
+            rate=float(os.environ.get('RATE_LIMIT_LOW_RPS', '2')),
+            burst=float(os.environ.get('RATE_LIMIT_LOW_BURST', '20')),
+        ),
+        NORMAL: RateLimit(
+            rate=float(os.environ.get('RATE_LIMIT_RPS', '10')),
+            burst=float(os.environ.get('RATE_LIMIT_BURST', '50')),
+        ),
+        HIGH: RateLimit(
+            rate=float(os.environ.get('RATE_LIMIT_HIGH_RPS', '10')),
+            burst=float(os.environ.get('RATE_LIMIT_HIGH_BURST', '50')),
+        ),
+    },
+    max_concurrency=int(os.environ.get('MAX_CONCURRENT_REQUESTS', '200')),
+    lag_soft=float(os.environ.get('SHED_LAG_SOFT_MS', '50')) / 1000,
+    lag_hard=float(os.environ.get('SHED_LAG_HARD_MS', '250')) / 1000,
+    pool_wait_soft=int(os.environ.get('SHED_POOL_WAIT_SOFT', '10')),
+    pool_wait_hard=int(os.environ.get('SHED_POOL_WAIT_HARD', '50')),
+    long_lived_paths=("/api/events",),
+    long_lived_suffixes=("/telemetry",),
+    trusted_proxies=parse_networks(os.environ.get('TRUSTED_PROXIES', '')),
+)
+# Shared by the middleware and batch sub-requests, so a batch spends the caller's budget
+admission_buckets = OrderedDict()
+
+# Batch sub-requests go straight to the router, skipping the other per-request middleware,
+# but each is admitted like a request of its own against the same client buckets
+batch_app = AdmissionMiddleware(
+    ExceptionMiddleware(app.router, handlers=app.exception_handlers),
+    config=admission_config,
+    lag_probe=loop_lag_probe,
+    pool_monitor=pool_monitor,
+    buckets=admission_buckets,
+)
+
+# Innermost so stored responses are uncompressed and replays skip validation and inserts
+if use_mongo:
+    app.add_middleware(
+        IdempotencyMiddleware,
+        store=idempotency_store,
+        paths=(
+            "/api/preferences",
+            "/api/cbt-sessions",
+            "/api/cbt-sessions/sync",
+            "/api/zen-sessions",
+            "/api/analytics",
+            "/api/favorites",
+        ),
+        # A created session echoes its thought and answers, which are encrypted at rest
+        sealed_paths=("/api/cbt-sessions",),
+        cipher=cbt_cipher,
+    )
+
+# Compress large JSON list responses; list routes with full content get a higher brotli quality
+default_compression = CompressionPolicy(
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+    gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4')),
+)
+list_compression = CompressionPolicy(
+    minimum_size=default_compression.minimum_size,
+    gzip_level=default_compression.gzip_level,
+    brotli_quality=int(os.environ.get('COMPRESSION_LIST_BROTLI_QUALITY', '6')),
+)
+app.add_middleware(
+    CompressionMiddleware,
+    default=default_compression,
+    routes={
+        "/api/articles": list_compression,
+        "/api/cbt-sessions": list_compression,
+        "/api/zen-sessions": list_compression,
+    },
+)
+
+# Admission control for whole requests; batch_app admits their sub-requests with the same buckets
+app.add_middleware(
+    AdmissionMiddleware,
+    config=admission_config,
+    lag_probe=loop_lag_probe,
+    pool_monitor=pool_monitor,
+    buckets=admission_buckets,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -543,13 +1279,81 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+if trace_exporter is not None:
+    app.add_middleware(TracingMiddleware, tracer=tracer)
+
+# Outermost so access records include time spent in admission control and CORS
+app.add_middleware(
+    AccessLogMiddleware,
+    sample_rate=float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', '0.1')),
+    slow_ms=float(os.environ.get('ACCESS_LOG_SLOW_MS', '1000')),
 )
-logger = logging.getLogger(__name__)
+
+async def create_indexes():
+    if not use_mongo:
+        return
+    try:
+        await idempotency_store.ensure_indexes()
+        await daily_usage_reports.ensure_indexes()
+        await distortion_stats.ensure_indexes()
+        await storage.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create indexes: {str(e)}")
+
+@app.on_event("startup")
+async def schedule_index_creation():
+    # In the background so an unreachable Mongo doesn't block startup
+    asyncio.get_running_loop().create_task(create_indexes())
+
+@app.on_event("startup")
+async def start_loop_lag_probe():
+    loop_lag_probe.start()
+
+@app.on_event("startup")
+async def start_trace_exporter():
+    if trace_exporter is not None:
+        trace_exporter.start()
+
+@app.on_event("startup")
+async def start_cache_invalidator():
+    if use_mongo:
+        cache_invalidator.start()
+    else:
+        # One process owns the SQLite file and sees every write, so its cache stays valid
+        cache.enabled = True
+    event_hub.start()
+    recommendations.start()
+
+@app.on_event("startup")
+async def start_session_archiver():
+    if use_mongo and os.environ.get('ARCHIVE_ENABLED', 'true').lower() == 'true':
+        session_archiver.start()
+
+@app.on_event("startup")
+async def start_job_scheduler():
+    if use_mongo:
+        job_scheduler.start()
+    else:
+        # A single SQLite worker runs the search backfill to completion itself
+        search_backfill.start()
+
+@app.on_event("startup")
+async def start_account_eraser():
+    account_eraser.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await loop_lag_probe.stop()
+    await job_scheduler.stop()
+    await distortion_stats.stop()
+    await cache_invalidator.stop()
+    await event_hub.stop()
+    await recommendations.stop()
+    await session_archiver.stop()
+    await account_eraser.stop()
+    await search_backfill.stop()
+    await storage.close()
+    client.close()
+    if trace_exporter is not None:
+        trace_exporter.stop()
+    log_listener.stop()
\ No newline at end of file
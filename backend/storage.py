@@ -0,0 +1,1110 @@
+"""Storage backends behind the API handlers: MongoDB through Motor, or embedded SQLite."""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+from archive import as_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Session field holding the (blinded) keyword terms that ``SessionRepository.search``
+# matches; it is kept in the index only and never returned with a session
+SEARCH_TERMS_FIELD = "search_terms"
+
+
+class UserDataRepository(ABC):
+    """A collection holding documents owned by one user each"""
+
+    @abstractmethod
+    async def delete_user_batch(self, user_id: str, limit: int) -> int:
+        """Delete up to ``limit`` of the user's documents, returning how many were deleted"""
+
+
+class PreferencesRepository(UserDataRepository):
+    @abstractmethod
+    async def insert(self, doc: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def list(self, limit: int = 1000) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def find_by_user(self, user_id: str, limit: int = 10000) -> List[Dict[str, Any]]:
+        """The user's preferences, oldest first"""
+
+    @abstractmethod
+    async def latest(self) -> Optional[datetime]:
+        """``created_at`` of the newest preferences of any user"""
+
+    @abstractmethod
+    def scan_moods(self, batch_size: int = 50000) -> AsyncIterator[List[Tuple[str, datetime, str]]]:
+        """Every (user_id, created_at, current_mood), in batches, for bulk analytics"""
+
+
+class SessionRepository(UserDataRepository):
+    """CBT or zen sessions; both are per-user and read by ``created_at`` range"""
+
+    @abstractmethod
+    async def insert(self, doc: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def find_by_user(
+        self, user_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None, limit: int = 1000
+    ) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def created_at_by_user(self, user_id: str, since: Optional[datetime] = None, limit: int = 10000) -> List[datetime]:
+        """Creation times of the user's sessions, oldest first, read without the documents"""
+
+    @abstractmethod
+    async def delete(self, user_id: str, session_id: str) -> bool: ...
+
+    @abstractmethod
+    async def update(self, user_id: str, session_id: str, fields: Dict[str, Any]) -> bool:
+        """Set top-level ``fields`` on the user's session; False if there is no such session"""
+
+    @abstractmethod
+    def scan_activity(self, batch_size: int = 50000) -> AsyncIterator[List[Tuple[str, datetime]]]:
+        """Every session's (user_id, created_at), in batches, for bulk analytics"""
+
+    @abstractmethod
+    def scan_range(self, since: datetime, until: datetime, batch_size: int = 2000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Every session created in [since, until), oldest first, in batches, for offline jobs"""
+
+    @abstractmethod
+    async def search(
+        self,
+        user_id: str,
+        terms: List[str],
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 500,
+    ) -> List[Dict[str, Any]]:
+        """A user's sessions indexed under any of ``terms``, newest first"""
+
+    @abstractmethod
+    async def set_search_terms(self, terms_by_id: Dict[str, List[str]]) -> None:
+        """Replace the indexed terms of each session in ``terms_by_id``, for backfills"""
+
+
+class ArticleRepository(ABC):
+    @abstractmethod
+    async def insert_many(self, docs: List[Dict[str, Any]]) -> None: ...
+
+    @abstractmethod
+    async def list(self, limit: int = 1000) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def get(self, article_id: str) -> Optional[Dict[str, Any]]: ...
+
+
+class FavoriteRepository(UserDataRepository):
+    @abstractmethod
+    async def insert(self, doc: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def get(self, user_id: str, article_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def list(self, user_id: str, limit: int = 1000) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def delete(self, user_id: str, article_id: str) -> bool: ...
+
+    @abstractmethod
+    async def counts_by_article(self) -> Dict[str, int]:
+        """Number of users who favorited each article"""
+
+
+class AnalyticsRepository(UserDataRepository):
+    @abstractmethod
+    async def insert(self, doc: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def feature_stats(self, user_id: str) -> List[Dict[str, Any]]:
+        """``{"_id": feature, "total_sessions": n, "total_duration": s}`` per feature"""
+
+    @abstractmethod
+    async def recent(self, user_id: str, since: datetime, limit: int = 20) -> List[Dict[str, Any]]:
+        """Events at or after ``since``, newest first"""
+
+
+class DataKeyRepository(ABC):
+    """Wrapped per-user data keys for field encryption"""
+
+    @abstractmethod
+    async def get_many(self, user_ids: List[str]) -> Dict[str, bytes]: ...
+
+    @abstractmethod
+    async def create(self, user_id: str, wrapped: bytes) -> bytes:
+        """Store a key unless the user already has one; returns the key that is kept"""
+
+    @abstractmethod
+    async def delete(self, user_id: str) -> bool: ...
+
+
+class ErasureRepository(ABC):
+    """Account erasure jobs, one per user"""
+
+    @abstractmethod
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def save(self, doc: Dict[str, Any], owner: Optional[str] = None) -> bool:
+        """Insert or replace the job for ``doc["user_id"]``.
+
+        With ``owner``, only replace a job still leased to ``owner``; False if another worker took it over.
+        """
+
+    @abstractmethod
+    async def claim(self, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Lease one unfinished job that is unleased, expired or already ``owner``'s, oldest first"""
+
+
+class JobStateRepository(ABC):
+    """Checkpoints of resumable background jobs, one document per job name"""
+
+    @abstractmethod
+    async def get(self, name: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def save(self, name: str, doc: Dict[str, Any]) -> None: ...
+
+
+class Storage:
+    """The repositories the handlers use, one per collection"""
+
+    preferences: PreferencesRepository
+    cbt_sessions: SessionRepository
+    zen_sessions: SessionRepository
+    articles: ArticleRepository
+    favorites: FavoriteRepository
+    analytics: AnalyticsRepository
+    data_keys: DataKeyRepository
+    erasures: ErasureRepository
+    job_state: JobStateRepository
+    # Read-your-writes tokens when reads are routed away from the primary
+    causal = None
+
+    def sessions(self, kind: str) -> SessionRepository:
+        return getattr(self, f"{kind}_sessions")
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+# MongoDB
+
+NO_ID = {"_id": 0}
+SESSION_FIELDS = {"_id": 0, SEARCH_TERMS_FIELD: 0}
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def read_preference(name: str, max_staleness: int = -1):
+    """Read preference by its URI name; ``max_staleness`` is seconds, -1 for no limit"""
+    mode = READ_PREFERENCES[name]
+    if mode is Primary:
+        return Primary()
+    return mode(max_staleness=max_staleness)
+
+
+async def scan(collection, projection: Dict[str, Any], batch_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Stream a whole collection in ``batch_size`` chunks of projected documents"""
+    batch: List[Dict[str, Any]] = []
+    async for doc in collection.find({}, projection, batch_size=batch_size):
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def created_range(since: Optional[datetime], until: Optional[datetime]) -> Dict[str, Any]:
+    return {k: v for k, v in (("$gte", since), ("$lte", until)) if v is not None}
+
+
+class CausalTokens:
+    """Cluster and operation time of each scope's latest write on this worker.
+
+    A scope is a user_id, or a collection name for data that is not per user.
+    Reads in a scope that wrote within ``ttl`` seconds run in a causally
+    consistent session advanced past that write, so a lagging secondary waits
+    until it has applied it before answering (read-your-writes). Other reads
+    go out without a session and may be up to the configured staleness behind.
+    Writes made through other workers arrive via ``observe`` from the change
+    stream, so a user's next request keeps the guarantee on any worker.
+    """
+
+    def __init__(self, client, ttl: float = 300.0, max_scopes: int = 10000) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.max_scopes = max_scopes
+        self._tokens: "OrderedDict[str, Tuple[float, Any, Any]]" = OrderedDict()
+
+    def remember(self, scope: str, cluster_time: Any, operation_time: Any) -> None:
+        current = self._tokens.get(scope)
+        if current is not None and current[2] > operation_time:
+            cluster_time, operation_time = current[1], current[2]
+        self._tokens[scope] = (time.monotonic() + self.ttl, cluster_time, operation_time)
+        self._tokens.move_to_end(scope)
+        if len(self._tokens) > self.max_scopes:
+            self._tokens.popitem(last=False)
+
+    def observe(self, scope: str, operation_time: Any) -> None:
+        """Record a write seen on the change stream, typically made by another worker"""
+        self.remember(scope, None, operation_time)
+
+    def lookup(self, scope: str) -> Optional[Tuple[Any, Any]]:
+        entry = self._tokens.get(scope)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._tokens[scope]
+            return None
+        return entry[1], entry[2]
+
+    @asynccontextmanager
+    async def writing(self, scope: str) -> AsyncIterator[Any]:
+        async with await self.client.start_session(causal_consistency=True) as session:
+            yield session
+            # Standalone servers report no operation time; there is nothing to wait for
+            if session.operation_time is not None:
+                self.remember(scope, session.cluster_time, session.operation_time)
+
+    @asynccontextmanager
+    async def reading(self, scope: str) -> AsyncIterator[Any]:
+        token = self.lookup(scope)
+        if token is None:
+            yield None
+            return
+        async with await self.client.start_session(causal_consistency=True) as session:
+            if token[0] is not None:
+                session.advance_cluster_time(token[0])
+            # afterClusterTime in the read concern is taken from the operation time
+            session.advance_operation_time(token[1])
+            yield session
+
+
+class MongoRepository:
+    """Writes and point lookups use ``collection`` on the primary; list and
+    analytics reads use ``reads``, which carries the routed read preference"""
+
+    def __init__(self, collection, read_pref=None, causal: Optional[CausalTokens] = None) -> None:
+        self.collection = collection
+        self.reads = collection.with_options(read_preference=read_pref) if read_pref is not None else collection
+        self.causal = causal
+
+    def writing(self, scope: str):
+        return self.causal.writing(scope) if self.causal is not None else nullcontext()
+
+    def reading(self, scope: str):
+        return self.causal.reading(scope) if self.causal is not None else nullcontext()
+
+    async def delete_user_batch(self, user_id, limit):
+        # Bounded by _id so one call never turns into an unbounded delete_many
+        ids = [doc["_id"] async for doc in self.collection.find({"user_id": user_id}, {"_id": 1}).limit(limit)]
+        if not ids:
+            return 0
+        async with self.writing(user_id) as session:
+            result = await self.collection.delete_many({"_id": {"$in": ids}}, session=session)
+        return result.deleted_count
+
+
+class MongoPreferences(MongoRepository, PreferencesRepository):
+    async def insert(self, doc):
+        async with self.writing(doc.get("user_id") or "user_preferences") as session:
+            await self.collection.insert_one(dict(doc), session=session)
+
+    async def list(self, limit=1000):
+        async with self.reading("user_preferences") as session:
+            return await self.reads.find({}, NO_ID, session=session).to_list(limit)
+
+    async def find_by_user(self, user_id, limit=10000):
+        async with self.reading(user_id) as session:
+            cursor = self.reads.find({"user_id": user_id}, NO_ID, session=session).sort("created_at", ASCENDING)
+            return await cursor.to_list(limit)
+
+    async def latest(self):
+        newest = await self.reads.find_one({}, {"_id": 0, "created_at": 1}, sort=[("created_at", DESCENDING)])
+        return newest.get("created_at") if newest else None
+
+    async def scan_moods(self, batch_size=50000):
+        async for batch in scan(self.reads, {"_id": 0, "user_id": 1, "created_at": 1, "current_mood": 1}, batch_size):
+            yield [(doc.get("user_id"), doc.get("created_at"), doc.get("current_mood")) for doc in batch]
+
+
+class MongoSessions(MongoRepository, SessionRepository):
+    async def insert(self, doc):
+        async with self.writing(doc.get("user_id")) as session:
+            # insert_one adds _id to the dict it is given; callers keep using theirs
+            await self.collection.insert_one(dict(doc), session=session)
+
+    async def get(self, session_id):
+        return await self.collection.find_one({"id": session_id}, SESSION_FIELDS)
+
+    async def find_by_user(self, user_id, since=None, until=None, limit=1000):
+        query: Dict[str, Any] = {"user_id": user_id}
+        if since is not None or until is not None:
+            query["created_at"] = created_range(since, until)
+        async with self.reading(user_id) as session:
+            return await self.reads.find(query, SESSION_FIELDS, session=session).to_list(limit)
+
+    async def created_at_by_user(self, user_id, since=None, limit=10000):
+        query: Dict[str, Any] = {"user_id": user_id}
+        if since is not None:
+            query["created_at"] = {"$gte": since}
+        async with self.reading(user_id) as session:
+            # Covered by the (user_id, created_at) index
+            cursor = self.reads.find(query, {"_id": 0, "created_at": 1}, session=session).sort("created_at", ASCENDING)
+            return [doc["created_at"] for doc in await cursor.to_list(limit) if doc.get("created_at") is not None]
+
+    async def delete(self, user_id, session_id):
+        async with self.writing(user_id) as session:
+            result = await self.collection.delete_one({"id": session_id, "user_id": user_id}, session=session)
+        return result.deleted_count > 0
+
+    async def update(self, user_id, session_id, fields):
+        async with self.writing(user_id) as session:
+            result = await self.collection.update_one(
+                {"id": session_id, "user_id": user_id}, {"$set": fields}, session=session
+            )
+        return result.matched_count > 0
+
+    async def scan_activity(self, batch_size=50000):
+        async for batch in scan(self.reads, {"_id": 0, "user_id": 1, "created_at": 1}, batch_size):
+            yield [(doc.get("user_id"), doc.get("created_at")) for doc in batch]
+
+    async def scan_range(self, since, until, batch_size=2000):
+        query = {"created_at": {"$gte": since, "$lt": until}}
+        cursor = self.reads.find(query, SESSION_FIELDS, batch_size=batch_size).sort("created_at", ASCENDING)
+        batch: List[Dict[str, Any]] = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def search(self, user_id, terms, since=None, until=None, limit=500):
+        if not terms:
+            return []
+        query: Dict[str, Any] = {"user_id": user_id, SEARCH_TERMS_FIELD: {"$in": terms}}
+        if since is not None or until is not None:
+            query["created_at"] = created_range(since, until)
+        async with self.reading(user_id) as session:
+            cursor = self.reads.find(query, SESSION_FIELDS, session=session).sort("created_at", DESCENDING)
+            return await cursor.to_list(limit)
+
+    async def set_search_terms(self, terms_by_id):
+        if terms_by_id:
+            await self.collection.bulk_write(
+                [UpdateOne({"id": session_id}, {"$set": {SEARCH_TERMS_FIELD: terms}}) for session_id, terms in terms_by_id.items()],
+                ordered=False,
+            )
+
+
+class MongoArticles(MongoRepository, ArticleRepository):
+    async def insert_many(self, docs):
+        async with self.writing("articles") as session:
+            await self.collection.insert_many([dict(doc) for doc in docs], session=session)
+
+    async def list(self, limit=1000):
+        async with self.reading("articles") as session:
+            return await self.reads.find({}, NO_ID, session=session).to_list(limit)
+
+    async def get(self, article_id):
+        return await self.collection.find_one({"id": article_id}, NO_ID)
+
+
+class MongoFavorites(MongoRepository, FavoriteRepository):
+    async def insert(self, doc):
+        async with self.writing(doc.get("user_id")) as session:
+            await self.collection.insert_one(dict(doc), session=session)
+
+    async def get(self, user_id, article_id):
+        return await self.collection.find_one({"user_id": user_id, "article_id": article_id}, NO_ID)
+
+    async def list(self, user_id, limit=1000):
+        async with self.reading(user_id) as session:
+            return await self.reads.find({"user_id": user_id}, NO_ID, session=session).to_list(limit)
+
+    async def delete(self, user_id, article_id):
+        async with self.writing(user_id) as session:
+            result = await self.collection.delete_one({"user_id": user_id, "article_id": article_id}, session=session)
+        return result.deleted_count > 0
+
+    async def counts_by_article(self):
+        pipeline = [{"$group": {"_id": "$article_id", "count": {"$sum": 1}}}]
+        return {row["_id"]: row["count"] async for row in self.reads.aggregate(pipeline)}
+
+
+class MongoAnalytics(MongoRepository, AnalyticsRepository):
+    async def insert(self, doc):
+        async with self.writing(doc.get("user_id")) as session:
+            await self.collection.insert_one(dict(doc), session=session)
+
+    async def feature_stats(self, user_id):
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$group": {
+                "_id": "$feature",
+                "total_sessions": {"$sum": 1},
+                "total_duration": {"$sum": "$duration"}
+            }}
+        ]
+        async with self.reading(user_id) as session:
+            return await self.reads.aggregate(pipeline, session=session).to_list(100)
+
+    async def recent(self, user_id, since, limit=20):
+        async with self.reading(user_id) as session:
+            return await self.reads.find(
+                {"user_id": user_id, "created_at": {"$gte": since}}, NO_ID, session=session
+            ).sort("created_at", -1).limit(limit).to_list(limit)
+
+
+class MongoDataKeys(DataKeyRepository):
+    # Always on the primary: a key read from a lagging secondary could be missing
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    async def get_many(self, user_ids):
+        return {
+            doc["_id"]: doc["wrapped"]
+            async for doc in self.collection.find({"_id": {"$in": list(user_ids)}})
+        }
+
+    async def create(self, user_id, wrapped):
+        try:
+            await self.collection.insert_one({"_id": user_id, "wrapped": wrapped, "created_at": datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            # Another request created this user's key first
+            return (await self.collection.find_one({"_id": user_id}))["wrapped"]
+        return wrapped
+
+    async def delete(self, user_id):
+        result = await self.collection.delete_one({"_id": user_id})
+        return result.deleted_count > 0
+
+
+class MongoErasures(ErasureRepository):
+    # Always on the primary, like the data keys: job state must not go back in time
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    async def get(self, user_id):
+        return await self.collection.find_one({"_id": user_id}, NO_ID)
+
+    async def save(self, doc, owner=None):
+        if owner is None:
+            await self.collection.replace_one({"_id": doc["user_id"]}, {"_id": doc["user_id"], **doc}, upsert=True)
+            return True
+        result = await self.collection.replace_one({"_id": doc["user_id"], "owner": owner}, {"_id": doc["user_id"], **doc})
+        return result.matched_count > 0
+
+    async def claim(self, owner, lease_seconds):
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {
+                "status": {"$ne": "completed"},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}, {"owner": owner}],
+            },
+            {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=lease_seconds)}},
+            projection=NO_ID,
+            sort=[("requested_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+
+class MongoJobState(JobStateRepository):
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    async def get(self, name):
+        return await self.collection.find_one({"_id": name}, NO_ID)
+
+    async def save(self, name, doc):
+        await self.collection.replace_one({"_id": name}, {"_id": name, **doc}, upsert=True)
+
+
+class MongoStorage(Storage):
+    """Motor-backed storage.
+
+    With ``read_pref`` set, list and analytics reads are routed by it (e.g. to
+    secondaries) while writes stay on the primary, and read-your-writes is kept
+    through per-scope causal tokens. Without it everything reads the primary.
+    """
+
+    def __init__(self, db, read_pref=None, causal_ttl: float = 300.0) -> None:
+        self.db = db
+        routed = read_pref is not None and read_pref.mode != Primary().mode
+        self.causal = CausalTokens(db.client, ttl=causal_ttl) if routed else None
+        pref = read_pref if routed else None
+        self.preferences = MongoPreferences(db.user_preferences, pref, self.causal)
+        self.cbt_sessions = MongoSessions(db.cbt_sessions, pref, self.causal)
+        self.zen_sessions = MongoSessions(db.zen_sessions, pref, self.causal)
+        self.articles = MongoArticles(db.articles, pref, self.causal)
+        self.favorites = MongoFavorites(db.favorite_articles, pref, self.causal)
+        self.analytics = MongoAnalytics(db.usage_analytics, pref, self.causal)
+        self.data_keys = MongoDataKeys(db.data_keys)
+        self.erasures = MongoErasures(db.erasure_jobs)
+        # Alongside the report checkpoints
+        self.job_state = MongoJobState(db.report_state)
+
+    async def ensure_indexes(self) -> None:
+        await self.db.user_preferences.create_index([("user_id", ASCENDING), ("created_at", ASCENDING)])
+        await self.db.user_preferences.create_index([("created_at", DESCENDING)])
+        await self.db.cbt_sessions.create_index([("created_at", ASCENDING)])
+        for name in ("cbt_sessions", "zen_sessions"):
+            await self.db[name].create_index([("user_id", ASCENDING), ("created_at", ASCENDING)])
+        await self.db.erasure_jobs.create_index([("status", ASCENDING), ("requested_at", ASCENDING)])
+        # Multikey over the terms: a search touches only matching sessions, however long the journal
+        await self.db.cbt_sessions.create_index(
+            [("user_id", ASCENDING), (SEARCH_TERMS_FIELD, ASCENDING), ("created_at", DESCENDING)]
+        )
+
+
+# SQLite
+
+def stored_datetime(value: datetime) -> datetime:
+    """Naive UTC at millisecond precision, which is what a BSON date holds"""
+    value = as_naive_utc(value)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": stored_datetime(value).isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def dump_doc(doc: Dict[str, Any]) -> str:
+    return json.dumps(doc, default=_encode, separators=(",", ":"))
+
+
+def load_doc(text: str) -> Dict[str, Any]:
+    # Datetimes come back naive UTC, the same as from Motor
+    return json.loads(text, object_hook=_decode)
+
+
+def sort_key(value: Optional[datetime]) -> Optional[str]:
+    """Fixed-width text so timestamps compare correctly as strings"""
+    if value is None:
+        return None
+    return stored_datetime(value).isoformat(sep=" ", timespec="milliseconds")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_preferences (id TEXT, user_id TEXT, created_at TEXT, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS cbt_sessions (id TEXT, user_id TEXT, created_at TEXT, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS cbt_sessions_id ON cbt_sessions (id);
+CREATE INDEX IF NOT EXISTS cbt_sessions_user ON cbt_sessions (user_id, created_at);
+CREATE INDEX IF NOT EXISTS cbt_sessions_created ON cbt_sessions (created_at);
+CREATE TABLE IF NOT EXISTS cbt_sessions_terms (user_id TEXT, term TEXT, created_at TEXT, session INTEGER);
+CREATE INDEX IF NOT EXISTS cbt_sessions_terms_lookup ON cbt_sessions_terms (user_id, term, created_at);
+CREATE INDEX IF NOT EXISTS cbt_sessions_terms_session ON cbt_sessions_terms (session);
+CREATE TABLE IF NOT EXISTS zen_sessions (id TEXT, user_id TEXT, created_at TEXT, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS zen_sessions_id ON zen_sessions (id);
+CREATE INDEX IF NOT EXISTS zen_sessions_user ON zen_sessions (user_id, created_at);
+CREATE INDEX IF NOT EXISTS zen_sessions_created ON zen_sessions (created_at);
+CREATE TABLE IF NOT EXISTS zen_sessions_terms (user_id TEXT, term TEXT, created_at TEXT, session INTEGER);
+CREATE INDEX IF NOT EXISTS zen_sessions_terms_lookup ON zen_sessions_terms (user_id, term, created_at);
+CREATE INDEX IF NOT EXISTS zen_sessions_terms_session ON zen_sessions_terms (session);
+CREATE TABLE IF NOT EXISTS articles (id TEXT, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS articles_id ON articles (id);
+CREATE TABLE IF NOT EXISTS favorite_articles (user_id TEXT, article_id TEXT, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS favorite_articles_user ON favorite_articles (user_id, article_id);
+CREATE TABLE IF NOT EXISTS usage_analytics (user_id TEXT, feature TEXT, duration, created_at TEXT, doc TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS usage_analytics_user ON usage_analytics (user_id, created_at);
+CREATE TABLE IF NOT EXISTS data_keys (user_id TEXT PRIMARY KEY, wrapped BLOB NOT NULL, created_at TEXT);
+CREATE TABLE IF NOT EXISTS erasure_jobs (user_id TEXT PRIMARY KEY, status TEXT NOT NULL, requested_at TEXT, doc TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS job_state (name TEXT PRIMARY KEY, doc TEXT NOT NULL);
+"""
+
+# Columns added to existing tables since they were first created: (table, column, type)
+ADDED_COLUMNS = (
+    ("user_preferences", "user_id", "TEXT"),
+    ("user_preferences", "created_at", "TEXT"),
+)
+
+# Indexes on added columns, created once the columns exist
+INDEXES = """
+CREATE INDEX IF NOT EXISTS user_preferences_user ON user_preferences (user_id, created_at);
+CREATE INDEX IF NOT EXISTS user_preferences_created ON user_preferences (created_at);
+"""
+
+Rows = List[Tuple[Any, ...]]
+
+
+class SQLiteDatabase:
+    """A WAL-mode SQLite file used from worker threads.
+
+    Writes are serialized on a single thread, since SQLite allows one writer at a
+    time anyway; reads run on a small pool with a connection per thread, which WAL
+    lets proceed alongside the writer. The event loop never touches SQLite.
+    """
+
+    def __init__(self, path: str, readers: int = 4) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="sqlite-reader")
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            for table, column, kind in ADDED_COLUMNS:
+                if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+            conn.executescript(INDEXES)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _read(self, sql: str, params: Sequence[Any]) -> Rows:
+        return self._connection().execute(sql, params).fetchall()
+
+    def _write(self, sql: str, params: Sequence[Any], many: bool) -> int:
+        conn = self._connection()
+        with conn:
+            cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+        return cursor.rowcount
+
+    def _transact(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self._connection()
+        with conn:
+            return fn(conn)
+
+    async def _run(self, executor: ThreadPoolExecutor, fn: Callable, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+    async def fetch(self, sql: str, params: Sequence[Any] = ()) -> Rows:
+        return await self._run(self._readers, self._read, sql, params)
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        return await self._run(self._writer, self._write, sql, params, False)
+
+    async def execute_many(self, sql: str, params: Sequence[Sequence[Any]]) -> int:
+        return await self._run(self._writer, self._write, sql, params, True)
+
+    async def transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run ``fn(conn)`` on the writer thread as one transaction"""
+        return await self._run(self._writer, self._transact, fn)
+
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+async def scan_rows(db: SQLiteDatabase, table: str, columns: str, batch_size: int) -> AsyncIterator[Rows]:
+    """Stream ``columns`` of every row of ``table`` in rowid order, ``batch_size`` rows at a time"""
+    last = 0
+    while True:
+        rows = await db.fetch(f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch_size))
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [row[1:] for row in rows]
+
+
+async def delete_user_rows(db: SQLiteDatabase, table: str, user_id: str, limit: int) -> int:
+    return await db.execute(
+        f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE user_id = ? LIMIT ?)", (user_id, limit)
+    )
+
+
+def docs(rows: Rows) -> List[Dict[str, Any]]:
+    return [load_doc(row[0]) for row in rows]
+
+
+def first_doc(rows: Rows) -> Optional[Dict[str, Any]]:
+    return load_doc(rows[0][0]) if rows else None
+
+
+class SQLitePreferences(PreferencesRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def insert(self, doc):
+        await self.db.execute(
+            "INSERT INTO user_preferences (id, user_id, created_at, doc) VALUES (?, ?, ?, ?)",
+            (doc.get("id"), doc.get("user_id"), sort_key(doc.get("created_at")), dump_doc(doc)),
+        )
+
+    async def list(self, limit=1000):
+        return docs(await self.db.fetch("SELECT doc FROM user_preferences ORDER BY rowid LIMIT ?", (limit,)))
+
+    async def find_by_user(self, user_id, limit=10000):
+        return docs(await self.db.fetch(
+            "SELECT doc FROM user_preferences WHERE user_id = ? ORDER BY created_at, rowid LIMIT ?", (user_id, limit)
+        ))
+
+    async def latest(self):
+        rows = await self.db.fetch("SELECT MAX(created_at) FROM user_preferences")
+        return datetime.fromisoformat(rows[0][0]) if rows and rows[0][0] else None
+
+    async def scan_moods(self, batch_size=50000):
+        async for rows in scan_rows(self.db, "user_preferences", "user_id, created_at, json_extract(doc, '$.current_mood')", batch_size):
+            yield [(user_id, datetime.fromisoformat(created) if created else None, mood) for user_id, created, mood in rows]
+
+    async def delete_user_batch(self, user_id, limit):
+        return await delete_user_rows(self.db, "user_preferences", user_id, limit)
+
+
+class SQLiteSessions(SessionRepository):
+    def __init__(self, db: SQLiteDatabase, table: str) -> None:
+        self.db = db
+        self.table = table
+
+    async def insert(self, doc):
+        terms = doc.get(SEARCH_TERMS_FIELD) or []
+        row = (doc.get("id"), doc.get("user_id"), sort_key(doc.get("created_at")))
+        stored = dump_doc({k: v for k, v in doc.items() if k != SEARCH_TERMS_FIELD})
+
+        def write(conn):
+            # Terms live in their own table, the JSON column has no multikey index
+            session = conn.execute(
+                f"INSERT INTO {self.table} (id, user_id, created_at, doc) VALUES (?, ?, ?, ?)", (*row, stored)
+            ).lastrowid
+            conn.executemany(
+                f"INSERT INTO {self.table}_terms (user_id, term, created_at, session) VALUES (?, ?, ?, ?)",
+                [(row[1], term, row[2], session) for term in terms],
+            )
+        await self.db.transaction(write)
+
+    async def get(self, session_id):
+        return first_doc(await self.db.fetch(f"SELECT doc FROM {self.table} WHERE id = ? LIMIT 1", (session_id,)))
+
+    async def find_by_user(self, user_id, since=None, until=None, limit=1000):
+        sql = f"SELECT doc FROM {self.table} WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if since is not None:
+            sql += " AND created_at >= ?"
+            params.append(sort_key(since))
+        if until is not None:
+            sql += " AND created_at <= ?"
+            params.append(sort_key(until))
+        params.append(limit)
+        return docs(await self.db.fetch(sql + " ORDER BY rowid LIMIT ?", params))
+
+    async def created_at_by_user(self, user_id, since=None, limit=10000):
+        # Answered from the (user_id, created_at) index without reading doc
+        sql = f"SELECT created_at FROM {self.table} WHERE user_id = ? AND created_at IS NOT NULL"
+        params: List[Any] = [user_id]
+        if since is not None:
+            sql += " AND created_at >= ?"
+            params.append(sort_key(since))
+        params.append(limit)
+        rows = await self.db.fetch(sql + " ORDER BY created_at LIMIT ?", params)
+        return [datetime.fromisoformat(created) for (created,) in rows]
+
+    async def delete(self, user_id, session_id):
+        def write(conn):
+            # Like delete_one, remove at most one matching row
+            found = conn.execute(
+                f"SELECT rowid FROM {self.table} WHERE id = ? AND user_id = ? LIMIT 1", (session_id, user_id)
+            ).fetchone()
+            if found is None:
+                return False
+            conn.execute(f"DELETE FROM {self.table} WHERE rowid = ?", found)
+            conn.execute(f"DELETE FROM {self.table}_terms WHERE session = ?", found)
+            return True
+        return await self.db.transaction(write)
+
+    async def update(self, user_id, session_id, fields):
+        def write(conn):
+            found = conn.execute(
+                f"SELECT rowid, doc FROM {self.table} WHERE id = ? AND user_id = ? LIMIT 1", (session_id, user_id)
+            ).fetchone()
+            if found is None:
+                return False
+            conn.execute(f"UPDATE {self.table} SET doc = ? WHERE rowid = ?", (dump_doc({**load_doc(found[1]), **fields}), found[0]))
+            return True
+        return await self.db.transaction(write)
+
+    async def scan_activity(self, batch_size=50000):
+        async for rows in scan_rows(self.db, self.table, "user_id, created_at", batch_size):
+            yield [(user_id, datetime.fromisoformat(created) if created else None) for user_id, created in rows]
+
+    async def scan_range(self, since, until, batch_size=2000):
+        # Keyset on (created_at, rowid) so each batch is one index range read
+        last = (sort_key(since), 0)
+        end = sort_key(until)
+        while True:
+            rows = await self.db.fetch(
+                f"SELECT created_at, rowid, doc FROM {self.table} WHERE (created_at, rowid) > (?, ?) AND created_at < ? "
+                "ORDER BY created_at, rowid LIMIT ?",
+                (*last, end, batch_size),
+            )
+            if not rows:
+                return
+            last = rows[-1][:2]
+            yield [load_doc(row[2]) for row in rows]
+
+    async def delete_user_batch(self, user_id, limit):
+        def write(conn):
+            rowids = [row[0] for row in conn.execute(f"SELECT rowid FROM {self.table} WHERE user_id = ? LIMIT ?", (user_id, limit))]
+            placeholders = ",".join("?" * len(rowids))
+            conn.execute(f"DELETE FROM {self.table}_terms WHERE session IN ({placeholders})", rowids)
+            conn.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", rowids)
+            return len(rowids)
+        return await self.db.transaction(write)
+
+    async def search(self, user_id, terms, since=None, until=None, limit=500):
+        if not terms:
+            return []
+        sql = f"SELECT session FROM {self.table}_terms WHERE user_id = ? AND term IN ({', '.join('?' * len(terms))})"
+        params: List[Any] = [user_id, *terms]
+        if since is not None:
+            sql += " AND created_at >= ?"
+            params.append(sort_key(since))
+        if until is not None:
+            sql += " AND created_at <= ?"
+            params.append(sort_key(until))
+        # A session has at most one row per term, so the newest limit * len(terms)
+        # rows cover the newest ``limit`` sessions; the index serves them in order
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params += [limit * len(terms), limit]
+        return docs(await self.db.fetch(
+            f"SELECT doc FROM {self.table} WHERE rowid IN ({sql}) ORDER BY created_at DESC, rowid DESC LIMIT ?", params
+        ))
+
+    async def set_search_terms(self, terms_by_id):
+        def write(conn):
+            for session_id, terms in terms_by_id.items():
+                for rowid, user_id, created_at in conn.execute(
+                    f"SELECT rowid, user_id, created_at FROM {self.table} WHERE id = ?", (session_id,)
+                ).fetchall():
+                    conn.execute(f"DELETE FROM {self.table}_terms WHERE session = ?", (rowid,))
+                    conn.executemany(
+                        f"INSERT INTO {self.table}_terms (user_id, term, created_at, session) VALUES (?, ?, ?, ?)",
+                        [(user_id, term, created_at, rowid) for term in terms],
+                    )
+        await self.db.transaction(write)
+
+
+class SQLiteArticles(ArticleRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def insert_many(self, docs):
+        await self.db.execute_many(
+            "INSERT INTO articles (id, doc) VALUES (?, ?)",
+            [(doc.get("id"), dump_doc(doc)) for doc in docs],
+        )
+
+    async def list(self, limit=1000):
+        return docs(await self.db.fetch("SELECT doc FROM articles ORDER BY rowid LIMIT ?", (limit,)))
+
+    async def get(self, article_id):
+        return first_doc(await self.db.fetch("SELECT doc FROM articles WHERE id = ? LIMIT 1", (article_id,)))
+
+
+class SQLiteFavorites(FavoriteRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def insert(self, doc):
+        await self.db.execute(
+            "INSERT INTO favorite_articles (user_id, article_id, doc) VALUES (?, ?, ?)",
+            (doc.get("user_id"), doc.get("article_id"), dump_doc(doc)),
+        )
+
+    async def get(self, user_id, article_id):
+        return first_doc(await self.db.fetch(
+            "SELECT doc FROM favorite_articles WHERE user_id = ? AND article_id = ? LIMIT 1", (user_id, article_id)
+        ))
+
+    async def list(self, user_id, limit=1000):
+        return docs(await self.db.fetch(
+            "SELECT doc FROM favorite_articles WHERE user_id = ? ORDER BY rowid LIMIT ?", (user_id, limit)
+        ))
+
+    async def delete(self, user_id, article_id):
+        deleted = await self.db.execute(
+            "DELETE FROM favorite_articles WHERE rowid = "
+            "(SELECT rowid FROM favorite_articles WHERE user_id = ? AND article_id = ? LIMIT 1)",
+            (user_id, article_id),
+        )
+        return deleted > 0
+
+    async def counts_by_article(self):
+        rows = await self.db.fetch("SELECT article_id, COUNT(*) FROM favorite_articles GROUP BY article_id")
+        return dict(rows)
+
+    async def delete_user_batch(self, user_id, limit):
+        return await delete_user_rows(self.db, "favorite_articles", user_id, limit)
+
+
+class SQLiteAnalytics(AnalyticsRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def insert(self, doc):
+        duration = doc.get("duration")
+        await self.db.execute(
+            "INSERT INTO usage_analytics (user_id, feature, duration, created_at, doc) VALUES (?, ?, ?, ?, ?)",
+            (
+                doc.get("user_id"),
+                doc.get("feature"),
+                duration if isinstance(duration, (int, float)) else None,
+                sort_key(doc.get("created_at")),
+                dump_doc(doc),
+            ),
+        )
+
+    async def feature_stats(self, user_id):
+        # COALESCE matches $sum, which is 0 when no event has a numeric duration
+        rows = await self.db.fetch(
+            "SELECT feature, COUNT(*), COALESCE(SUM(duration), 0) FROM usage_analytics "
+            "WHERE user_id = ? GROUP BY feature LIMIT 100",
+            (user_id,),
+        )
+        return [{"_id": feature, "total_sessions": count, "total_duration": total} for feature, count, total in rows]
+
+    async def recent(self, user_id, since, limit=20):
+        return docs(await self.db.fetch(
+            "SELECT doc FROM usage_analytics WHERE user_id = ? AND created_at >= ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, sort_key(since), limit),
+        ))
+
+    async def delete_user_batch(self, user_id, limit):
+        return await delete_user_rows(self.db, "usage_analytics", user_id, limit)
+
+
+class SQLiteDataKeys(DataKeyRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def get_many(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        placeholders = ",".join("?" * len(user_ids))
+        rows = await self.db.fetch(f"SELECT user_id, wrapped FROM data_keys WHERE user_id IN ({placeholders})", user_ids)
+        return {user_id: bytes(wrapped) for user_id, wrapped in rows}
+
+    async def create(self, user_id, wrapped):
+        await self.db.execute(
+            "INSERT OR IGNORE INTO data_keys (user_id, wrapped, created_at) VALUES (?, ?, ?)",
+            (user_id, wrapped, sort_key(datetime.now(timezone.utc))),
+        )
+        # Either ours or one inserted first; committed, so any reader sees it
+        return (await self.get_many([user_id]))[user_id]
+
+    async def delete(self, user_id):
+        return await self.db.execute("DELETE FROM data_keys WHERE user_id = ?", (user_id,)) > 0
+
+
+class SQLiteErasures(ErasureRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def get(self, user_id):
+        return first_doc(await self.db.fetch("SELECT doc FROM erasure_jobs WHERE user_id = ?", (user_id,)))
+
+    async def save(self, doc, owner=None):
+        def write(conn):
+            if owner is not None:
+                stored = first_doc(conn.execute("SELECT doc FROM erasure_jobs WHERE user_id = ?", (doc["user_id"],)).fetchall())
+                if stored is None or stored.get("owner") != owner:
+                    return False
+            conn.execute(
+                "INSERT OR REPLACE INTO erasure_jobs (user_id, status, requested_at, doc) VALUES (?, ?, ?, ?)",
+                (doc["user_id"], doc["status"], sort_key(doc.get("requested_at")), dump_doc(doc)),
+            )
+            return True
+        return await self.db.transaction(write)
+
+    async def claim(self, owner, lease_seconds):
+        now = stored_datetime(datetime.now(timezone.utc))
+
+        def write(conn):
+            for (text,) in conn.execute(
+                "SELECT doc FROM erasure_jobs WHERE status != 'completed' ORDER BY requested_at"
+            ).fetchall():
+                doc = load_doc(text)
+                if doc.get("lease_until") is None or doc["lease_until"] <= now or doc.get("owner") == owner:
+                    doc.update(owner=owner, lease_until=now + timedelta(seconds=lease_seconds))
+                    conn.execute("UPDATE erasure_jobs SET doc = ? WHERE user_id = ?", (dump_doc(doc), doc["user_id"]))
+                    return doc
+            return None
+        return await self.db.transaction(write)
+
+
+class SQLiteJobState(JobStateRepository):
+    def __init__(self, db: SQLiteDatabase) -> None:
+        self.db = db
+
+    async def get(self, name):
+        return first_doc(await self.db.fetch("SELECT doc FROM job_state WHERE name = ?", (name,)))
+
+    async def save(self, name, doc):
+        await self.db.execute("INSERT OR REPLACE INTO job_state (name, doc) VALUES (?, ?)", (name, dump_doc(doc)))
+
+
+class SQLiteStorage(Storage):
+    """Single-node storage in one SQLite file; needs no server"""
+
+    def __init__(self, path: str, readers: int = 4) -> None:
+        self.db = SQLiteDatabase(path, readers)
+        self.preferences = SQLitePreferences(self.db)
+        self.cbt_sessions = SQLiteSessions(self.db, "cbt_sessions")
+        self.zen_sessions = SQLiteSessions(self.db, "zen_sessions")
+        self.articles = SQLiteArticles(self.db)
+        self.favorites = SQLiteFavorites(self.db)
+        self.analytics = SQLiteAnalytics(self.db)
+        self.data_keys = SQLiteDataKeys(self.db)
+        self.erasures = SQLiteErasures(self.db)
+        self.job_state = SQLiteJobState(self.db)
+
+    async def close(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.db.close)
@@ -0,0 +1,260 @@
+"""Breathing telemetry for zen sessions: streamed samples reduced to packed arrays and summary stats."""
+import base64
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Phase codes sent with every sample, in the order ZenMode cycles through them
+PHASES = ("inhale", "hold", "exhale", "holdOut")
+INHALE = 0
+# Target seconds per phase for each breathing mode offered in ZenMode; 0 means the phase is skipped
+PATTERNS = {
+    "box": (4, 4, 4, 4),
+    "478": (4, 7, 8, 2),
+    "equal": (5, 0, 5, 0),
+    "calm": (4, 2, 6, 2),
+}
+# Phase durations are stored as uint16 milliseconds
+MAX_PHASE_MS = np.iinfo(np.uint16).max
+
+
+def pack(values: np.ndarray, dtype: str) -> str:
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode()
+
+
+def unpack(data: Optional[str], dtype: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=dtype) if data else np.empty(0, dtype=dtype)
+
+
+def summarize(phases: np.ndarray, durations_ms: np.ndarray, pattern: str) -> Dict[str, Any]:
+    """Breath rate, interval variability and adherence to ``pattern`` from completed phase runs"""
+    durations = durations_ms.astype(np.float64) / 1000
+    starts = np.concatenate(([0.0], np.cumsum(durations)[:-1]))
+    # A breath runs from one inhale to the next
+    intervals = np.diff(starts[phases == INHALE])
+    summary: Dict[str, Any] = {
+        "breaths": int(intervals.size),
+        "breath_rate": round(60 / float(intervals.mean()), 2) if intervals.size else None,
+        "interval_sd": round(float(intervals.std()), 3) if intervals.size > 1 else None,
+        # Beat-to-beat style variability: RMS of successive interval differences
+        "interval_rmssd": round(float(np.sqrt(np.mean(np.diff(intervals) ** 2))), 3) if intervals.size > 2 else None,
+    }
+    targets = PATTERNS[pattern]
+    phase_adherence: Dict[str, Optional[float]] = {}
+    weighted, weights = 0.0, 0.0
+    for code, target in enumerate(targets):
+        if target == 0:
+            continue
+        actual = durations[phases == code]
+        if not actual.size:
+            phase_adherence[PHASES[code]] = None
+            continue
+        # 1 when the phase lasted exactly its target, falling linearly to 0 at 100% off
+        score = float(np.clip(1 - np.abs(actual - target) / target, 0, 1).mean())
+        phase_adherence[PHASES[code]] = round(score, 3)
+        weighted += score * target
+        weights += target
+    summary["adherence"] = round(weighted / weights, 3) if weights else None
+    summary["phase_adherence"] = phase_adherence
+    summary["phase_mean_seconds"] = {
+        PHASES[code]: round(float(durations[phases == code].mean()), 2)
+        for code in range(len(PHASES)) if (phases == code).any()
+    }
+    return summary
+
+
+class BreathTelemetry:
+    """Reduce a stream of breathing samples to a fixed-rate signal and phase runs.
+
+    Each batch is columnar: ``t`` (milliseconds since the session started),
+    ``phase`` (an index into PHASES) and optionally ``value`` (the breathing
+    signal, e.g. the guide's scale or a sensor reading). Values are averaged
+    into ``resolution_ms`` bins and phases collapsed into runs, both with
+    NumPy over the whole batch, so no per-sample Python work or storage is
+    needed. A bin or run still open at the end of a batch is carried into the
+    next one, and ``resume`` continues from a stored document, so a session
+    can be streamed over several connections. ``t`` may not exceed
+    ``max_samples`` bins of session time, which bounds the stored signal
+    however the samples are spread.
+    """
+
+    def __init__(self, pattern: str = "478", resolution_ms: int = 250, max_samples: int = 1_000_000) -> None:
+        if pattern not in PATTERNS:
+            raise ValueError(f"Unknown breathing pattern: {pattern}")
+        self.pattern = pattern
+        self.resolution_ms = resolution_ms
+        self.max_samples = max_samples
+        self.max_ms = max_samples * resolution_ms
+        self.samples = 0
+        self.last_ms: Optional[float] = None
+        # Completed bins as (bin indices, means) chunks, plus the bin still filling
+        self._first_bin: Optional[int] = None
+        self._bins: List[np.ndarray] = []
+        self._means: List[np.ndarray] = []
+        self._open_bin: Optional[int] = None
+        self._open_sum = 0.0
+        self._open_count = 0
+        # Completed phase runs, plus the run still in progress
+        self._phases: List[np.ndarray] = []
+        self._durations: List[np.ndarray] = []
+        self.first_run_ms: Optional[float] = None
+        self._open_phase: Optional[int] = None
+        self._open_since: Optional[float] = None
+
+    @classmethod
+    def resume(cls, stored: Optional[Dict[str, Any]], pattern: str, **options: Any) -> "BreathTelemetry":
+        telemetry = cls(stored.get("pattern", pattern) if stored else pattern, **options)
+        if not stored:
+            return telemetry
+        if stored.get("resolution_ms") != telemetry.resolution_ms:
+            raise ValueError("Stored telemetry uses a different resolution")
+        signal = unpack(stored.get("signal"), "<f2").astype(np.float64)
+        present = ~np.isnan(signal)
+        if present.any():
+            telemetry._first_bin = stored["first_bin"] + int(np.flatnonzero(present)[0])
+        telemetry._bins.append(stored["first_bin"] + np.flatnonzero(present))
+        telemetry._means.append(signal[present])
+        telemetry._phases.append(unpack(stored.get("phases"), "u1"))
+        telemetry._durations.append(unpack(stored.get("phase_ms"), "<u2"))
+        telemetry.samples = stored.get("samples", 0)
+        telemetry.last_ms = stored.get("last_ms")
+        telemetry.first_run_ms = stored.get("first_run_ms")
+        telemetry._open_phase = stored.get("open_phase")
+        telemetry._open_since = stored.get("open_since_ms")
+        return telemetry
+
+    def add(self, batch: Dict[str, Any]) -> int:
+        """Fold one batch in; returns the number of samples accepted"""
+        t = np.asarray(batch.get("t", ()), dtype=np.float64)
+        phase = np.asarray(batch.get("phase", ()), dtype=np.int64)
+        value = np.asarray(batch["value"], dtype=np.float64) if batch.get("value") is not None else None
+        if t.ndim != 1 or phase.shape != t.shape or (value is not None and value.shape != t.shape):
+            raise ValueError("t, phase and value must be arrays of the same length")
+        if t.size and ((phase < 0).any() or (phase >= len(PHASES)).any()):
+            raise ValueError(f"phase must be 0-{len(PHASES) - 1} ({', '.join(PHASES)})")
+        if not np.isfinite(t).all() or (t < 0).any():
+            raise ValueError("t must be finite milliseconds since the session started")
+        if t.size and t[-1] >= self.max_ms:
+            raise OverflowError(f"t beyond the longest session ({self.max_ms / 3_600_000:g} hours)")
+        if t.size > 1 and (np.diff(t) < 0).any():
+            raise ValueError("t must be non-decreasing")
+        if self.last_ms is not None:
+            # Replayed samples after a reconnect are dropped, not double counted
+            keep = t > self.last_ms
+            t, phase = t[keep], phase[keep]
+            value = value[keep] if value is not None else None
+        if not t.size:
+            return 0
+        if self.samples + t.size > self.max_samples:
+            raise OverflowError(f"More than {self.max_samples} samples for one session")
+        if value is not None:
+            # Samples only move forward, so the signal spans from the first bin ever seen
+            first_bin = self._first_bin if self._first_bin is not None else int(t[0] // self.resolution_ms)
+            if int(t[-1] // self.resolution_ms) - first_bin >= self.max_samples:
+                raise OverflowError(f"Signal spans more than {self.max_samples} bins")
+            self._first_bin = first_bin
+        self.samples += t.size
+        self.last_ms = float(t[-1])
+        if value is not None:
+            self._add_values(t, value)
+        self._add_phases(t, phase)
+        return int(t.size)
+
+    def _add_values(self, t: np.ndarray, value: np.ndarray) -> None:
+        bins = (t // self.resolution_ms).astype(np.int64)
+        # t is sorted, so each bin is one contiguous slice
+        starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+        sums = np.add.reduceat(value, starts)
+        counts = np.diff(np.append(starts, t.size))
+        unique = bins[starts]
+        if self._open_bin is not None:
+            if unique[0] == self._open_bin:
+                sums[0] += self._open_sum
+                counts[0] += self._open_count
+            else:
+                self._bins.append(np.array([self._open_bin]))
+                self._means.append(np.array([self._open_sum / self._open_count]))
+        # The last bin may continue in the next batch
+        self._bins.append(unique[:-1])
+        self._means.append(sums[:-1] / counts[:-1])
+        self._open_bin, self._open_sum, self._open_count = int(unique[-1]), float(sums[-1]), int(counts[-1])
+
+    def _add_phases(self, t: np.ndarray, phase: np.ndarray) -> None:
+        changes = np.flatnonzero(phase[1:] != phase[:-1]) + 1
+        run_phases = phase[np.concatenate(([0], changes))]
+        run_starts = t[np.concatenate(([0], changes))]
+        if self._open_phase is not None and run_phases[0] == self._open_phase:
+            run_starts[0] = self._open_since
+        elif self._open_phase is not None:
+            run_phases = np.concatenate(([self._open_phase], run_phases))
+            run_starts = np.concatenate(([self._open_since], run_starts))
+        if self.first_run_ms is None:
+            self.first_run_ms = float(run_starts[0])
+        # A run lasts until the next one starts; the last run is still open
+        self._phases.append(run_phases[:-1].astype(np.uint8))
+        self._durations.append(np.minimum(np.diff(run_starts), MAX_PHASE_MS).astype(np.uint16))
+        self._open_phase, self._open_since = int(run_phases[-1]), float(run_starts[-1])
+
+    def signal(self) -> Tuple[int, np.ndarray]:
+        """(first bin index, bin means with NaN for empty bins), including the open bin"""
+        bins = self._bins + ([np.array([self._open_bin])] if self._open_bin is not None else [])
+        means = self._means + ([np.array([self._open_sum / self._open_count])] if self._open_bin is not None else [])
+        bins = np.concatenate(bins) if bins else np.empty(0, dtype=np.int64)
+        if not bins.size:
+            return 0, np.empty(0)
+        first = int(bins.min())
+        signal = np.full(int(bins.max()) - first + 1, np.nan)
+        signal[bins - first] = np.concatenate(means)
+        return first, signal
+
+    def runs(self) -> Tuple[np.ndarray, np.ndarray]:
+        phases = np.concatenate(self._phases) if self._phases else np.empty(0, dtype=np.uint8)
+        durations = np.concatenate(self._durations) if self._durations else np.empty(0, dtype=np.uint16)
+        return phases, durations
+
+    def summary(self) -> Dict[str, Any]:
+        phases, durations = self.runs()
+        summary = summarize(phases, durations, self.pattern)
+        summary["samples"] = self.samples
+        summary["duration_seconds"] = (
+            round((self.last_ms - self.first_run_ms) / 1000, 2) if self.last_ms is not None else 0.0
+        )
+        return summary
+
+    def to_document(self) -> Dict[str, Any]:
+        """Packed arrays and summary, as stored under the session's ``telemetry`` field"""
+        first_bin, signal = self.signal()
+        phases, durations = self.runs()
+        return {
+            "pattern": self.pattern,
+            "resolution_ms": self.resolution_ms,
+            "samples": self.samples,
+            "last_ms": self.last_ms,
+            # float16 bin means, NaN where no sample fell in the bin
+            "first_bin": first_bin,
+            "signal": pack(signal, "<f2"),
+            # Completed phase runs: PHASES codes and milliseconds
+            "first_run_ms": self.first_run_ms,
+            "phases": pack(phases, "u1"),
+            "phase_ms": pack(durations, "<u2"),
+            "open_phase": self._open_phase,
+            "open_since_ms": self._open_since,
+            "summary": self.summary(),
+        }
+
+
+def decode(stored: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored telemetry with its arrays unpacked to plain lists, for clients"""
+    signal = unpack(stored.get("signal"), "<f2").astype(np.float64)
+    return {
+        "pattern": stored.get("pattern"),
+        "resolution_ms": stored.get("resolution_ms"),
+        "start_ms": stored.get("first_bin", 0) * stored.get("resolution_ms", 0),
+        "signal": [None if np.isnan(v) else round(float(v), 4) for v in signal],
+        "phases": [PHASES[code] for code in unpack(stored.get("phases"), "u1")],
+        "phase_ms": unpack(stored.get("phase_ms"), "<u2").tolist(),
+        "summary": stored.get("summary", {}),
+    }
@@ -0,0 +1,304 @@
+"""Lightweight in-process tracing: request and Mongo command spans with tail sampling."""
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "serenity-backend"
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = False
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        self.trace.add(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans of one request, collected until the root span ends"""
+
+    __slots__ = ("trace_id", "spans", "_lock")
+
+    def __init__(self) -> None:
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        # Mongo spans finish on Motor's executor threads
+        with self._lock:
+            self.spans.append(span)
+
+
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class TailSampler:
+    """Keep errored traces, the slowest ``keep_ratio`` of recent traces and a small random baseline"""
+
+    def __init__(self, keep_ratio: float = 0.05, baseline_rate: float = 0.01, window: int = 1000) -> None:
+        self.keep_ratio = keep_ratio
+        self.baseline_rate = baseline_rate
+        self.recent: deque = deque(maxlen=window)
+        self.threshold_ms = 0.0
+        self._since_update = 0
+
+    def keep(self, root: Span) -> bool:
+        duration = root.duration_ms
+        self.recent.append(duration)
+        self._since_update += 1
+        # Recompute the slow-trace threshold periodically rather than per request
+        if self._since_update >= 50 or len(self.recent) < 50:
+            ordered = sorted(self.recent)
+            self.threshold_ms = ordered[min(len(ordered) - 1, int(len(ordered) * (1 - self.keep_ratio)))]
+            self._since_update = 0
+        return root.error or duration >= self.threshold_ms or random.random() < self.baseline_rate
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    """Encode spans as an OTLP/JSON ExportTraceServiceRequest"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [
+                {
+                    "traceId": span.trace.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": 2 if span.parent_id is None else (3 if span.name.startswith("mongo.") else 1),
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [_attribute(k, v) for k, v in span.attributes.items()],
+                    "status": {"code": 2 if span.error else 1},
+                }
+                for span in spans
+            ],
+        }],
+    }]}
+
+
+class BatchExporter:
+    """Export kept traces from a background thread in batches.
+
+    ``target`` is either a file path (one OTLP/JSON request per line) or an
+    ``http://`` OTLP collector base URL such as http://localhost:4318.
+    """
+
+    def __init__(self, target: str, max_batch: int = 256, flush_interval: float = 5.0, max_queue: int = 10000) -> None:
+        self.target = target
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def submit(self, spans: List[Span]) -> None:
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self, spans: List[Span]) -> None:
+        payload = json.dumps(to_otlp(spans))
+        if self.target.startswith(("http://", "https://")):
+            request = urllib.request.Request(
+                self.target.rstrip("/") + "/v1/traces",
+                data=payload.encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+        else:
+            with open(self.target, "a") as f:
+                f.write(payload + "\n")
+
+    def _run(self) -> None:
+        while not self._stopping.is_set() or not self.queue.empty():
+            batch: List[Span] = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.extend(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.warning(f"Trace export failed, dropping {len(batch)} spans: {str(e)}")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+
+
+class Tracer:
+    """Entry point for manual spans; without an exporter nothing is recorded"""
+
+    def __init__(self, sampler: TailSampler, exporter: Optional[BatchExporter] = None) -> None:
+        self.sampler = sampler
+        self.exporter = exporter
+
+    def start_span(self, name: str, **attributes: Any) -> Optional[Span]:
+        parent = current_span.get()
+        if parent is None:
+            return None
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Manual child span of the current request; a no-op outside a traced request"""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield None
+            return
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException:
+            span.error = True
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def finish(self, root: Span) -> None:
+        root.end()
+        if self.exporter is not None and self.sampler.keep(root):
+            self.exporter.submit(root.trace.spans)
+
+
+class TracingMiddleware:
+    """Open a root span per HTTP request"""
+
+    def __init__(self, app: ASGIApp, tracer: Tracer) -> None:
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        root = Span(Trace(), f"{scope['method']} {scope['path']}", None, {"http.method": scope["method"]})
+        token = current_span.set(root)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                root.error = message["status"] >= 500
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            root.error = True
+            raise
+        finally:
+            current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+                root.attributes["http.route"] = route.path
+            self.tracer.finish(root)
+
+
+def _command_collection(event: monitoring.CommandStartedEvent) -> str:
+    if event.command_name == "getMore":
+        return str(event.command.get("collection", ""))
+    value = event.command.get(event.command_name)
+    return value if isinstance(value, str) else ""
+
+
+def _reply_count(command_name: str, reply: Dict[str, Any]) -> Optional[int]:
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if "n" in reply:
+        return reply["n"]
+    return None
+
+
+class MongoSpanListener(monitoring.CommandListener):
+    """Child span for every Mongo command issued inside a traced request"""
+
+    def __init__(self) -> None:
+        self._pending: Dict[Tuple[Any, int], Span] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        parent = current_span.get()
+        if parent is None:
+            return
+        span = Span(parent.trace, f"mongo.{event.command_name}", parent.span_id, {
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+            "db.mongodb.collection": _command_collection(event),
+        })
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = span
+
+    def _finish(self, event, reply: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            span = self._pending.pop((event.connection_id, event.request_id), None)
+        if span is None:
+            return
+        if reply is not None:
+            count = _reply_count(event.command_name, reply)
+            if count is not None:
+                span.attributes["db.documents"] = count
+        else:
+            span.error = True
+        span.end()
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event, None)
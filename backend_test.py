@@ -10,6 +10,7 @@ import uuid
 from datetime import datetime
 import sys
 import os
+import time
 
 # Get backend URL from frontend .env file
 def get_backend_url():
@@ -548,6 +549,242 @@ class SerenitySpaceAPITester:
         
         return success_count > 0 and summary_success
         
+    def test_batch_startup(self):
+        """Test the multiplexed start-up batch endpoint"""
+        batch = {
+            "requests": [
+                {"id": "preferences", "path": "/api/preferences"},
+                {"id": "articles", "path": "/api/articles"},
+                {"id": "favorites", "path": "/api/favorites?user_id=anonymous"},
+                {"id": "cbt", "path": "/api/cbt-sessions?user_id=anonymous"},
+                {"id": "zen", "path": "/api/zen-sessions?user_id=anonymous"},
+            ]
+        }
+        
+        try:
+            response = self.session.post(f"{API_URL}/batch", json=batch)
+            if response.status_code == 200:
+                results = {item['id']: item for item in response.json().get('responses', [])}
+                failed = [rid for rid, item in results.items() if item['status'] != 200]
+                if len(results) == len(batch['requests']) and not failed:
+                    self.log_test("Batch Start-up", True, f"All {len(results)} sub-requests returned 200")
+                    return True
+                else:
+                    self.log_test("Batch Start-up", False, f"Failed sub-requests: {failed}")
+            else:
+                self.log_test("Batch Start-up", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_test("Batch Start-up", False, f"Error: {str(e)}")
+        return False
+        
+    def test_recommended_articles(self):
+        """Test mood-aware article recommendations"""
+        try:
+            catalog = self.session.get(f"{API_URL}/articles")
+            response = self.session.get(f"{API_URL}/articles/recommended", params={"mood": "Anxious", "identity": "Student"})
+            if response.status_code == 200 and catalog.status_code == 200:
+                ranked = response.json()
+                if sorted(a['id'] for a in ranked) == sorted(a['id'] for a in catalog.json()):
+                    self.log_test("Recommended Articles", True, f"Top pick for Anxious Student: {ranked[0]['title'] if ranked else 'none'}")
+                    return True
+                self.log_test("Recommended Articles", False, "Ranking does not cover the catalog (may still be rebuilding)")
+            else:
+                self.log_test("Recommended Articles", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_test("Recommended Articles", False, f"Error: {str(e)}")
+        return False
+        
+    def test_breathing_telemetry(self):
+        """Test streaming breathing samples into a zen session"""
+        try:
+            created = self.session.post(f"{API_URL}/zen-sessions", json={"session_type": "breathing", "duration": 1, "completed": False})
+            if created.status_code != 200:
+                self.log_test("Breathing Telemetry", False, f"HTTP {created.status_code}: {created.text}")
+                return False
+            session_id = created.json()['id']
+            self.created_data['zen_sessions'].append(session_id)
+            # Four 4-7-8 cycles at 10 Hz, streamed one second per line; three complete inhale-to-inhale breaths
+            phases = [0] * 40 + [1] * 70 + [2] * 80 + [3] * 20
+            samples = phases * 4 + [0]
+            lines = (
+                json.dumps({"t": [i * 100 for i in range(start, min(start + 10, len(samples)))],
+                            "phase": samples[start:start + 10]}) + "\n"
+                for start in range(0, len(samples), 10)
+            )
+            response = self.session.post(
+                f"{API_URL}/zen-sessions/{session_id}/telemetry",
+                data=lines,
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+            if response.status_code == 200:
+                summary = response.json()['summary']
+                if summary['breaths'] == 3 and summary['adherence'] == 1.0:
+                    self.log_test("Breathing Telemetry", True, f"{response.json()['samples']} samples, rate {summary['breath_rate']}/min")
+                    return True
+                self.log_test("Breathing Telemetry", False, f"Unexpected summary: {summary}")
+            else:
+                self.log_test("Breathing Telemetry", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_test("Breathing Telemetry", False, f"Error: {str(e)}")
+        return False
+        
+    def test_cbt_search(self):
+        """Test ranked search within the user's CBT journal"""
+        session = {
+            "negative_thought": "I am going to fail my chemistry exam",
+            "questions_and_answers": [{"question": "What evidence supports this thought?", "answer": "I revised for the exam all week"}],
+        }
+        try:
+            created = self.session.post(f"{API_URL}/cbt-sessions", json=session)
+            if created.status_code != 200:
+                self.log_test("CBT Journal Search", False, f"HTTP {created.status_code}: {created.text}")
+                return False
+            self.created_data['cbt_sessions'].append(created.json()['id'])
+            response = self.session.get(f"{API_URL}/cbt-sessions/search", params={"q": "chemistry exams", "limit": 5})
+            if response.status_code == 200:
+                results = response.json()['results']
+                top = results[0] if results else None
+                if top and top['session']['id'] == created.json()['id'] and '<mark>chemistry</mark>' in top['snippets'][0]['text']:
+                    self.log_test("CBT Journal Search", True, f"{len(results)} results, top score {top['score']}")
+                    return True
+                self.log_test("CBT Journal Search", False, f"New session not ranked first: {results[:1]}")
+            else:
+                self.log_test("CBT Journal Search", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_test("CBT Journal Search", False, f"Error: {str(e)}")
+        return False
+        
+    def test_mood_timeline(self):
+        """Test a user's mood timeline built from their preference history"""
+        try:
+            user_id = f"timeline-{uuid.uuid4()}"
+            for mood in ("Anxious", "Stressed", "Calm"):
+                prefs = {"identity": "Student", "current_mood": mood, "mood_frequency": "This week", "theme_colors": {}}
+                response = self.session.post(f"{API_URL}/preferences", params={"user_id": user_id}, json=prefs)
+                if response.status_code != 200:
+                    self.log_test("Mood Timeline", False, f"Saving preferences failed: HTTP {response.status_code}")
+                    return False
+            response = self.session.get(f"{API_URL}/preferences/timeline", params={"user_id": user_id, "days": 7})
+            if response.status_code == 200:
+                data = response.json()
+                moods = [event["mood"] for event in data["events"]]
+                transitions = sum(map(sum, data["transitions"]["counts"]))
+                if moods == ["Anxious", "Stressed", "Calm"] and transitions == 2 and len(data["daily"]) == 7:
+                    self.log_test("Mood Timeline", True, f"Today's distribution: {data['daily'][-1]['distribution']}")
+                    return True
+                self.log_test("Mood Timeline", False, f"Unexpected timeline: {moods}, {transitions} transitions")
+            else:
+                self.log_test("Mood Timeline", False, f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            self.log_test("Mood Timeline", False, f"Error: {str(e)}")
+        return False
+        
+    def test_distortion_report(self):
+        """Test the admin-only cognitive-distortion statistics"""
+        try:
+            response = self.session.get(f"{API_URL}/reports/distortions")
+            if response.status_code != 403:
+                self.log_test("Distortion Report", False, f"Expected 403 without admin token, got HTTP {response.status_code}")
+                return False
+            admin_token = os.environ.get('ADMIN_TOKEN')
+            if not admin_token:
+                self.log_test("Distortion Report", True, "Rejected without admin token (ADMIN_TOKEN not set, report skipped)")
+                return True
+            response = self.session.get(f"{API_URL}/reports/distortions", headers={"X-Admin-Token": admin_token})
+            if response.status_code == 200 and "stats" in response.json():
+                stats = response.json()["stats"]
+                classified = sum(row["sessions"] for row in stats if row["category"] != "unclassified")
+                self.log_test("Distortion Report", True, f"{len(stats)} rows, {classified} distortion matches")
+                return True
+            self.log_test("Distortion Report", False, f"HTTP {response.status_code}: {response.text[:200]}")
+        except Exception as e:
+            self.log_test("Distortion Report", False, f"Error: {str(e)}")
+        return False
+        
+    def test_account_erasure(self):
+        """Test queued account erasure and its status endpoint"""
+        try:
+            user_id = f"erasure-{uuid.uuid4()}"
+            response = self.session.delete(f"{API_URL}/users/{user_id}")
+            if response.status_code != 403:
+                self.log_test("Account Erasure", False, f"Expected 403 without admin token, got HTTP {response.status_code}")
+                return False
+            admin_token = os.environ.get('ADMIN_TOKEN')
+            if not admin_token:
+                self.log_test("Account Erasure", True, "Rejected without admin token (ADMIN_TOKEN not set, erasure skipped)")
+                return True
+            headers = {"X-Admin-Token": admin_token}
+            prefs = {"identity": "Student", "current_mood": "Calm", "mood_frequency": "This week", "theme_colors": {}}
+            self.session.post(f"{API_URL}/preferences", params={"user_id": user_id}, json=prefs)
+            response = self.session.delete(f"{API_URL}/users/{user_id}", headers=headers)
+            if response.status_code != 202:
+                self.log_test("Account Erasure", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            for _ in range(30):
+                job = self.session.get(f"{API_URL}/users/{user_id}/erasure", headers=headers).json()
+                if job.get("status") == "completed":
+                    break
+                time.sleep(1)
+            remaining = self.session.get(f"{API_URL}/preferences", params={"user_id": user_id}).json()
+            if job.get("status") == "completed" and remaining == []:
+                self.log_test("Account Erasure", True, f"Deleted per collection: {job['deleted']}")
+                return True
+            self.log_test("Account Erasure", False, f"Job {job.get('status')}, {len(remaining)} preferences left")
+        except Exception as e:
+            self.log_test("Account Erasure", False, f"Error: {str(e)}")
+        return False
+        
+    def test_loop_monitor(self):
+        """Test the admin-only event-loop lag histogram and sampling profiler"""
+        try:
+            response = self.session.get(f"{API_URL}/admin/loop-lag")
+            if response.status_code != 403:
+                self.log_test("Loop Monitor", False, f"Expected 403 without admin token, got HTTP {response.status_code}")
+                return False
+            admin_token = os.environ.get('ADMIN_TOKEN')
+            if not admin_token:
+                self.log_test("Loop Monitor", True, "Rejected without admin token (ADMIN_TOKEN not set, profile skipped)")
+                return True
+            headers = {"X-Admin-Token": admin_token}
+            lag = self.session.get(f"{API_URL}/admin/loop-lag", headers=headers).json()
+            if lag["histogram"]["buckets"][-1]["count"] != lag["histogram"]["count"]:
+                self.log_test("Loop Monitor", False, f"Histogram not cumulative: {lag['histogram']}")
+                return False
+            response = self.session.get(f"{API_URL}/admin/profile", params={"seconds": 1}, headers=headers)
+            stacks = response.text.strip().splitlines()
+            if response.status_code == 200 and stacks and stacks[0].rsplit(" ", 1)[1].isdigit():
+                self.log_test("Loop Monitor", True, f"Lag {lag['lag_ms']}ms, {len(lag['slow_callbacks'])} stalls, {len(stacks)} stacks profiled")
+                return True
+            self.log_test("Loop Monitor", False, f"HTTP {response.status_code}: {response.text[:200]}")
+        except Exception as e:
+            self.log_test("Loop Monitor", False, f"Error: {str(e)}")
+        return False
+        
+    def test_daily_usage_report(self):
+        """Test the admin-only daily usage report export"""
+        try:
+            response = self.session.get(f"{API_URL}/reports/daily-usage")
+            if response.status_code != 403:
+                self.log_test("Daily Usage Report", False, f"Expected 403 without admin token, got HTTP {response.status_code}")
+                return False
+            admin_token = os.environ.get('ADMIN_TOKEN')
+            if not admin_token:
+                self.log_test("Daily Usage Report", True, "Rejected without admin token (ADMIN_TOKEN not set, export skipped)")
+                return True
+            response = self.session.get(
+                f"{API_URL}/reports/daily-usage",
+                params={"format": "csv"},
+                headers={"X-Admin-Token": admin_token},
+            )
+            if response.status_code == 200 and response.text.startswith("day,source,feature"):
+                rows = len(response.text.strip().splitlines()) - 1
+                self.log_test("Daily Usage Report", True, f"CSV export returned {rows} rows")
+                return True
+            self.log_test("Daily Usage Report", False, f"HTTP {response.status_code}: {response.text[:200]}")
+        except Exception as e:
+            self.log_test("Daily Usage Report", False, f"Error: {str(e)}")
+        return False
+        
     def run_all_tests(self):
         """Run all API tests"""
         print(f"🧪 Starting Serenity Space Backend API Tests")
@@ -581,6 +818,33 @@ class SerenitySpaceAPITester:
         print("\n📊 Testing Usage Analytics System...")
         analytics_ok = self.test_usage_analytics()
         
+        print("\n📦 Testing Batch Start-up Endpoint...")
+        batch_ok = self.test_batch_startup()
+        
+        print("\n🧭 Testing Recommended Articles...")
+        recommended_ok = self.test_recommended_articles()
+        
+        print("\n🔎 Testing CBT Journal Search...")
+        search_ok = self.test_cbt_search()
+        
+        print("\n🌬️ Testing Breathing Telemetry...")
+        telemetry_ok = self.test_breathing_telemetry()
+        
+        print("\n📉 Testing Mood Timeline...")
+        timeline_ok = self.test_mood_timeline()
+        
+        print("\n🧩 Testing Distortion Statistics...")
+        distortions_ok = self.test_distortion_report()
+        
+        print("\n🗑️ Testing Account Erasure...")
+        erasure_ok = self.test_account_erasure()
+        
+        print("\n🩺 Testing Loop Monitor...")
+        loop_ok = self.test_loop_monitor()
+        
+        print("\n📈 Testing Daily Usage Reports...")
+        reports_ok = self.test_daily_usage_report()
+        
         # Summary
         print("\n" + "=" * 60)
         print("📊 TEST SUMMARY")
@@ -602,7 +866,7 @@ class SerenitySpaceAPITester:
                 print(f"  • {test['test']}: {test['message']}")
         
         # Overall status
-        critical_apis = [health_ok, prefs_ok, questions_ok, cbt_ok, zen_ok, articles_ok, dynamic_cbt_ok, analytics_ok]
+        critical_apis = [health_ok, prefs_ok, questions_ok, cbt_ok, zen_ok, articles_ok, dynamic_cbt_ok, analytics_ok, batch_ok, recommended_ok, search_ok, telemetry_ok, timeline_ok, distortions_ok, erasure_ok, loop_ok, reports_ok]
         all_critical_passed = all(critical_apis)
         
         if all_critical_passed:
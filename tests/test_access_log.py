@@ -0,0 +1,124 @@
+"""
+Access records: sampling of successful requests, errors and slow requests always logged, request ids.
+
+Usage: python -m pytest tests/test_access_log.py
+"""
+
+import asyncio
+import json
+import logging
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from access_log import AccessLogMiddleware, JsonFormatter, MongoTimingListener, RequestIdFilter, current_request  # noqa: E402
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def access_records():
+    handler = Records()
+    logger = logging.getLogger("access")
+    logger.addHandler(handler)
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        yield handler.records
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+
+
+def endpoint(status=200, delay=0.0, mongo_ms=0.0):
+    async def app(scope, receive, send):
+        if delay:
+            await asyncio.sleep(delay)
+        if mongo_ms:
+            # What the command listener does for each Mongo command the handler issues
+            event = SimpleNamespace(duration_micros=int(mongo_ms * 1000))
+            MongoTimingListener().succeeded(event)
+            MongoTimingListener().succeeded(event)
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def request(app, path="/api/articles", headers=()):
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"user_id=u1", "headers": list(headers)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return dict(sent[0]["headers"])
+
+
+def test_successful_requests_are_sampled(access_records):
+    app = AccessLogMiddleware(endpoint(), sample_rate=0.0, slow_ms=1000)
+    for _ in range(20):
+        request(app)
+    assert access_records == []
+    app.sample_rate = 1.0
+    request(app)
+    fields = access_records[0].fields
+    assert fields["status"] == 200 and fields["sampled"] is True and fields["user_id"] == "u1"
+
+
+def test_a_request_is_logged_when_its_draw_falls_under_the_rate(access_records, monkeypatch):
+    draws = iter([0.05, 0.5, 0.09, 0.95])
+    monkeypatch.setattr("access_log.random.random", lambda: next(draws))
+    app = AccessLogMiddleware(endpoint(), sample_rate=0.1)
+    for _ in range(4):
+        request(app)
+    assert len(access_records) == 2
+
+
+def test_errors_and_slow_requests_are_always_logged(access_records):
+    request(AccessLogMiddleware(endpoint(status=503), sample_rate=0.0))
+    request(AccessLogMiddleware(endpoint(delay=0.02), sample_rate=0.0, slow_ms=10))
+    assert [(r.fields["status"], r.fields["sampled"]) for r in access_records] == [(503, False), (200, False)]
+    assert access_records[1].fields["latency_ms"] >= 10
+
+
+def test_a_failing_handler_is_logged_as_500(access_records):
+    async def broken(scope, receive, send):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        request(AccessLogMiddleware(broken, sample_rate=0.0))
+    assert access_records[0].fields["status"] == 500
+
+
+def test_request_id_is_propagated_and_mongo_time_attributed(access_records):
+    headers = request(AccessLogMiddleware(endpoint(mongo_ms=1.5)), headers=[(b"x-request-id", b"req-1")])
+    assert headers[b"x-request-id"] == b"req-1"
+    fields = access_records[0].fields
+    assert fields["request_id"] == "req-1" and fields["mongo_commands"] == 2 and fields["mongo_ms"] == 3.0
+    # Generated when the client didn't send one
+    assert len(request(AccessLogMiddleware(endpoint()))[b"x-request-id"]) == 32
+    assert current_request.get() is None
+
+
+def test_records_are_json_lines_tagged_with_the_request():
+    record = logging.LogRecord("server", logging.INFO, __file__, 1, "hello %s", ("there",), None)
+    RequestIdFilter().filter(record)
+    assert json.loads(JsonFormatter().format(record))["message"] == "hello there"
+    record.fields = {"route": "/api/articles", "status": 200}
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["route"] == "/api/articles" and entry["level"] == "INFO"
@@ -0,0 +1,186 @@
+"""
+Admission control: client identity, token buckets, pressure shedding and the concurrency cap.
+
+Usage: python -m pytest tests/test_admission.py
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from admission import (  # noqa: E402
+    HIGH, LOW, NORMAL, AdmissionConfig, AdmissionMiddleware, RateLimit, TokenBucket, client_key, parse_networks,
+)
+
+PROXIES = parse_networks("10.0.0.0/8, 192.168.1.1")
+
+
+class Probe:
+    def __init__(self, lag=0.0):
+        self.lag = lag
+
+
+class Pool:
+    def __init__(self, waiting=0):
+        self.waiting = waiting
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def scope(path="/api/articles", method="GET", client="203.0.113.7", forwarded=None, query=b""):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return {"type": "http", "method": method, "path": path, "query_string": query, "headers": headers, "client": (client, 5000)}
+
+
+def config(**overrides):
+    return AdmissionConfig(limits={
+        LOW: RateLimit(rate=1, burst=2),
+        NORMAL: RateLimit(rate=1, burst=100),
+        HIGH: RateLimit(rate=1, burst=100),
+    }, **overrides)
+
+
+async def ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def call(app, request):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(request, receive, send)
+    headers = dict(sent[0]["headers"])
+    return sent[0]["status"], headers
+
+
+def test_client_key_ignores_user_id_and_untrusted_forwarded_for():
+    assert client_key(scope(query=b"user_id=someone-else")) == "ip:203.0.113.7"
+    # A client talking to us directly can't pick its own address
+    assert client_key(scope(forwarded="1.2.3.4"), PROXIES) == "ip:203.0.113.7"
+    assert client_key(scope(forwarded="1.2.3.4")) == "ip:203.0.113.7"
+
+
+def test_client_key_takes_the_first_untrusted_hop_behind_trusted_proxies():
+    assert client_key(scope(client="10.1.2.3", forwarded="198.51.100.9"), PROXIES) == "ip:198.51.100.9"
+    # Entries to the left of the real client are whatever the client sent
+    assert client_key(scope(client="10.1.2.3", forwarded="1.2.3.4, 198.51.100.9, 192.168.1.1"), PROXIES) == "ip:198.51.100.9"
+    assert client_key(scope(client="10.1.2.3"), PROXIES) == "ip:10.1.2.3"
+    assert client_key(scope(client="10.1.2.3", forwarded="not-an-ip"), PROXIES) == "ip:not-an-ip"
+
+
+def test_token_bucket_refills_at_its_rate_up_to_the_burst():
+    limit = RateLimit(rate=2, burst=3)
+    bucket = TokenBucket(limit.burst, now=0.0)
+    assert [bucket.take(limit, 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(limit, 0.0) == 0.5
+    assert bucket.take(limit, 0.5) == 0.0
+    # Idle time never banks more than the burst
+    assert [bucket.take(limit, 100.0) for _ in range(4)][-1] > 0
+
+
+def test_each_client_and_priority_has_its_own_bucket():
+    async def main():
+        clock = Clock()
+        app = AdmissionMiddleware(ok, config(), Probe(), Pool(), clock=clock)
+        analytics = scope("/api/analytics/summary")
+        assert [(await call(app, analytics))[0] for _ in range(3)] == [200, 200, 429]
+        status, headers = await call(app, analytics)
+        assert status == 429 and headers[b"retry-after"] == b"1"
+        # Other routes and other clients have their own budget
+        assert (await call(app, scope("/api/articles")))[0] == 200
+        assert (await call(app, scope("/api/analytics/summary", client="203.0.113.8")))[0] == 200
+        # Changing user_id does not buy a fresh bucket
+        assert (await call(app, scope("/api/analytics/summary", query=b"user_id=fresh")))[0] == 429
+        clock.now = 1.0
+        assert (await call(app, analytics))[0] == 200
+    asyncio.run(main())
+
+
+def test_the_bucket_table_is_bounded():
+    async def main():
+        app = AdmissionMiddleware(ok, config(max_clients=3), Probe(), Pool())
+        for i in range(5):
+            await call(app, scope(client=f"203.0.113.{i}"))
+        assert len(app.buckets) == 3
+        assert ("ip:203.0.113.0", NORMAL) not in app.buckets
+    asyncio.run(main())
+
+
+def test_pressure_sheds_low_priority_first():
+    async def main():
+        probe, pool = Probe(), Pool()
+        app = AdmissionMiddleware(ok, config(), probe, pool)
+        analytics = scope("/api/analytics/summary", client="203.0.113.1")
+        read = scope("/api/articles")
+        write = scope("/api/cbt-sessions", method="POST")
+
+        probe.lag = 0.1  # past lag_soft
+        status, headers = await call(app, analytics)
+        assert status == 503 and headers[b"retry-after"] == b"2"
+        assert (await call(app, read))[0] == 200
+
+        probe.lag = 0.3  # past lag_hard
+        assert (await call(app, read))[0] == 503
+        assert (await call(app, write))[0] == 200
+
+        probe.lag = 0.0
+        pool.waiting = 60  # Mongo pool queue past pool_wait_hard
+        assert (await call(app, read))[0] == 503
+        pool.waiting = 0
+        assert (await call(app, read))[0] == 200
+    asyncio.run(main())
+
+
+def test_concurrency_cap_keeps_a_reserve_for_session_writes():
+    async def main():
+        release = asyncio.Event()
+        started = []
+
+        async def slow(scope, receive, send):
+            started.append(scope["path"])
+            await release.wait()
+            await ok(scope, receive, send)
+
+        app = AdmissionMiddleware(slow, config(max_concurrency=3, high_reserve=1, long_lived_paths=("/api/events",)), Probe(), Pool())
+        reads = [asyncio.create_task(call(app, scope(f"/api/articles/{i}"))) for i in range(2)]
+        await asyncio.sleep(0)
+        assert app.in_flight == 2
+        # Reads are capped below the reserve...
+        assert (await call(app, scope("/api/articles")))[0] == 503
+        # ...which a session write may still use
+        write = asyncio.create_task(call(app, scope("/api/cbt-sessions", method="POST")))
+        await asyncio.sleep(0)
+        assert app.in_flight == 3
+        assert (await call(app, scope("/api/zen-sessions", method="POST")))[0] == 503
+        # Streams don't hold a slot
+        stream = asyncio.create_task(call(app, scope("/api/events")))
+        await asyncio.sleep(0)
+        assert "/api/events" in started and app.in_flight == 3
+        release.set()
+        results = await asyncio.gather(*reads, write, stream)
+        assert [status for status, _ in results] == [200, 200, 200, 200]
+        assert app.in_flight == 0
+    asyncio.run(main())
+
+
+def test_non_api_and_preflight_requests_bypass_admission():
+    async def main():
+        app = AdmissionMiddleware(ok, config(), Probe(lag=10.0), Pool())
+        assert (await call(app, scope("/")))[0] == 200
+        assert (await call(app, scope("/api/articles", method="OPTIONS")))[0] == 200
+        assert not app.buckets
+    asyncio.run(main())
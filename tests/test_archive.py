@@ -0,0 +1,127 @@
+"""
+Session archival: bucket packing, archive round trips, capped reads and the archival lease.
+
+The archiver tests run when STORAGE_TEST_MONGO_URL points at a MongoDB server; each
+uses a throwaway database that is dropped afterwards.
+
+Usage: python -m pytest tests/test_archive.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from archive import TERMS_FIELD, SessionArchiver, as_naive_utc, bucket_terms, pack_sessions, unpack_sessions  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+needs_mongo = pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+
+NOW = datetime.now(timezone.utc)
+# BSON keeps milliseconds
+NOW = NOW.replace(microsecond=NOW.microsecond // 1000 * 1000)
+
+
+def session(user_id="u1", days_ago=400, **fields):
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "negative_thought": "I always get this wrong",
+        "created_at": as_naive_utc(NOW - timedelta(days=days_ago)),
+        **fields,
+    }
+
+
+@asynccontextmanager
+async def open_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    name = f"archive_{uuid.uuid4().hex[:12]}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+def test_buckets_round_trip_and_carry_the_union_of_terms():
+    sessions = [session(**{TERMS_FIELD: ["b", "a"]}), session(**{TERMS_FIELD: ["a", "c"]}), session()]
+    assert unpack_sessions(pack_sessions(sessions)) == sessions
+    assert bucket_terms(sessions) == ["a", "b", "c"]
+
+
+def test_reads_only_reach_the_archive_past_the_cutoff():
+    archiver = SessionArchiver(db=None, max_age_days=180)
+    assert archiver.reaches_archive(None)
+    assert archiver.reaches_archive(NOW - timedelta(days=200))
+    assert not archiver.reaches_archive(NOW - timedelta(days=30))
+    # Naive datetimes are read as UTC
+    assert not archiver.reaches_archive(as_naive_utc(NOW - timedelta(days=30)))
+
+
+@needs_mongo
+def test_old_sessions_move_to_buckets_and_read_back():
+    async def main():
+        async with open_db() as db:
+            archiver = SessionArchiver(db, max_age_days=180, batch_size=4, duty_cycle=1.0)
+            await archiver.ensure_indexes()
+            old = [session(days_ago=400 - i) for i in range(6)] + [session("u2", days_ago=300)]
+            recent = session(days_ago=1)
+            await db.cbt_sessions.insert_many([dict(doc) for doc in old + [recent]])
+
+            assert await archiver.acquire_lease()
+            assert await archiver.run_once() == {"cbt": 7, "zen": 0}
+            assert [doc["id"] for doc in await db.cbt_sessions.find().to_list(None)] == [recent["id"]]
+
+            archived = await archiver.fetch_archived("cbt", "u1")
+            assert [doc["id"] for doc in archived] == [doc["id"] for doc in old[:6]]
+            assert "_id" not in archived[0] and archived[0]["negative_thought"] == "I always get this wrong"
+            assert await archiver.is_archived("cbt", old[0]["id"])
+
+            # A range only unpacks what it overlaps, and the cap keeps the newest
+            ranged = await archiver.fetch_archived("cbt", "u1", since=NOW - timedelta(days=397, hours=12))
+            assert [doc["id"] for doc in ranged] == [doc["id"] for doc in old[3:6]]
+            capped = await archiver.fetch_archived("cbt", "u1", limit=3)
+            assert [doc["id"] for doc in capped] == [doc["id"] for doc in old[3:6]]
+
+            assert await archiver.delete_archived("cbt", "u1", old[0]["id"])
+            assert not await archiver.delete_archived("cbt", "u2", old[1]["id"])
+            assert len(await archiver.fetch_archived("cbt", "u1")) == 5
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_only_the_lease_holder_archives_and_it_stops_once_taken_over():
+    async def main():
+        async with open_db() as db:
+            first = SessionArchiver(db, max_age_days=180, batch_size=2, duty_cycle=1.0, interval=60)
+            second = SessionArchiver(db, max_age_days=180, batch_size=2, duty_cycle=1.0, interval=60)
+            await first.ensure_indexes()
+            assert await first.acquire_lease()
+            assert not await second.acquire_lease()
+
+            await db.cbt_sessions.insert_many([session(days_ago=400 - i) for i in range(6)])
+            batches = []
+            archive_batch = first.archive_batch
+
+            async def take_over_after_one(kind, cutoff):
+                moved = await archive_batch(kind, cutoff)
+                batches.append(moved)
+                # The first worker's lease runs out mid-run and another worker takes it
+                await db.archive_state.update_one({"_id": "archive_lease"}, {"$set": {"expires_at": NOW - timedelta(seconds=1)}})
+                assert await second.acquire_lease()
+                return moved
+
+            first.archive_batch = take_over_after_one
+            assert await first.run_once() == {"cbt": 2}
+            assert batches == [2]
+            assert await db.cbt_sessions.count_documents({}) == 4
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Batched sub-requests: GET only, and admitted against the caller's own rate limits.
+
+Usage: python -m pytest tests/test_batch.py
+"""
+
+import asyncio
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+from fastapi import FastAPI
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from admission import HIGH, LOW, NORMAL, AdmissionConfig, AdmissionMiddleware, LoopLagProbe, RateLimit  # noqa: E402
+from batch import dispatch_batch  # noqa: E402
+
+SCOPE = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+         "server": ("test", 80), "client": ("10.0.0.1", 5000), "root_path": "", "headers": []}
+
+
+class NoPool:
+    waiting = 0
+
+
+def build(buckets):
+    api = FastAPI()
+
+    @api.get("/api/analytics/summary")
+    async def summary():
+        return {"total_sessions": 0}
+
+    @api.get("/api/articles")
+    async def articles():
+        return []
+
+    @api.post("/api/analytics")
+    async def track():
+        return {}
+
+    config = AdmissionConfig(limits={
+        LOW: RateLimit(rate=0.001, burst=2),
+        NORMAL: RateLimit(rate=0.001, burst=50),
+        HIGH: RateLimit(rate=0.001, burst=50),
+    })
+    return AdmissionMiddleware(api.router, config, LoopLagProbe(), NoPool(), buckets=buckets)
+
+
+def test_analytics_sub_requests_are_rate_limited():
+    buckets = OrderedDict()
+    app = build(buckets)
+    requests = [{"id": str(i), "method": "GET", "path": "/api/analytics/summary"} for i in range(5)]
+    requests.append({"id": "articles", "method": "GET", "path": "/api/articles"})
+    responses = asyncio.run(dispatch_batch(app, SCOPE, requests, timeout=5))
+    statuses = [response["status"] for response in responses]
+    assert sorted(statuses[:5]) == [200, 200, 429, 429, 429]
+    assert statuses[5] == 200
+    # The LOW budget is the same one a direct request would spend
+    assert ("ip:10.0.0.1", LOW) in buckets
+    again = asyncio.run(dispatch_batch(build(buckets), SCOPE, requests[:1], timeout=5))
+    assert again[0]["status"] == 429
+
+
+def test_writes_are_not_allowed_in_a_batch():
+    responses = asyncio.run(dispatch_batch(build(OrderedDict()), SCOPE, [
+        {"id": "track", "method": "POST", "path": "/api/analytics", "body": {"feature": "zen"}},
+        {"id": "nested", "method": "GET", "path": "/api/batch"},
+    ], timeout=5))
+    assert [response["status"] for response in responses] == [405, 400]
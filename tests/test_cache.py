@@ -0,0 +1,168 @@
+"""
+Per-worker read cache: generations, TTL and change-stream invalidation.
+
+Usage: python -m pytest tests/test_cache.py
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from pymongo.errors import OperationFailure
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from cache import CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAMS_UNSUPPORTED, ChangeStreamInvalidator, LocalCache  # noqa: E402
+
+
+def enabled_cache(**kwargs):
+    cache = LocalCache(**kwargs)
+    cache.enabled = True
+    return cache
+
+
+def change(collection, user_id=None, operation="insert"):
+    return {"ns": {"coll": collection}, "operationType": operation, "fullDocument": {"user_id": user_id} if user_id else None}
+
+
+class Stream:
+    """Minimal change stream: replays ``pending`` on try_next, then fails with ``error``"""
+
+    def __init__(self, pending=(), error=None):
+        self.pending = list(pending)
+        self.error = error
+        self.resume_token = {"_data": "start"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def try_next(self):
+        if not self.pending:
+            return None
+        change = self.pending.pop(0)
+        self.resume_token = {"_data": change["token"]}
+        return change
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise self.error
+
+
+class Database:
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.resumed_after = []
+
+    def watch(self, pipeline, resume_after=None):
+        self.resumed_after.append(resume_after)
+        return self.streams.pop(0)
+
+
+def test_entries_are_only_served_while_enabled_and_fresh():
+    cache = LocalCache(ttl=0.05)
+    cache.set("articles", None, ["a1"], cache.generation)
+    assert cache.get("articles") is None  # not watching yet: nothing is stored or served
+    cache.enabled = True
+    cache.set("articles", None, ["a1"], cache.generation)
+    assert cache.get("articles") == ["a1"] and cache.hits == 1
+    time.sleep(0.06)
+    assert cache.get("articles") is None and cache.misses == 1
+
+
+def test_a_read_that_raced_a_write_is_not_cached():
+    cache = enabled_cache()
+    generation = cache.generation
+    # The write lands while the read is still in flight...
+    cache.invalidate("favorites", "u1")
+    # ...so what the read returns may predate it
+    cache.set("favorites", "u1", ["stale"], generation)
+    assert cache.get("favorites", "u1") is None
+    cache.set("favorites", "u1", ["fresh"], cache.generation)
+    assert cache.get("favorites", "u1") == ["fresh"]
+
+
+def test_invalidation_by_key_and_by_namespace():
+    cache = enabled_cache(max_entries=10)
+    for user_id in ("u1", "u2"):
+        cache.set("cbt_sessions", user_id, user_id, cache.generation)
+        cache.set("zen_sessions", user_id, user_id, cache.generation)
+    cache.invalidate("cbt_sessions", "u1")
+    assert cache.get("cbt_sessions", "u1") is None and cache.get("cbt_sessions", "u2") == "u2"
+    cache.invalidate("zen_sessions")
+    assert cache.get("zen_sessions", "u1") is None and cache.get("zen_sessions", "u2") is None
+    assert cache.get("cbt_sessions", "u2") == "u2"
+
+
+def test_the_entry_table_is_bounded():
+    cache = enabled_cache(max_entries=2)
+    for user_id in ("u1", "u2", "u3"):
+        cache.set("favorites", user_id, user_id, cache.generation)
+    assert len(cache._entries) <= 2 and cache.get("favorites", "u3") == "u3"
+
+
+def test_changes_evict_the_owner_and_feed_listeners():
+    cache = enabled_cache()
+    seen, writes, evicted = [], [], []
+    invalidator = ChangeStreamInvalidator(
+        None, cache, on_write=lambda owner, at: writes.append((owner, at)), on_invalidate=lambda ns, key: evicted.append((ns, key)),
+    )
+    invalidator.add_listener("user_events", seen.append)
+    cache.set("favorites", "u1", ["a1"], cache.generation)
+    cache.set("articles", None, ["a1"], cache.generation)
+    invalidator.handle({**change("favorite_articles", "u1"), "clusterTime": 7})
+    invalidator.handle({**change("articles", "admin"), "clusterTime": 8})
+    invalidator.handle(change("user_events", "u1"))
+    assert cache.get("favorites", "u1") is None and cache.get("articles") is None
+    assert writes == [("u1", 7), ("admin", 8)]
+    assert evicted == [("favorites", "u1"), ("articles", None)]
+    assert len(seen) == 1 and invalidator.events == 2
+
+
+def test_resume_replays_missed_changes_before_serving():
+    async def main():
+        cache = LocalCache()
+        missed = {**change("cbt_sessions", "u1"), "token": "t1"}
+        db = Database(
+            Stream(error=OperationFailure("stepdown", code=11602)),
+            Stream(pending=[missed], error=OperationFailure("history lost", code=CHANGE_STREAM_HISTORY_LOST)),
+            Stream(error=OperationFailure("not a replica set", code=CHANGE_STREAMS_UNSUPPORTED)),
+        )
+        invalidator = ChangeStreamInvalidator(db, cache, retry_delay=0)
+        cache.enabled = True
+        cache.set("cbt_sessions", "u1", ["old"], cache.generation)
+        await invalidator.run()
+        # First connection: no resume point, so everything cached before is dropped
+        # Second: resumed after the first stream's token and replayed the missed change
+        # Third: the token had left the oplog, so it restarted from now
+        assert db.resumed_after == [None, {"_data": "start"}, None]
+        assert invalidator.events == 1
+        assert cache.get("cbt_sessions", "u1") is None
+        # Without change streams the cache stays off
+        assert cache.enabled is False
+    asyncio.run(main())
+
+
+def test_session_writes_evict_the_owners_mood_timeline():
+    cache = enabled_cache()
+    invalidator = ChangeStreamInvalidator(None, cache)
+    for kind in ("cbt_sessions", "zen_sessions"):
+        cache.set("mood_timeline", "u1", "timeline", cache.generation)
+        cache.set("mood_timeline", "u2", "timeline", cache.generation)
+        invalidator.handle(change(kind, "u1"))
+        assert cache.get("mood_timeline", "u1") is None
+        assert cache.get("mood_timeline", "u2") == "timeline"
+
+
+def test_archiving_drops_every_mood_timeline():
+    cache = enabled_cache()
+    invalidator = ChangeStreamInvalidator(None, cache)
+    cache.set("mood_timeline", "u1", "timeline", cache.generation)
+    # Bucket updates only carry the _id, so the whole namespace goes
+    invalidator.handle(change("session_archive", operation="update"))
+    assert cache.get("mood_timeline", "u1") is None
@@ -0,0 +1,109 @@
+"""
+Response compression: Accept-Encoding negotiation, per-route policies and skip rules.
+
+Usage: python -m pytest tests/test_compression.py
+"""
+
+import asyncio
+import gzip
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import compression  # noqa: E402
+from compression import CompressionMiddleware, CompressionPolicy, choose_encoding, parse_accept_encoding  # noqa: E402
+
+BODY = b'{"title": "Breathing for exam stress"}' * 100
+
+
+def respond(body=BODY, content_type="application/json", chunks=1, headers=()):
+    async def app(scope, receive, send):
+        raw = [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()), *headers]
+        await send({"type": "http.response.start", "status": 200, "headers": raw})
+        size = len(body) // chunks
+        for i in range(chunks):
+            part = body[i * size:] if i == chunks - 1 else body[i * size:(i + 1) * size]
+            await send({"type": "http.response.body", "body": part, "more_body": i < chunks - 1})
+    return app
+
+
+def get(app, path="/api/articles", accept="gzip, br"):
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [(b"accept-encoding", accept.encode())] if accept else []}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return headers, b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def test_accept_encoding_q_values():
+    assert parse_accept_encoding("gzip;q=0.5, br , identity;q=bogus") == {"gzip": 0.5, "br": 1.0, "identity": 0.0}
+    assert choose_encoding("") is None
+    assert choose_encoding("gzip, br;q=0") == "gzip"
+    assert choose_encoding("br;q=0, gzip;q=0") is None
+    assert choose_encoding("*") in ("br", "gzip")
+
+
+def test_brotli_preferred_on_ties_and_gzip_without_it(monkeypatch):
+    if compression.brotli is not None:
+        assert choose_encoding("gzip, br") == "br"
+        assert choose_encoding("gzip, br;q=0.5") == "gzip"
+    monkeypatch.setattr(compression, "brotli", None)
+    assert choose_encoding("br") is None
+    assert choose_encoding("gzip, br") == "gzip"
+
+
+@pytest.mark.parametrize("accept", ["gzip", "br"])
+def test_large_bodies_are_compressed(accept):
+    if accept == "br" and compression.brotli is None:
+        pytest.skip("brotli not installed")
+    headers, body = get(CompressionMiddleware(respond()), accept=accept)
+    assert headers["content-encoding"] == accept
+    assert headers["content-length"] == str(len(body))
+    assert "Accept-Encoding" in headers["vary"]
+    decoded = gzip.decompress(body) if accept == "gzip" else compression.brotli.decompress(body)
+    assert decoded == BODY
+
+
+@pytest.mark.parametrize("body,kwargs", [
+    (b"{}", {}),
+    (BODY, {"content_type": "image/png"}),
+    (BODY, {"content_type": "text/event-stream"}),
+    (BODY, {"chunks": 3}),
+], ids=["small", "image", "event-stream", "streaming"])
+def test_skipped_responses_pass_through_untouched(body, kwargs):
+    headers, sent = get(CompressionMiddleware(respond(body=body, **kwargs)), accept="gzip")
+    assert "content-encoding" not in headers and "vary" not in headers
+    assert sent == body
+
+
+def test_already_encoded_responses_are_not_compressed_twice():
+    encoded = gzip.compress(BODY)
+    headers, body = get(CompressionMiddleware(respond(body=encoded, headers=[(b"content-encoding", b"gzip")])), accept="gzip")
+    assert headers["content-encoding"] == "gzip" and body == encoded
+
+
+def test_no_acceptable_coding_leaves_the_body_alone():
+    headers, body = get(CompressionMiddleware(respond()), accept="identity")
+    assert "content-encoding" not in headers and body == BODY
+
+
+def test_longest_route_prefix_picks_the_policy():
+    app = CompressionMiddleware(
+        respond(),
+        default=CompressionPolicy(minimum_size=1),
+        routes={"/api": CompressionPolicy(enabled=False), "/api/articles": CompressionPolicy(minimum_size=1)},
+    )
+    assert app.policy_for("/api/articles/recommended").minimum_size == 1
+    assert "content-encoding" in get(app, "/api/articles", accept="gzip")[0]
+    assert "content-encoding" not in get(app, "/api/zen-sessions")[0]
+    assert app.policy_for("/health").enabled
@@ -0,0 +1,158 @@
+"""
+Cognitive-distortion rules and the pooled daily counting job.
+
+The checkpointed MongoDB jobs run when STORAGE_TEST_MONGO_URL points at a server.
+
+Usage: python -m pytest tests/test_distortions.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from distortions import CATEGORIES, STATE_ID, DistortionStats, classify, classify_chunk, frame, primary  # noqa: E402
+from encryption import FieldCipher  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+FIELDS = ("negative_thought", "questions_and_answers")
+DAY = datetime(2026, 5, 4)
+
+
+def session(thought, created_at, user_id="u1"):
+    return {"id": str(uuid.uuid4()), "user_id": user_id, "negative_thought": thought, "questions_and_answers": [], "created_at": created_at}
+
+
+def test_rules_follow_the_dynamic_question_order():
+    assert classify("I ALWAYS fail, I'm so stupid") == ["fear_of_failure", "all_or_nothing", "labeling"]
+    assert primary("I'm so stupid and I always mess up") == "all_or_nothing"
+    assert primary("No one would notice") == "loneliness"
+    assert classify("It's a quiet day") == [] and primary("It's a quiet day") is None
+
+
+def test_classify_chunk_counts_every_category_per_day():
+    counts, sessions, pid, cpu = classify_chunk([
+        ("2026-05-04", "I never get it right and I'm useless"),
+        ("2026-05-04", "Nothing in particular"),
+        ("2026-05-05", "I never get it right"),
+    ])
+    assert sessions == 3 and pid == os.getpid() and cpu >= 0
+    assert counts == {
+        "2026-05-04": {"all_or_nothing": 1, "worthlessness": 1, "unclassified": 1},
+        "2026-05-05": {"all_or_nothing": 1},
+    }
+    rows = frame(counts)
+    assert len(rows) == 2 * len(CATEGORIES)
+    assert rows[(rows.day == "2026-05-05") & (rows.category == "labeling")].sessions.item() == 0
+
+
+def test_counts_decrypted_sessions_on_a_process_pool(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "distortions.db"))
+        cipher = FieldCipher(os.urandom(32), storage.data_keys, FIELDS)
+        stats = DistortionStats(storage, cipher, workers=2, batch_size=7, chunk_size=3)
+        try:
+            thoughts = ["I always fail", "Nobody cares", "Just tired"] * 10
+            for i, thought in enumerate(thoughts):
+                doc = session(thought, DAY + timedelta(hours=i), user_id=f"u{i % 4}")
+                await storage.cbt_sessions.insert(await cipher.encrypt(doc))
+            rows, throughput = await stats.compute(DAY, DAY + timedelta(days=1))
+            totals = rows.groupby("category").sessions.sum()
+            # The first 24 sessions fall on DAY, 8 of each thought
+            assert totals["fear_of_failure"] == totals["all_or_nothing"] == 8
+            assert totals["loneliness"] == 8 and totals["unclassified"] == 8
+            assert throughput["sessions"] == 24
+            assert sum(worker["sessions"] for worker in throughput["workers"]) == 24
+        finally:
+            await stats.stop()
+            await storage.close()
+    asyncio.run(main())
+
+
+@pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+def test_materialize_resumes_from_the_checkpoint():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from reports import STATE_COLLECTION
+    from storage import MongoStorage
+
+    async def main():
+        client = AsyncIOMotorClient(MONGO_URL)
+        name = f"distortions_{uuid.uuid4().hex[:12]}"
+        db = client[name]
+        storage = MongoStorage(db)
+        cipher = FieldCipher(None, storage.data_keys, FIELDS)
+        stats = DistortionStats(storage, cipher, db, workers=2, chunk_days=1)
+        try:
+            today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+            for days_ago in (3, 2, 2, 0):
+                await storage.cbt_sessions.insert(session("I always fail", today - timedelta(days=days_ago)))
+            # Today is incomplete and waits for tomorrow's run
+            assert await stats.materialize() == 3
+            assert await stats.materialize() == 0
+            rows, throughput = await stats.load()
+            assert rows[rows.category == "all_or_nothing"].sessions.tolist() == [1, 2]
+            assert throughput["sessions"] == 3
+
+            # Rewind the checkpoint by two days: they are redone, not double counted
+            until = (await db[STATE_COLLECTION].find_one({"_id": STATE_ID}))["classified_until"]
+            await db[STATE_COLLECTION].update_one({"_id": STATE_ID}, {"$set": {"classified_until": until - timedelta(days=2)}})
+            assert await stats.materialize() == 2
+            rows, _ = await stats.load()
+            assert rows[rows.category == "all_or_nothing"].sessions.tolist() == [1, 2]
+        finally:
+            await stats.stop()
+            await client.drop_database(name)
+            client.close()
+    asyncio.run(main())
+
+
+@pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+def test_overlapping_runs_never_double_count_and_a_fenced_run_stops():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from distortions import STATS_COLLECTION
+    from reports import STATE_COLLECTION
+    from storage import MongoStorage
+
+    async def main():
+        client = AsyncIOMotorClient(MONGO_URL)
+        name = f"distortions_{uuid.uuid4().hex[:12]}"
+        db = client[name]
+        storage = MongoStorage(db)
+        cipher = FieldCipher(None, storage.data_keys, FIELDS)
+        first = DistortionStats(storage, cipher, db, workers=2, chunk_days=1)
+        second = DistortionStats(storage, cipher, db, workers=2, chunk_days=1)
+        try:
+            today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+            for days_ago in (4, 3, 3, 2, 1, 1, 1):
+                await storage.cbt_sessions.insert(session("I always fail", today - timedelta(days=days_ago)))
+            # Two workers materialize the same days at once, as after an expired lease
+            assert await asyncio.gather(first.materialize(), second.materialize()) == [4, 4]
+            rows, _ = await first.load()
+            assert rows[rows.category == "all_or_nothing"].sessions.tolist() == [1, 2, 1, 3]
+            assert await db[STATS_COLLECTION].count_documents({}) == 4 * len(CATEGORIES)
+
+            # A run whose lease was taken over stops before writing its chunk
+            await db[STATE_COLLECTION].delete_one({"_id": STATE_ID})
+            await db[STATS_COLLECTION].delete_many({})
+
+            async def lost():
+                return False
+
+            assert await first.materialize(lost) == 0
+            assert await db[STATS_COLLECTION].count_documents({}) == 0
+            assert await db[STATE_COLLECTION].find_one({"_id": STATE_ID}) is None
+        finally:
+            await first.stop()
+            await second.stop()
+            await client.drop_database(name)
+            client.close()
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Envelope encryption of CBT fields, with an in-memory key store.
+
+Usage: python -m pytest tests/test_encryption.py
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from encryption import ENCRYPTED_FIELD, FieldCipher, load_master_key  # noqa: E402
+
+FIELDS = ("negative_thought", "questions_and_answers")
+
+
+class MemoryKeys:
+    def __init__(self):
+        self.keys = {}
+        self.calls = 0
+
+    async def get_many(self, user_ids):
+        self.calls += 1
+        return {user_id: self.keys[user_id] for user_id in user_ids if user_id in self.keys}
+
+    async def create(self, user_id, wrapped):
+        return self.keys.setdefault(user_id, wrapped)
+
+    async def delete(self, user_id):
+        return self.keys.pop(user_id, None) is not None
+
+
+def cipher(keys=None, **options):
+    return FieldCipher(os.urandom(32), keys or MemoryKeys(), FIELDS, **options)
+
+
+def session(user_id="u1", session_id="s1"):
+    return {
+        "id": session_id,
+        "user_id": user_id,
+        "negative_thought": "Nobody likes me",
+        "questions_and_answers": [{"question": "Evidence?", "answer": "Some friends called"}],
+        "created_at": "2026-01-01T00:00:00",
+    }
+
+
+def test_roundtrip_seals_only_the_sensitive_fields():
+    async def main():
+        fc = cipher()
+        sealed = await fc.encrypt(session())
+        assert set(sealed) == {"id", "user_id", "created_at", ENCRYPTED_FIELD}
+        assert "Nobody" not in sealed[ENCRYPTED_FIELD]
+        assert await fc.decrypt_many([sealed]) == [session()]
+    asyncio.run(main())
+
+
+def test_ciphertext_is_bound_to_its_document():
+    async def main():
+        fc = cipher()
+        sealed = await fc.encrypt(session())
+        with pytest.raises(InvalidTag):
+            await fc.decrypt_many([{**sealed, "id": "s2"}])
+    asyncio.run(main())
+
+
+def test_batch_decrypt_fetches_keys_once_and_caches_them():
+    async def main():
+        master, keys = os.urandom(32), MemoryKeys()
+        docs = await FieldCipher(master, keys, FIELDS).encrypt_many(
+            [session(f"u{i % 3}", f"s{i}") for i in range(30)]
+        )
+        # A fresh cipher with the same master key, as on another worker
+        reader = FieldCipher(master, keys, FIELDS)
+        keys.calls = 0
+        opened = await reader.decrypt_many(docs)
+        assert [doc["id"] for doc in opened] == [f"s{i}" for i in range(30)]
+        assert keys.calls == 1
+        await reader.decrypt_many(docs)
+        assert keys.calls == 1
+
+        bounded = FieldCipher(master, keys, FIELDS, cache_size=2)
+        await bounded.decrypt_many(docs)
+        assert len(bounded._cache) == 2
+    asyncio.run(main())
+
+
+def test_large_batches_decrypt_off_the_event_loop():
+    async def main():
+        fc = cipher(offload_threshold=4)
+        docs = await fc.encrypt_many([session(session_id=f"s{i}") for i in range(10)])
+        assert len(await fc.decrypt_many(docs)) == 10
+    asyncio.run(main())
+
+
+def test_plaintext_documents_pass_through():
+    async def main():
+        fc = cipher()
+        assert await fc.decrypt_many([session()]) == [session()]
+        disabled = FieldCipher(None, MemoryKeys(), FIELDS)
+        assert await disabled.encrypt(session()) == session()
+        sealed = await fc.encrypt(session())
+        with pytest.raises(RuntimeError):
+            await disabled.decrypt_many([sealed])
+    asyncio.run(main())
+
+
+def test_deleted_key_makes_documents_unreadable():
+    async def main():
+        keys = MemoryKeys()
+        fc = cipher(keys)
+        sealed = await fc.encrypt(session())
+        await keys.delete("u1")
+        fc.forget("u1")
+        assert await fc.decrypt_many([sealed, session("u2", "plain")]) == [session("u2", "plain")]
+    asyncio.run(main())
+
+
+def test_master_key_must_be_256_bits():
+    assert load_master_key("") is None
+    assert len(load_master_key("A" * 43)) == 32
+    with pytest.raises(ValueError):
+        load_master_key("AAAA")
@@ -0,0 +1,194 @@
+"""
+Account erasure: crypto-shredding, bounded batches, adaptive batch size and resuming.
+
+Usage: python -m pytest tests/test_erasure.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from encryption import FieldCipher  # noqa: E402
+from erasure import COMPLETED, RUNNING, AccountEraser, LeaseLost  # noqa: E402
+from search import JournalSearch  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+FIELDS = ("negative_thought", "questions_and_answers")
+
+
+def steps(storage):
+    return [
+        ("user_preferences", storage.preferences.delete_user_batch),
+        ("cbt_sessions", storage.cbt_sessions.delete_user_batch),
+        ("zen_sessions", storage.zen_sessions.delete_user_batch),
+        ("favorite_articles", storage.favorites.delete_user_batch),
+        ("usage_analytics", storage.analytics.delete_user_batch),
+    ]
+
+
+async def fill(storage, cipher, user_id, sessions):
+    search = JournalSearch(storage, cipher)
+    now = datetime.now(timezone.utc)
+    for i in range(sessions):
+        doc = {"id": str(uuid.uuid4()), "user_id": user_id, "negative_thought": f"I always fail {i}", "questions_and_answers": [], "created_at": now}
+        await storage.cbt_sessions.insert(await cipher.encrypt(await search.index(doc)))
+    await storage.zen_sessions.insert({"id": str(uuid.uuid4()), "user_id": user_id, "session_type": "breathing", "duration": 5, "created_at": now})
+    await storage.favorites.insert({"id": str(uuid.uuid4()), "user_id": user_id, "article_id": "a1", "created_at": now})
+    await storage.analytics.insert({"id": str(uuid.uuid4()), "user_id": user_id, "feature": "zen", "action": "complete", "created_at": now})
+    await storage.preferences.insert({"id": str(uuid.uuid4()), "user_id": user_id, "current_mood": "Calm", "created_at": now})
+
+
+def test_batch_size_halves_when_slow_and_grows_when_fast():
+    eraser = AccountEraser(storage=None, steps=[], min_batch=50, max_batch=400, target_latency=0.05)
+    assert eraser.adapt(200, 0.2) == 100
+    assert eraser.adapt(60, 0.2) == 50
+    assert eraser.adapt(200, 0.01) == 250
+    assert eraser.adapt(380, 0.01) == 400
+
+
+def test_erases_one_user_in_batches(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "erasure.db"))
+        cipher = FieldCipher(os.urandom(32), storage.data_keys, FIELDS)
+        forgotten, erased = [], []
+        eraser = AccountEraser(
+            storage, steps(storage), on_key_deleted=forgotten.append, on_erased=erased.append,
+            min_batch=4, max_batch=8, duty_cycle=1.0,
+        )
+        try:
+            await fill(storage, cipher, "u1", 25)
+            await fill(storage, cipher, "u2", 2)
+            queued = await eraser.request("u1")
+            assert (await eraser.request("u1"))["id"] == queued["id"]
+            job = await eraser.erase(await storage.erasures.claim(eraser.owner, 60))
+            assert job["status"] == COMPLETED and erased == ["u1"] and "u1" in forgotten
+            assert job["deleted"] == {
+                "user_preferences": 1, "cbt_sessions": 25, "zen_sessions": 1, "favorite_articles": 1, "usage_analytics": 1,
+            }
+            assert await storage.data_keys.get_many(["u1"]) == {}
+            assert await storage.cbt_sessions.find_by_user("u1") == []
+            assert await storage.db.fetch("SELECT COUNT(*) FROM cbt_sessions_terms WHERE user_id = 'u1'") == [(0,)]
+            # The other user is untouched and still readable
+            kept = await cipher.decrypt_many(await storage.cbt_sessions.find_by_user("u2"))
+            assert [doc["negative_thought"] for doc in kept] == ["I always fail 0", "I always fail 1"]
+            assert (await storage.erasures.get("u1"))["status"] == COMPLETED
+            # A later request starts a new job
+            assert (await eraser.request("u1"))["id"] != queued["id"]
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_slow_deletes_shrink_the_batch(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "erasure.db"))
+        sizes = []
+        remaining = [30]
+
+        async def slow_delete(user_id, limit):
+            sizes.append(limit)
+            await asyncio.sleep(0.02)
+            deleted = min(limit, remaining[0])
+            remaining[0] -= deleted
+            return deleted
+
+        eraser = AccountEraser(storage, [("slow", slow_delete)], min_batch=2, max_batch=16, target_latency=0.01, duty_cycle=1.0)
+        try:
+            await eraser.request("u1")
+            job = await storage.erasures.claim(eraser.owner, 60)
+            job["batch_size"] = 16
+            await eraser.erase(job)
+            assert sizes[:4] == [16, 8, 4, 2]
+            assert set(sizes[4:]) == {2}
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_resumes_at_the_recorded_step_after_a_crash(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "erasure.db"))
+        cipher = FieldCipher(os.urandom(32), storage.data_keys, FIELDS)
+        calls = []
+
+        def tracked(name, delete, fail=False):
+            async def step(user_id, limit):
+                calls.append(name)
+                if fail:
+                    raise RuntimeError("primary stepped down")
+                return await delete(user_id, limit)
+            return name, step
+
+        try:
+            await fill(storage, cipher, "u1", 3)
+            crashing = AccountEraser(storage, [
+                tracked("user_preferences", storage.preferences.delete_user_batch),
+                tracked("cbt_sessions", storage.cbt_sessions.delete_user_batch, fail=True),
+            ], duty_cycle=1.0)
+            await crashing.request("u1")
+            with pytest.raises(RuntimeError):
+                await crashing.erase(await storage.erasures.claim(crashing.owner, 60))
+            job = await storage.erasures.get("u1")
+            assert job["status"] == RUNNING and job["step"] == "cbt_sessions"
+            assert job["deleted"] == {"user_preferences": 1}
+            # The crashed worker's lease runs out
+            await storage.erasures.save({**job, "lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)})
+
+            calls.clear()
+            # Another worker takes over once the lease has expired
+            resumed = AccountEraser(storage, [
+                tracked("user_preferences", storage.preferences.delete_user_batch),
+                tracked("cbt_sessions", storage.cbt_sessions.delete_user_batch),
+            ], duty_cycle=1.0)
+            job = await resumed.erase(await storage.erasures.claim(resumed.owner, 60))
+            assert "user_preferences" not in calls
+            assert job["deleted"] == {"user_preferences": 1, "cbt_sessions": 3}
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_a_stalled_worker_stops_once_its_job_is_taken_over(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "erasure.db"))
+        stalled = asyncio.Event()
+        resume = asyncio.Event()
+        remaining = [10]
+
+        async def delete(user_id, limit):
+            if remaining[0] == 5 and not resume.is_set():
+                stalled.set()
+                await resume.wait()
+            deleted = min(limit, remaining[0])
+            remaining[0] -= deleted
+            return deleted
+
+        slow = AccountEraser(storage, [("sessions", delete)], min_batch=5, max_batch=5, duty_cycle=1.0)
+        fast = AccountEraser(storage, [("sessions", delete)], min_batch=5, max_batch=5, duty_cycle=1.0)
+        try:
+            await slow.request("u1")
+            slow_run = asyncio.create_task(slow.erase(await storage.erasures.claim(slow.owner, 60)))
+            await stalled.wait()
+            # The slow worker's lease expires while it is stuck in a batch and another one takes over
+            job = await storage.erasures.get("u1")
+            await storage.erasures.save({**job, "lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)})
+            taken = await storage.erasures.claim(fast.owner, 60)
+            assert taken["owner"] == fast.owner
+            resume.set()
+            with pytest.raises(LeaseLost):
+                await slow_run
+            # Its late checkpoint did not overwrite the new owner's lease
+            assert (await storage.erasures.get("u1"))["owner"] == fast.owner
+            job = await fast.erase(taken)
+            assert job["status"] == COMPLETED and remaining == [0]
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
@@ -0,0 +1,140 @@
+"""
+Server-Sent Events hub: live delivery, slow consumers, cross-worker events and Last-Event-ID replay.
+
+The replay tests run when STORAGE_TEST_MONGO_URL points at a MongoDB server; each uses
+a throwaway database that is dropped afterwards.
+
+Usage: python -m pytest tests/test_events.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from events import HEARTBEAT, EventHub  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+needs_mongo = pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+
+
+def parse(chunk: bytes):
+    """(id, event, data) of one SSE frame"""
+    fields = dict(line.split(": ", 1) for line in chunk.decode().strip().split("\n"))
+    return fields.get("id"), fields.get("event"), json.loads(fields["data"]) if "data" in fields else None
+
+
+async def take(stream, count):
+    return [await asyncio.wait_for(stream.__anext__(), 1) for _ in range(count)]
+
+
+@asynccontextmanager
+async def open_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    name = f"events_{uuid.uuid4().hex[:12]}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+def test_events_reach_only_the_users_connections():
+    async def main():
+        hub = EventHub(db=None, heartbeat_interval=0.5)
+        mine, theirs = hub.stream("u1"), hub.stream("u2")
+        assert (await take(mine, 1))[0] == b"retry: 500\n\n"
+        await take(theirs, 1)
+        assert hub.connection_count == 2
+        await hub.publish("u1", "favorites", {"op": "added", "article_id": "a1"})
+        _, event, data = parse((await take(mine, 1))[0])
+        assert event == "favorites" and data == {"op": "added", "article_id": "a1"}
+        # Heartbeats keep idle connections open
+        for queue in hub.subscribers["u2"]:
+            queue.put_nowait(HEARTBEAT)
+        assert await take(theirs, 1) == [b": ping\n\n"]
+        await mine.aclose()
+        await theirs.aclose()
+        assert hub.connection_count == 0
+    asyncio.run(main())
+
+
+def test_a_slow_consumer_is_disconnected_instead_of_buffering():
+    async def main():
+        hub = EventHub(db=None, queue_size=2)
+        stream = hub.stream("u1")
+        await take(stream, 1)
+        for i in range(3):
+            await hub.publish("u1", "favorites", {"i": i})
+        # Its queue overflowed: the stream ends and the client reconnects with Last-Event-ID
+        with pytest.raises(StopAsyncIteration):
+            await take(stream, 1)
+        assert hub.connection_count == 0
+    asyncio.run(main())
+
+
+def test_events_from_other_workers_arrive_over_the_change_stream():
+    async def main():
+        hub, other = EventHub(db=None), EventHub(db=None)
+        stream = hub.stream("u1")
+        await take(stream, 1)
+        event = {"_id": "e1", "user_id": "u1", "type": "zen_sessions", "data": {"op": "created"}}
+        # This worker's own events were already delivered when published
+        hub.handle_change({"operationType": "insert", "fullDocument": {**event, "origin": hub.origin}})
+        hub.handle_change({"operationType": "insert", "fullDocument": {**event, "origin": other.origin}})
+        assert parse((await take(stream, 1))[0])[:2] == ("e1", "zen_sessions")
+        assert all(queue.empty() for queue in hub.subscribers["u1"])
+        await stream.aclose()
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_reconnecting_replays_missed_events_once():
+    async def main():
+        async with open_db() as db:
+            hub = EventHub(db, queue_size=8)
+            first = hub.stream("u1")
+            await take(first, 1)
+            await hub.publish("u1", "cbt_sessions", {"op": "created", "n": 0})
+            seen_id = parse((await take(first, 1))[0])[0]
+            await first.aclose()
+
+            # Missed while disconnected, including another user's and an unpersisted hint
+            await hub.publish("u1", "cbt_sessions", {"op": "created", "n": 1})
+            await hub.publish("u2", "cbt_sessions", {"op": "created", "n": 9})
+            await hub.publish("u1", "summary", {"feature": "zen"}, persist=False)
+            await hub.publish("u1", "favorites", {"op": "added", "n": 2})
+
+            resumed = hub.stream("u1", seen_id)
+            replayed = [parse(chunk) for chunk in (await take(resumed, 3))[1:]]
+            assert [(event, data["n"]) for _, event, data in replayed] == [("cbt_sessions", 1), ("favorites", 2)]
+            await hub.publish("u1", "favorites", {"op": "removed", "n": 3})
+            assert parse((await take(resumed, 1))[0])[2]["n"] == 3
+            await resumed.aclose()
+            assert await db.user_events.count_documents({"type": "summary"}) == 0
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_a_client_too_far_behind_is_told_to_refetch():
+    async def main():
+        async with open_db() as db:
+            hub = EventHub(db, queue_size=2)
+            await hub.publish("u1", "favorites", {"n": 0})
+            oldest = str((await db.user_events.find_one())["_id"])
+            for n in range(1, 4):
+                await hub.publish("u1", "favorites", {"n": n})
+            for last_event_id in (oldest, "not-an-object-id"):
+                stream = hub.stream("u1", last_event_id)
+                assert parse((await take(stream, 2))[1])[1] == "reset"
+                await stream.aclose()
+    asyncio.run(main())
@@ -0,0 +1,223 @@
+"""
+Idempotency-Key handling: replay, payload mismatch, in-flight conflicts, crashed claims
+and sealing of stored responses that carry encrypted content.
+
+The stored-response tests run when STORAGE_TEST_MONGO_URL points at a MongoDB server;
+each uses a throwaway database that is dropped afterwards.
+
+Usage: python -m pytest tests/test_idempotency.py
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from encryption import FieldCipher  # noqa: E402
+from idempotency import IdempotencyMiddleware, IdempotencyStore  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+needs_mongo = pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+
+
+class Sessions:
+    """Endpoint that inserts one session per call"""
+
+    def __init__(self) -> None:
+        self.inserted = []
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        self.inserted.append(json.loads(message["body"]))
+        body = json.dumps({"id": len(self.inserted)}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+class Thoughts:
+    """Endpoint that echoes the created CBT session, as POST /api/cbt-sessions does"""
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        body = json.dumps({"id": "s1", "user_id": "u1", **json.loads(message["body"])}).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+class MemoryKeys:
+    def __init__(self):
+        self.keys = {}
+
+    async def get_many(self, user_ids):
+        return {user_id: self.keys[user_id] for user_id in user_ids if user_id in self.keys}
+
+    async def create(self, user_id, wrapped):
+        return self.keys.setdefault(user_id, wrapped)
+
+
+class MemoryStore(IdempotencyStore):
+    """The store with its collection replaced by a dict"""
+
+    def __init__(self):
+        super().__init__(db=None)
+        self.records = {}
+
+    async def get(self, key):
+        return self.records.get(key)
+
+    async def claim(self, key, fingerprint, user_id=None):
+        return self.records.setdefault(key, {"state": "pending", "fingerprint": fingerprint})["fingerprint"] == fingerprint
+
+    async def complete(self, key, fingerprint, status, content_type, body, sealed=False, user_id=None):
+        self.records[key] = {
+            "user_id": user_id, "state": "done", "fingerprint": fingerprint, "status": status,
+            "content_type": content_type, "body": body, "sealed": sealed,
+        }
+
+
+def fingerprint(body):
+    return hashlib.sha256(b"user_id=u1\0" + json.dumps(body).encode()).hexdigest()
+
+
+async def post(app, body, key, path="/api/zen-sessions"):
+    scope = {
+        "type": "http", "method": "POST", "path": path, "query_string": b"user_id=u1",
+        "headers": [(b"idempotency-key", key.encode())] if key else [],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    headers = dict(sent[0]["headers"])
+    return sent[0]["status"], json.loads(sent[1]["body"]), headers
+
+
+@asynccontextmanager
+async def open_store(**kwargs):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    name = f"idempotency_{uuid.uuid4().hex[:12]}"
+    try:
+        yield IdempotencyStore(client[name], **kwargs)
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+def test_requests_without_a_key_or_with_a_long_one_skip_the_store():
+    async def main():
+        sessions = Sessions()
+        app = IdempotencyMiddleware(sessions, store=None, paths=["/api/zen-sessions"])
+        assert (await post(app, {"duration": 4}, None))[0] == 200
+        assert (await post(app, {"duration": 4}, "k" * 256))[0] == 400
+        assert len(sessions.inserted) == 1
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_a_retry_replays_the_original_response():
+    async def main():
+        async with open_store() as store:
+            sessions = Sessions()
+            app = IdempotencyMiddleware(sessions, store, paths=["/api/zen-sessions"])
+            first = await post(app, {"duration": 4}, "k1")
+            retry = await post(app, {"duration": 4}, "k1")
+            assert first[1] == retry[1] == {"id": 1}
+            assert retry[2].get(b"idempotent-replayed") == b"true"
+            assert (await post(app, {"duration": 20}, "k1"))[0] == 422
+            assert len(sessions.inserted) == 1
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_a_claim_left_by_a_crashed_request_expires():
+    async def main():
+        async with open_store(pending_seconds=0.2) as store:
+            sessions = Sessions()
+            app = IdempotencyMiddleware(sessions, store, paths=["/api/zen-sessions"])
+            # The worker that claimed the key dies before completing or releasing it
+            assert await store.claim("/api/zen-sessions:u1:k1", fingerprint({"duration": 4}))
+            # While the claim is held the retry is told the request is still running
+            assert (await post(app, {"duration": 4}, "k1"))[0] == 409
+            await asyncio.sleep(0.3)
+            # A different payload never takes the key over
+            assert (await post(app, {"duration": 20}, "k1"))[0] == 422
+            status, body, _ = await post(app, {"duration": 4}, "k1")
+            assert status == 200 and body == {"id": 1}
+            assert (await post(app, {"duration": 4}, "k1"))[2].get(b"idempotent-replayed") == b"true"
+            assert len(sessions.inserted) == 1
+    asyncio.run(main())
+
+
+def test_responses_with_encrypted_content_are_stored_sealed():
+    async def main():
+        keys = MemoryKeys()
+        cipher = FieldCipher(os.urandom(32), keys, ("negative_thought",))
+        store = MemoryStore()
+        app = IdempotencyMiddleware(Thoughts(), store, paths=["/api/cbt-sessions"], sealed_paths=["/api/cbt-sessions"], cipher=cipher)
+        thought = {"negative_thought": "Nobody likes me"}
+        first = await post(app, thought, "k1", path="/api/cbt-sessions")
+        [record] = store.records.values()
+        assert record["sealed"] and b"Nobody" not in record["body"]
+        retry = await post(app, thought, "k1", path="/api/cbt-sessions")
+        assert retry[1] == first[1] and first[1]["negative_thought"] == "Nobody likes me"
+        # Once the user's data key is erased the stored response can't be replayed
+        keys.keys.clear()
+        cipher.forget("u1")
+        assert (await post(app, thought, "k1", path="/api/cbt-sessions"))[0] == 410
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_no_plaintext_thought_reaches_the_collection():
+    async def main():
+        async with open_store() as store:
+            cipher = FieldCipher(os.urandom(32), MemoryKeys(), ("negative_thought",))
+            app = IdempotencyMiddleware(Thoughts(), store, paths=["/api/cbt-sessions"], sealed_paths=["/api/cbt-sessions"], cipher=cipher)
+            await post(app, {"negative_thought": "Nobody likes me"}, "k1", path="/api/cbt-sessions")
+            store._memory.clear()
+            [record] = await store.collection.find().to_list(None)
+            assert record["sealed"] and b"Nobody" not in bytes(record["body"])
+            retry = await post(app, {"negative_thought": "Nobody likes me"}, "k1", path="/api/cbt-sessions")
+            assert retry[1]["negative_thought"] == "Nobody likes me"
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_erasure_removes_the_users_stored_responses():
+    async def main():
+        async with open_store() as store:
+            await store.ensure_indexes()
+            app = IdempotencyMiddleware(Sessions(), store, paths=["/api/zen-sessions"])
+            for key in ("k1", "k2", "k3"):
+                await post(app, {"duration": 4}, key)
+            await store.complete("/api/zen-sessions:u2:k1", "f", 200, "application/json", b"{}", user_id="u2")
+            assert await store.delete_user_batch("u1", 2) == 2
+            assert await store.delete_user_batch("u1", 2) == 1
+            assert await store.delete_user_batch("u1", 2) == 0
+            # Nothing of theirs is left in memory either, so a retry is processed again
+            assert not any(record["user_id"] == "u1" for _, record in store._memory.values())
+            assert await store.get("/api/zen-sessions:u2:k1") is not None
+    asyncio.run(main())
+
+
+def test_forgetting_a_user_drops_only_their_responses_from_memory():
+    store = IdempotencyStore(db=None)
+    store._remember("/api/zen-sessions:u1:k1", {"user_id": "u1", "state": "done"})
+    store._remember("/api/zen-sessions:u2:k1", {"user_id": "u2", "state": "done"})
+    store.forget_user("u1")
+    assert list(store._memory) == ["/api/zen-sessions:u2:k1"]
@@ -0,0 +1,96 @@
+"""
+Event-loop lag histogram, slow-callback stacks and the sampling profiler.
+
+Usage: python -m pytest tests/test_loop_monitor.py
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from admission import LoopLagProbe  # noqa: E402
+from profiler import SamplingProfiler  # noqa: E402
+
+
+def test_histogram_is_cumulative():
+    probe = LoopLagProbe()
+    for sample in (0.0005, 0.003, 0.003, 0.2, 7.0):
+        probe.observe(sample)
+    buckets = {b["le"]: b["count"] for b in probe.histogram()["buckets"]}
+    assert buckets[0.001] == 1
+    assert buckets[0.005] == 3
+    assert buckets[0.1] == 3
+    assert buckets[0.25] == 4
+    assert buckets[5.0] == 4
+    assert buckets["+Inf"] == 5
+    assert probe.histogram()["count"] == 5
+    assert probe.histogram()["sum"] == pytest.approx(7.2065)
+
+
+def blocking_handler():
+    time.sleep(0.3)
+
+
+def test_slow_callback_stack_names_the_blocking_function():
+    async def scenario():
+        probe = LoopLagProbe(interval=0.02, slow_threshold=0.05)
+        probe.start()
+        try:
+            await asyncio.sleep(0.05)
+            blocking_handler()
+            await asyncio.sleep(0.05)
+        finally:
+            await probe.stop()
+        return probe
+
+    probe = asyncio.run(scenario())
+    assert len(probe.slow_callbacks) == 1
+    slow = probe.slow_callbacks[-1]
+    assert slow["blocked_ms"] >= 250
+    assert "blocking_handler" in "".join(slow["stack"])
+    assert probe.histogram()["buckets"][-1]["count"] == probe.samples
+
+
+def busy_loop(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(i * i for i in range(1000))
+
+
+def test_profiler_collapses_stacks_of_one_thread():
+    worker = threading.Thread(target=busy_loop, args=(0.5,))
+    worker.start()
+    folded = SamplingProfiler().profile(0.3, interval=0.005, thread_id=worker.ident)
+    worker.join()
+    lines = folded.splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert all("busy_loop" in line for line in lines)
+    assert "test_loop_monitor.py:busy_loop" in stack.split(";")
+    # Only the requested thread: no thread name at the root
+    assert not stack.startswith("MainThread")
+
+
+def test_profiler_runs_one_profile_at_a_time():
+    profiler = SamplingProfiler()
+    first = threading.Thread(target=profiler.profile, args=(0.3,))
+    first.start()
+    time.sleep(0.05)
+    assert profiler.running
+    with pytest.raises(RuntimeError):
+        profiler.profile(0.1)
+    first.join()
+    assert not profiler.running
+    # Every other thread by default, each rooted at its name
+    worker = threading.Thread(target=busy_loop, args=(0.3,), name="busy-worker")
+    worker.start()
+    folded = profiler.profile(0.1)
+    worker.join()
+    assert any(line.startswith("busy-worker;") for line in folded.splitlines())
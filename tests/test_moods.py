@@ -0,0 +1,122 @@
+"""
+Mood trajectory analytics: rolling distributions, transitions, usage effects and cohort trends.
+
+Usage: python -m pytest tests/test_moods.py
+"""
+
+import asyncio
+import sqlite3
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from moods import MoodEvents, MoodTrends, cohort_trends, rolling_distribution, timeline, transitions, usage_effect  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+NOW = datetime(2026, 6, 10, 12, 0)
+DAY = 86400
+
+ANXIOUS, UNFOCUSED, SAD, STRESSED, CALM = range(5)
+
+
+def preference(user_id, mood, days_ago):
+    return {
+        "id": str(uuid.uuid4()), "user_id": user_id, "identity": "Student", "current_mood": mood,
+        "mood_frequency": "This week", "theme_colors": {}, "created_at": NOW - timedelta(days=days_ago),
+    }
+
+
+def test_rolling_distribution_counts_the_trailing_window():
+    times = np.array([0, DAY, 2 * DAY, 10 * DAY])
+    codes = np.array([ANXIOUS, ANXIOUS, CALM, CALM])
+    counts = rolling_distribution(times, codes, np.array([2 * DAY, 11 * DAY]), 3 * DAY)
+    assert counts[0].tolist() == [2, 0, 0, 0, 1]
+    assert counts[1].tolist() == [0, 0, 0, 0, 1]
+
+
+def test_transitions_stay_within_a_user():
+    users = np.array([0, 0, 0, 1, 1])
+    codes = np.array([ANXIOUS, CALM, CALM, SAD, CALM])
+    result = transitions(users, codes)
+    counts = np.array(result["counts"])
+    assert counts.sum() == 3
+    assert counts[ANXIOUS, CALM] == 1 and counts[CALM, CALM] == 1 and counts[SAD, CALM] == 1
+    assert result["probabilities"][ANXIOUS][CALM] == 1.0
+
+
+def test_usage_effect_splits_intervals_by_sessions_in_between():
+    users = np.array([0, 0, 0, 1, 1])
+    times = np.array([0, 10, 20, 0, 10])
+    codes = np.array([ANXIOUS, CALM, ANXIOUS, SAD, SAD])
+    # User 0 meditated between their first two reports only; user 1's session is after their last report
+    effect = usage_effect(users, times, codes, np.array([0, 1]), np.array([5, 15]))
+    assert effect["intervals"] == 3
+    assert effect["intervals_with_usage"] == 1
+    assert effect["mean_change_with_usage"] == 2.0
+    assert effect["mean_change_without_usage"] == -1.0
+
+
+def test_timeline_for_one_user():
+    preferences = [preference("u1", "Anxious", 9), preference("u1", "Stressed", 5), preference("u1", "Calm", 1)]
+    usage = {"zen": [NOW - timedelta(days=3), NOW - timedelta(days=2)], "cbt": []}
+    result = timeline(list(reversed(preferences)), usage, NOW, days=10, window_days=7)
+    assert [event["mood"] for event in result["events"]] == ["Anxious", "Stressed", "Calm"]
+    assert len(result["daily"]) == 10 and result["daily"][-1]["date"] == "2026-06-10"
+    assert result["daily"][0]["distribution"]["Anxious"] == 1.0
+    assert result["daily"][-1]["distribution"]["Calm"] == 0.5
+    assert result["usage"]["zen"]["intervals_with_usage"] == 1
+    assert result["usage"]["zen"]["mean_change_with_usage"] == 2.0
+    assert result["usage"]["cbt"]["intervals_with_usage"] == 0
+    empty = timeline([], {}, NOW, days=3)
+    assert empty["events"] == [] and empty["daily"][0]["distribution"] is None
+
+
+def test_cohort_trends_from_storage(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "moods.db"))
+        try:
+            for user_id, mood, days_ago in (("u1", "Anxious", 20), ("u1", "Calm", 2), ("u2", "Sad", 15), ("u2", "Bored", 3)):
+                await storage.preferences.insert(preference(user_id, mood, days_ago))
+            await storage.zen_sessions.insert({"id": "z1", "user_id": "u1", "session_type": "breathing", "duration": 5, "created_at": NOW - timedelta(days=10)})
+            trends = await MoodTrends(storage, batch_size=2).compute()
+            assert trends["users"] == 2 and trends["reports"] == 3
+            assert sum(week["reports"] for week in trends["weekly"]) == 3
+            assert all(datetime.fromisoformat(week["week_start"]).weekday() == 0 for week in trends["weekly"])
+            assert trends["usage"]["zen"]["intervals_with_usage"] == 1
+            assert trends["usage"]["cbt"]["intervals"] == 1
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_cohort_trends_scale_with_arrays():
+    rng = np.random.default_rng(0)
+    n = 200000
+    users = np.sort(rng.integers(0, 20000, n)).astype(np.int32)
+    times = np.sort(rng.integers(1_700_000_000, 1_730_000_000, n))
+    events = MoodEvents([str(i) for i in range(20000)], users, times, rng.integers(0, 5, n).astype(np.int8))
+    trends = cohort_trends(events, {"zen": (rng.integers(0, 20000, n).astype(np.int32), rng.integers(1_700_000_000, 1_730_000_000, n))})
+    assert sum(week["reports"] for week in trends["weekly"]) == n
+    assert np.array(trends["transitions"]["counts"]).sum() == n - len(np.unique(users))
+
+
+def test_sqlite_adds_preference_columns_to_an_existing_file(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE user_preferences (id TEXT, doc TEXT NOT NULL)")
+        conn.execute("INSERT INTO user_preferences (id, doc) VALUES ('old', ?)", ('{"id": "old"}',))
+
+    async def main():
+        storage = SQLiteStorage(path)
+        try:
+            await storage.preferences.insert(preference("u1", "Calm", 0))
+            assert len(await storage.preferences.list()) == 2
+            assert [pref["current_mood"] for pref in await storage.preferences.find_by_user("u1")] == ["Calm"]
+        finally:
+            await storage.close()
+    asyncio.run(main())
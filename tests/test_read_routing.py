@@ -0,0 +1,155 @@
+"""
+Read routing and read-your-writes for the MongoDB storage backend.
+
+The token bookkeeping runs anywhere. The replica-set tests need a local
+multi-member replica set (see README) and STORAGE_TEST_REPLSET_URL, e.g.
+mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+
+Usage: python -m pytest tests/test_read_routing.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from bson import Timestamp
+from pymongo import monitoring
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from storage import CausalTokens, MongoStorage, read_preference  # noqa: E402
+
+REPLSET_URL = os.environ.get("STORAGE_TEST_REPLSET_URL")
+needs_replset = pytest.mark.skipif(not REPLSET_URL, reason="STORAGE_TEST_REPLSET_URL not set")
+
+
+def test_read_preference_by_name():
+    assert read_preference("primary").mode == 0
+    pref = read_preference("secondaryPreferred", 120)
+    assert pref.mongos_mode == "secondaryPreferred"
+    assert pref.max_staleness == 120
+    assert read_preference("nearest").max_staleness == -1
+    with pytest.raises(KeyError):
+        read_preference("secondaries")
+
+
+def test_primary_reads_are_not_routed():
+    storage = MongoStorage(FakeDB(), read_pref=read_preference("primary"))
+    assert storage.causal is None
+    assert storage.analytics.reads is storage.analytics.collection
+
+
+def test_causal_tokens_keep_the_latest_write():
+    tokens = CausalTokens(client=None)
+    tokens.remember("u1", {"clusterTime": Timestamp(10, 1)}, Timestamp(10, 1))
+    tokens.observe("u1", Timestamp(9, 4))
+    assert tokens.lookup("u1") == ({"clusterTime": Timestamp(10, 1)}, Timestamp(10, 1))
+    tokens.observe("u1", Timestamp(11, 1))
+    assert tokens.lookup("u1") == (None, Timestamp(11, 1))
+    assert tokens.lookup("u2") is None
+
+
+def test_causal_tokens_expire_and_are_bounded():
+    tokens = CausalTokens(client=None, ttl=0.05, max_scopes=2)
+    tokens.observe("u1", Timestamp(1, 1))
+    tokens.observe("u2", Timestamp(1, 2))
+    tokens.observe("u3", Timestamp(1, 3))
+    assert tokens.lookup("u1") is None
+    assert tokens.lookup("u3") == (None, Timestamp(1, 3))
+    time.sleep(0.06)
+    assert tokens.lookup("u3") is None
+
+
+class FakeCollection:
+    def with_options(self, **kwargs):
+        return FakeCollection()
+
+
+class FakeDB:
+    client = None
+
+    def __getattr__(self, name):
+        return FakeCollection()
+
+
+class ReadTargets(monitoring.CommandListener):
+    """Server address of every find/aggregate"""
+
+    def __init__(self):
+        self.reads = []
+
+    def started(self, event):
+        if event.command_name in ("find", "aggregate"):
+            self.reads.append(event.connection_id)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def run_on_replset(scenario, **storage_options):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def main():
+        targets = ReadTargets()
+        client = AsyncIOMotorClient(REPLSET_URL, event_listeners=[targets])
+        name = f"routing_{uuid.uuid4().hex[:12]}"
+        try:
+            storage = MongoStorage(client[name], **storage_options)
+            await scenario(client, storage, targets)
+        finally:
+            await client.drop_database(name)
+            client.close()
+    asyncio.run(main())
+
+
+@needs_replset
+def test_list_reads_go_to_secondaries():
+    async def scenario(client, storage, targets):
+        await storage.analytics.feature_stats("u1")
+        await storage.favorites.list("u1")
+        primary = client.primary
+        assert targets.reads and all(address != primary for address in targets.reads)
+    run_on_replset(scenario, read_pref=read_preference("secondary"))
+
+
+@needs_replset
+def test_read_your_writes_on_secondaries():
+    async def scenario(client, storage, targets):
+        for i in range(50):
+            user_id = f"user-{i}"
+            await storage.cbt_sessions.insert({
+                "id": str(uuid.uuid4()), "user_id": user_id, "negative_thought": "...",
+                "questions_and_answers": [], "created_at": datetime.now(timezone.utc),
+            })
+            assert len(await storage.cbt_sessions.find_by_user(user_id)) == 1
+            await storage.analytics.insert({
+                "id": str(uuid.uuid4()), "user_id": user_id, "feature": "zen", "action": "view",
+                "duration": 5, "created_at": datetime.now(timezone.utc),
+            })
+            assert await storage.analytics.feature_stats(user_id) == [{"_id": "zen", "total_sessions": 1, "total_duration": 5}]
+        primary = client.primary
+        assert all(address != primary for address in targets.reads)
+    run_on_replset(scenario, read_pref=read_preference("secondary"))
+
+
+@needs_replset
+def test_writes_from_another_worker_are_observed():
+    async def scenario(client, storage, targets):
+        # A second storage stands in for another worker; its writes reach this
+        # worker's tokens the way the change stream would deliver them
+        other = MongoStorage(storage.db, read_pref=read_preference("secondary"))
+        for i in range(20):
+            user_id = f"user-{i}"
+            await other.favorites.insert({"id": str(uuid.uuid4()), "user_id": user_id, "article_id": "a1"})
+            _, operation_time = other.causal.lookup(user_id)
+            storage.causal.observe(user_id, operation_time)
+            assert [fav["article_id"] for fav in await storage.favorites.list(user_id)] == ["a1"]
+    run_on_replset(scenario, read_pref=read_preference("secondary"))
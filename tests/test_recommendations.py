@@ -0,0 +1,159 @@
+"""
+Ranking and table rebuilds for article recommendations, on SQLite storage.
+
+Usage: python -m pytest tests/test_recommendations.py
+"""
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from recommendations import RecommendationTable, rank  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+ARTICLES = [
+    {"id": "growth", "title": "Building Emotional Resilience", "content": "...", "category": "Personal Growth"},
+    {"id": "anxiety", "title": "Understanding Anxiety", "content": "Slow breathing helps.", "category": "Mental Health"},
+    {"id": "detox", "title": "Digital Detox", "content": "Screen time and focus.", "category": "Digital Wellbeing"},
+]
+
+
+def ids(articles):
+    return [article["id"] for article in articles]
+
+
+def test_mood_affinity_orders_the_catalog():
+    assert ids(rank(ARTICLES, {}, "Anxious", None))[0] == "anxiety"
+    assert ids(rank(ARTICLES, {}, "Unfocused", "Student"))[0] == "detox"
+    assert ids(rank(ARTICLES, {}, "Sad", None))[0] == "growth"
+
+
+def test_without_a_mood_popularity_decides_and_ties_keep_catalog_order():
+    assert ids(rank(ARTICLES, {}, None, None)) == ["growth", "anxiety", "detox"]
+    assert ids(rank(ARTICLES, {"detox": 3}, None, None))[0] == "detox"
+
+
+def test_table_serves_every_pair_and_falls_back(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "recommendations.db"))
+        try:
+            await storage.articles.insert_many(ARTICLES)
+            table = RecommendationTable(storage)
+            await table.ensure_built()
+            assert ids(json.loads(table.get("Anxious", "Student")))[0] == "anxiety"
+            assert table.get("Bored", "Astronaut") == table.get(None, None)
+
+            await storage.favorites.insert({"id": "f1", "user_id": "u1", "article_id": "detox"})
+            await table.rebuild()
+            assert ids(json.loads(table.get(None, None)))[0] == "detox"
+            assert table.builds == 2
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_an_empty_catalog_is_seeded_before_ranking(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "recommendations.db"))
+        try:
+            async def seed():
+                await storage.articles.insert_many(ARTICLES)
+
+            table = RecommendationTable(storage, seed=seed)
+            await table.ensure_built()
+            assert ids(json.loads(table.get("Sad", None)))[0] == "growth"
+            assert len(await storage.articles.list()) == 3
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_a_burst_of_changes_is_throttled_into_few_rebuilds(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "recommendations.db"))
+        try:
+            await storage.articles.insert_many(ARTICLES)
+            table = RecommendationTable(storage, min_interval=0.2)
+            rebuild = table.rebuild
+            started = []
+
+            async def timed_rebuild(*args):
+                started.append(time.monotonic())
+                await rebuild(*args)
+
+            table.rebuild = timed_rebuild
+            table.start()
+            # An article edit every 10ms for half a second
+            for _ in range(50):
+                table.mark_stale()
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.3)
+            await table.stop()
+            # The first rebuild is immediate; the burst folds into one per interval
+            assert 2 <= len(started) <= 5
+            assert all(later - earlier >= 0.19 for earlier, later in zip(started, started[1:]))
+            assert ids(json.loads(table.get(None, None))) == ids(ARTICLES)
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_favorite_churn_rebuilds_less_often_and_reuses_the_catalog(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "recommendations.db"))
+        try:
+            await storage.articles.insert_many(ARTICLES)
+            reads = {"articles": 0, "favorites": 0}
+            list_articles, count_favorites = storage.articles.list, storage.favorites.counts_by_article
+
+            async def counted_list(*args, **kwargs):
+                reads["articles"] += 1
+                return await list_articles(*args, **kwargs)
+
+            async def counted_counts():
+                reads["favorites"] += 1
+                return await count_favorites()
+
+            storage.articles.list, storage.favorites.counts_by_article = counted_list, counted_counts
+            table = RecommendationTable(storage, min_interval=0.05, favorites_interval=0.6)
+            table.start()
+            await asyncio.sleep(0.1)
+            assert table.builds == 1 and reads == {"articles": 1, "favorites": 1}
+
+            # Favorites every 10ms for 0.3s: nothing until the favorites floor has passed
+            await storage.favorites.insert({"id": "f1", "user_id": "u1", "article_id": "detox"})
+            for _ in range(30):
+                table.mark_favorites_stale()
+                await asyncio.sleep(0.01)
+            assert table.builds == 1
+            await asyncio.sleep(0.35)
+            assert table.builds == 2 and reads == {"articles": 1, "favorites": 2}
+            assert ids(json.loads(table.get(None, None)))[0] == "detox"
+
+            # An article change is not held back by the favorites floor, and reuses the counts
+            await storage.articles.insert_many([{"id": "new", "title": "New", "content": "", "category": "Wellness"}])
+            table.mark_stale()
+            await asyncio.sleep(0.15)
+            await table.stop()
+            assert table.builds == 3 and reads == {"articles": 2, "favorites": 2}
+            assert "new" in ids(json.loads(table.get(None, None)))
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_concurrent_cold_starts_share_one_build(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "recommendations.db"))
+        try:
+            await storage.articles.insert_many(ARTICLES)
+            table = RecommendationTable(storage)
+            await asyncio.gather(*(table.ensure_built() for _ in range(10)))
+            assert table.builds == 1
+        finally:
+            await storage.close()
+    asyncio.run(main())
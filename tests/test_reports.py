@@ -0,0 +1,121 @@
+"""
+Daily usage reports: incremental $merge from report_state, and CSV/Parquet export.
+
+The materialization tests run when STORAGE_TEST_MONGO_URL points at a MongoDB server;
+each uses a throwaway database that is dropped afterwards.
+
+Usage: python -m pytest tests/test_reports.py
+"""
+
+import asyncio
+import importlib.util
+import io
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from reports import REPORT_COLUMNS, STATE_COLLECTION, STATE_ID, DailyUsageReports, day_start, export_frame  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+needs_mongo = pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+
+TODAY = day_start(datetime.now(timezone.utc))
+
+
+def analytics(days_ago, user_id="u1", feature="zen", duration=60):
+    return {"id": str(uuid.uuid4()), "user_id": user_id, "feature": feature, "action": "complete",
+            "duration": duration, "created_at": TODAY - timedelta(days=days_ago) + timedelta(hours=12)}
+
+
+@asynccontextmanager
+async def open_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    name = f"reports_{uuid.uuid4().hex[:12]}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+def test_reports_export_as_csv_and_parquet():
+    rows = pd.DataFrame(
+        [{"day": "2026-05-04", "source": "usage_analytics", "feature": "zen", "events": 3, "active_users": 2,
+          "total_duration": 180, "avg_duration": 60.0, "completed": None}],
+        columns=REPORT_COLUMNS,
+    )
+    body, media_type = export_frame(rows, "csv")
+    assert media_type == "text/csv"
+    assert body.decode().splitlines() == [",".join(REPORT_COLUMNS), "2026-05-04,usage_analytics,zen,3,2,180,60.0,"]
+    if importlib.util.find_spec("pyarrow") is None and importlib.util.find_spec("fastparquet") is None:
+        with pytest.raises(ImportError):
+            export_frame(rows, "parquet")
+        return
+    body, media_type = export_frame(rows, "parquet")
+    assert media_type == "application/vnd.apache.parquet"
+    assert pd.read_parquet(io.BytesIO(body)).events.tolist() == [3]
+
+
+@needs_mongo
+def test_materialize_resumes_from_report_state_without_redoing_days():
+    async def main():
+        async with open_db() as db:
+            reports = DailyUsageReports(db, chunk_days=2)
+            await db.usage_analytics.insert_many([
+                analytics(3), analytics(3, user_id="u2"), analytics(2), analytics(1, feature="cbt"), analytics(0),
+            ])
+            await db.zen_sessions.insert_one(
+                {"id": "z1", "user_id": "u1", "session_type": "breathing", "duration": 5, "completed": True,
+                 "created_at": TODAY - timedelta(days=1)}
+            )
+            # Today is incomplete and waits for tomorrow's run
+            assert await reports.materialize() == 3
+            state = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+            assert state["materialized_until"] == TODAY
+
+            rows = await reports.load()
+            first_day = (TODAY - timedelta(days=3)).date().isoformat()
+            zen = rows[(rows.day == first_day) & (rows.feature == "zen")]
+            assert zen.events.item() == 2 and zen.active_users.item() == 2 and zen.avg_duration.item() == 60
+            assert rows[rows.source == "zen_sessions"].completed.tolist() == [1]
+
+            # A late event on a materialized day is not picked up: nothing is pending
+            await db.usage_analytics.insert_one(analytics(2))
+            assert await reports.materialize() == 0
+            assert (await reports.load()).events.sum() == 5
+
+            # Rewinding the state redoes that day, replacing its rows rather than adding to them
+            await db[STATE_COLLECTION].update_one(
+                {"_id": STATE_ID}, {"$set": {"materialized_until": TODAY - timedelta(days=2)}}
+            )
+            assert await reports.materialize() == 2
+            rows = await reports.load()
+            assert len(rows) == 4 and rows.events.sum() == 6
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_a_run_stops_when_its_lease_is_lost():
+    async def main():
+        async with open_db() as db:
+            reports = DailyUsageReports(db, chunk_days=1)
+            await db.usage_analytics.insert_many([analytics(days_ago) for days_ago in (3, 2, 1)])
+            answers = iter([True, False])
+
+            async def keep_lease():
+                return next(answers)
+
+            assert await reports.materialize(keep_lease) == 1
+            state = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+            assert state["materialized_until"] == TODAY - timedelta(days=2)
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Job leases: one holder at a time, takeover after expiry and fencing of a run that outlasts its lease.
+
+The tests run when STORAGE_TEST_MONGO_URL points at a MongoDB server; each uses a
+throwaway database that is dropped afterwards.
+
+Usage: python -m pytest tests/test_scheduler.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from scheduler import JobScheduler  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+needs_mongo = pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")
+
+
+@asynccontextmanager
+async def open_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_URL)
+    name = f"scheduler_{uuid.uuid4().hex[:12]}"
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+@needs_mongo
+def test_one_worker_holds_a_lease_until_it_expires():
+    async def main():
+        async with open_db() as db:
+            first, second = JobScheduler(db), JobScheduler(db)
+            assert await first.acquire_lease("reports", 0.3)
+            assert not await second.acquire_lease("reports", 0.3)
+            # The holder may take it again, which extends it
+            assert await first.acquire_lease("reports", 0.3)
+            await asyncio.sleep(0.4)
+            assert await second.acquire_lease("reports", 60)
+            assert not await first.acquire_lease("reports", 60)
+            # Leases are per job
+            assert await first.acquire_lease("mood_trends", 60)
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_renewal_keeps_a_long_run_exclusive_and_fails_once_taken_over():
+    async def main():
+        async with open_db() as db:
+            first, second = JobScheduler(db), JobScheduler(db)
+            assert await first.acquire_lease("reports", 0.3)
+            for _ in range(3):
+                await asyncio.sleep(0.2)
+                assert await first.renew_lease("reports", 0.3)
+                assert not await second.acquire_lease("reports", 0.3)
+            await asyncio.sleep(0.4)
+            assert await second.acquire_lease("reports", 60)
+            assert not await first.renew_lease("reports", 60)
+    asyncio.run(main())
+
+
+@needs_mongo
+def test_fenced_jobs_are_given_their_lease_to_keep():
+    async def main():
+        async with open_db() as db:
+            scheduler, other = JobScheduler(db), JobScheduler(db)
+            kept = asyncio.get_running_loop().create_future()
+
+            async def job(keep_lease):
+                renewed = await keep_lease()
+                # Another worker takes the lease over while this run is still going
+                await db.job_leases.update_one({"_id": "reports"}, {"$set": {"owner": other.owner}})
+                kept.set_result((renewed, await keep_lease()))
+
+            scheduler.every("reports", 60, job, fenced=True)
+            scheduler.start()
+            try:
+                assert await asyncio.wait_for(kept, 5) == (True, False)
+            finally:
+                await scheduler.stop()
+    asyncio.run(main())
@@ -0,0 +1,189 @@
+"""
+Journal search: tokenizing, ranking, snippets and paging over blinded terms, on SQLite storage.
+
+Usage: python -m pytest tests/test_search.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from encryption import ENCRYPTED_FIELD, FieldCipher  # noqa: E402
+from search import BACKFILL_STATE, JournalSearch, SearchBackfill, highlight, index_terms, tokenize  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+FIELDS = ("negative_thought", "questions_and_answers")
+
+
+def session(thought, answer="I am not sure", user_id="u1", days_ago=0):
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "negative_thought": thought,
+        "questions_and_answers": [{"question": "What is the evidence?", "answer": answer}],
+        "created_at": datetime(2026, 6, 1) - timedelta(days=days_ago),
+    }
+
+
+def test_tokenize_drops_stopwords_and_strips_suffixes():
+    assert tokenize("I studied for the Exams, worrying!") == ["study", "exam", "worry"]
+    assert tokenize("stress is less") == ["stress", "less"]
+
+
+def test_questions_are_not_indexed():
+    assert index_terms(session("Exam panic", answer="slept badly")) == {"exam", "panic", "slept", "badly"}
+
+
+def test_highlight_marks_matches_and_escapes():
+    text = "Before the <big> exam I froze"
+    assert highlight(text, {"exam"}) == "Before the &lt;big&gt; <mark>exam</mark> I froze"
+    assert highlight("Nothing relevant here", {"exam"}) is None
+    long = "word " * 50 + "exam " + "tail " * 50
+    snippet = highlight(long, {"exam"})
+    assert snippet.startswith("…") and snippet.endswith("…") and "<mark>exam</mark>" in snippet
+
+
+@pytest.fixture(params=["plaintext", "encrypted"])
+def open_search(request, tmp_path):
+    async def factory():
+        storage = SQLiteStorage(str(tmp_path / "search.db"))
+        master = os.urandom(32) if request.param == "encrypted" else None
+        cipher = FieldCipher(master, storage.data_keys, FIELDS)
+        return storage, cipher, JournalSearch(storage, cipher)
+    return factory
+
+
+async def add(storage, cipher, search, doc):
+    await storage.cbt_sessions.insert(await cipher.encrypt(await search.index(doc)))
+
+
+def test_search_ranks_pages_and_filters(open_search):
+    async def main():
+        storage, cipher, search = await open_search()
+        try:
+            best = session("My exam tomorrow, I will fail the exam", answer="I studied for the exam", days_ago=1)
+            good = session("Worried about the exam", days_ago=5)
+            weak = session("Work was busy", answer="The exam came up in passing", days_ago=10)
+            for doc in (best, good, weak, session("Nobody called me back"), session("exam", user_id="u2")):
+                await add(storage, cipher, search, doc)
+
+            result = await search.search("u1", "exams")
+            assert [hit["session"]["id"] for hit in result["results"]] == [best["id"], good["id"], weak["id"]]
+            assert result["results"][0]["session"]["negative_thought"] == best["negative_thought"]
+            assert result["results"][0]["snippets"][0] == {
+                "field": "negative_thought", "text": "My <mark>exam</mark> tomorrow, I will fail the <mark>exam</mark>",
+            }
+            assert result["next_cursor"] is None
+
+            pages, cursor = [], None
+            while True:
+                page = await search.search("u1", "exam", cursor=cursor, limit=1)
+                pages += [hit["session"]["id"] for hit in page["results"]]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            assert pages == [best["id"], good["id"], weak["id"]]
+
+            ranged = await search.search("u1", "exam", since=datetime(2026, 6, 1) - timedelta(days=7))
+            assert [hit["session"]["id"] for hit in ranged["results"]] == [best["id"], good["id"]]
+            assert (await search.search("u1", "the and of"))["results"] == []
+            with pytest.raises(ValueError):
+                await search.search("u1", "exam", cursor="not-a-cursor")
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_encrypted_index_holds_no_words(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "blind.db"))
+        try:
+            cipher = FieldCipher(os.urandom(32), storage.data_keys, FIELDS)
+            search = JournalSearch(storage, cipher)
+            await add(storage, cipher, search, session("Panic before the exam"))
+            terms = [row[0] for row in await storage.db.fetch("SELECT term FROM cbt_sessions_terms")]
+            assert len(terms) == 4 and not {"panic", "exam"} & set(terms)
+            assert ENCRYPTED_FIELD in (await storage.cbt_sessions.find_by_user("u1"))[0]
+
+            # Another user's key blinds the same word differently
+            assert await cipher.blind("u1", ["exam"]) != await cipher.blind("u2", ["exam"], create=True)
+
+            # Once the data key is erased nothing of the user's can be found
+            await storage.data_keys.delete("u1")
+            cipher.forget("u1")
+            assert (await search.search("u1", "exam"))["results"] == []
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_truncated_when_more_sessions_match_than_are_ranked(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "truncated.db"))
+        try:
+            cipher = FieldCipher(None, storage.data_keys, FIELDS)
+            search = JournalSearch(storage, cipher, max_candidates=2)
+            for days_ago in range(3):
+                await add(storage, cipher, search, session("exam stress", days_ago=days_ago))
+            result = await search.search("u1", "exam")
+            assert len(result["results"]) == 2 and result["truncated"] is True
+            ranged = await search.search("u1", "exam", since=datetime(2026, 6, 1) - timedelta(days=1))
+            assert len(ranged["results"]) == 2 and ranged["truncated"] is False
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_backfill_indexes_old_sessions_and_resumes(open_search):
+    async def main():
+        storage, cipher, search = await open_search()
+        try:
+            # Written before search existed: sealed (when encryption is on) but without terms
+            old = [session(f"exam worry {i}", days_ago=10 - i) for i in range(5)]
+            for doc in old:
+                await storage.cbt_sessions.insert(await cipher.encrypt(doc))
+            await add(storage, cipher, search, session("exam tomorrow"))
+            assert len((await search.search("u1", "exam"))["results"]) == 1
+
+            # A budget of zero stops after one batch, as an interrupted run would
+            interrupted = SearchBackfill(storage, search, batch_size=2, duty_cycle=1.0, budget_seconds=0)
+            assert await interrupted.run_once() is False
+            state = await storage.job_state.get(BACKFILL_STATE)
+            assert state["sessions"] == 2 and state["completed_at"] is None
+            assert len((await search.search("u1", "exam"))["results"]) == 3
+
+            backfill = SearchBackfill(storage, search, batch_size=2, duty_cycle=1.0)
+            assert await backfill.run_once() is True
+            state = await storage.job_state.get(BACKFILL_STATE)
+            # Every session older than the first run, the boundary one counted twice on resume
+            assert state["sessions"] == 7 and state["completed_at"] is not None
+            assert len((await search.search("u1", "exam"))["results"]) == 6
+            assert await backfill.run_once() is True
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
+
+def test_backfill_skips_sessions_of_erased_users(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "erased.db"))
+        try:
+            cipher = FieldCipher(os.urandom(32), storage.data_keys, FIELDS)
+            search = JournalSearch(storage, cipher)
+            await storage.cbt_sessions.insert(await cipher.encrypt(session("exam panic")))
+            await storage.data_keys.delete("u1")
+            cipher.forget("u1")
+            assert await SearchBackfill(storage, search).run_once() is True
+            # No new data key was made for the erased user
+            assert await storage.data_keys.get_many(["u1"]) == {}
+        finally:
+            await storage.close()
+    asyncio.run(main())
+
@@ -0,0 +1,85 @@
+"""
+POST handlers on the embedded SQLite backend: what new_document builds is what is returned and stored.
+
+Usage: python -m pytest tests/test_server.py
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# The server reads its configuration at import time
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", str(Path(tempfile.mkdtemp()) / "server.db"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from recommendations import rank  # noqa: E402
+
+pytestmark = pytest.mark.skipif(server.use_mongo, reason="needs STORAGE_BACKEND=sqlite")
+
+
+def same_document(stored, returned):
+    """Equal apart from storage keeping created_at as naive UTC at millisecond precision"""
+    created = [datetime.fromisoformat(doc["created_at"].rstrip("Z")) for doc in (stored, returned)]
+    return (
+        {k: v for k, v in stored.items() if k != "created_at"} == {k: v for k, v in returned.items() if k != "created_at"}
+        and abs((created[0] - created[1]).total_seconds()) < 0.001
+    )
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(server.app) as client:
+        yield client
+
+
+def test_new_document_adds_only_server_fields():
+    doc = server.new_document(user_id="u1", session_type="breathing", duration=5)
+    assert set(doc) == {"id", "user_id", "session_type", "duration", "created_at"}
+    assert isinstance(doc["created_at"], datetime) and doc["created_at"].tzinfo is not None
+    # The timestamp is always the server's
+    assert server.new_document(created_at="yesterday")["created_at"] != "yesterday"
+
+
+def test_created_zen_session_is_returned_and_stored_as_built(client):
+    response = client.post("/api/zen-sessions", json={"session_type": "breathing", "duration": 5})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user_id"] == "anonymous" and body["completed"] is True and body["duration"] == 5
+    [listed] = [s for s in client.get("/api/zen-sessions").json() if s["id"] == body["id"]]
+    assert same_document(listed, body)
+
+
+def test_created_cbt_session_and_analytics_keep_optional_fields(client):
+    session = {"negative_thought": "I always fail", "questions_and_answers": [{"question": "Really?", "answer": "No"}]}
+    body = client.post("/api/cbt-sessions", json=session).json()
+    assert {k: body[k] for k in session} == session and body["id"]
+    [listed] = [s for s in client.get("/api/cbt-sessions").json() if s["id"] == body["id"]]
+    assert same_document(listed, body)
+
+    analytics = client.post("/api/analytics?user_id=u1", json={"feature": "zen", "action": "complete"}).json()
+    assert analytics["user_id"] == "u1" and analytics["duration"] is None and analytics["metadata"] is None
+
+
+def test_invalid_bodies_are_rejected_before_anything_is_stored(client):
+    before = len(client.get("/api/zen-sessions").json())
+    response = client.post("/api/zen-sessions", json={"session_type": "breathing", "duration": "long"})
+    assert response.status_code == 422
+    assert len(client.get("/api/zen-sessions").json()) == before
+
+
+def test_recommendations_seed_the_catalog_and_document_their_schema(client):
+    ranked = client.get("/api/articles/recommended", params={"mood": "Anxious"}).json()
+    listed = client.get("/api/articles").json()
+    assert ranked and sorted(a["id"] for a in ranked) == sorted(a["id"] for a in listed)
+    assert [a["id"] for a in ranked] == [a["id"] for a in rank(listed, {}, "Anxious", None)]
+    schema = client.get("/openapi.json").json()["paths"]["/api/articles/recommended"]["get"]["responses"]["200"]
+    assert schema["content"]["application/json"]["schema"]["items"]["$ref"].endswith("/Article")
@@ -0,0 +1,405 @@
+"""
+Conformance suite every storage backend must pass.
+
+SQLite always runs. The MongoDB backend runs when STORAGE_TEST_MONGO_URL points at a
+server; each test uses a throwaway database that is dropped afterwards.
+
+Usage: python -m pytest tests/test_storage_conformance.py
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from storage import MongoStorage, SQLiteStorage  # noqa: E402
+
+MONGO_URL = os.environ.get("STORAGE_TEST_MONGO_URL")
+
+BACKENDS = [
+    "sqlite",
+    pytest.param("mongo", marks=pytest.mark.skipif(not MONGO_URL, reason="STORAGE_TEST_MONGO_URL not set")),
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+
+@asynccontextmanager
+async def open_storage(backend, tmp_path):
+    if backend == "sqlite":
+        storage = SQLiteStorage(str(tmp_path / "conformance.db"), readers=2)
+        try:
+            yield storage
+        finally:
+            await storage.close()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(MONGO_URL)
+        name = f"conformance_{uuid.uuid4().hex[:12]}"
+        try:
+            storage = MongoStorage(client[name])
+            await storage.ensure_indexes()
+            yield storage
+        finally:
+            await client.drop_database(name)
+            client.close()
+
+
+def run(backend, tmp_path, scenario):
+    async def main():
+        async with open_storage(backend, tmp_path) as storage:
+            await scenario(storage)
+    asyncio.run(main())
+
+
+def at(days_ago: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days_ago)
+
+
+def session(user_id="u1", created_at=None, **fields):
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "negative_thought": "I always get this wrong",
+        "questions_and_answers": [{"question": "Is that true?", "answer": "Not always"}],
+        "created_at": created_at or at(0),
+        **fields,
+    }
+
+
+def by_id(docs):
+    return sorted(docs, key=lambda doc: doc["id"])
+
+
+def test_preferences_roundtrip(backend, tmp_path):
+    async def scenario(storage):
+        prefs = {
+            "id": "p1",
+            "identity": "Student",
+            "current_mood": "Calm",
+            "mood_frequency": "Just today",
+            "theme_colors": {"primary": "#06B6D4"},
+            "created_at": at(0),
+        }
+        await storage.preferences.insert(prefs)
+        assert "_id" not in prefs
+        stored = await storage.preferences.list()
+        assert len(stored) == 1
+        assert stored[0]["theme_colors"] == {"primary": "#06B6D4"}
+        assert set(stored[0]) == set(prefs)
+    run(backend, tmp_path, scenario)
+
+
+def test_session_scan_range_is_half_open_and_oldest_first(backend, tmp_path):
+    async def scenario(storage):
+        start = datetime(2026, 3, 1)
+        for hours in (30, 0, 5, 24, 10, -1):
+            await storage.cbt_sessions.insert(session(created_at=start + timedelta(hours=hours), hours=hours))
+        batches = [batch async for batch in storage.cbt_sessions.scan_range(start, start + timedelta(days=1), batch_size=2)]
+        assert [len(batch) for batch in batches] == [2, 1]
+        assert [doc["hours"] for batch in batches for doc in batch] == [0, 5, 10]
+        assert all("_id" not in doc for batch in batches for doc in batch)
+    run(backend, tmp_path, scenario)
+
+
+def test_preferences_by_user_latest_and_scan(backend, tmp_path):
+    async def scenario(storage):
+        assert await storage.preferences.latest() is None
+        for user_id, mood, days_ago in (("u1", "Calm", 1), ("u1", "Anxious", 3), ("u2", "Sad", 2)):
+            await storage.preferences.insert({
+                "id": str(uuid.uuid4()), "user_id": user_id, "identity": "Student", "current_mood": mood,
+                "mood_frequency": "This week", "theme_colors": {}, "created_at": at(days_ago),
+            })
+        assert [pref["current_mood"] for pref in await storage.preferences.find_by_user("u1")] == ["Anxious", "Calm"]
+        newest = (await storage.preferences.find_by_user("u1"))[-1]["created_at"]
+        assert await storage.preferences.latest() == newest
+
+        batches = [batch async for batch in storage.preferences.scan_moods(batch_size=2)]
+        assert [len(batch) for batch in batches] == [2, 1]
+        rows = sorted(row for batch in batches for row in batch)
+        assert [(user_id, mood) for user_id, _, mood in rows] == [("u1", "Anxious"), ("u1", "Calm"), ("u2", "Sad")]
+        assert all(isinstance(created, datetime) and created.tzinfo is None for _, created, _ in rows)
+
+        await storage.zen_sessions.insert(session(created_at=at(1)))
+        activity = [row async for batch in storage.zen_sessions.scan_activity() for row in batch]
+        assert [user_id for user_id, _ in activity] == ["u1"]
+    run(backend, tmp_path, scenario)
+
+
+def test_datetimes_come_back_naive_utc_in_milliseconds(backend, tmp_path):
+    async def scenario(storage):
+        created = datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        doc = session(created_at=created)
+        await storage.cbt_sessions.insert(doc)
+        stored = await storage.cbt_sessions.get(doc["id"])
+        assert stored["created_at"] == datetime(2026, 3, 1, 12, 30, 15, 123000)
+        assert stored["created_at"].tzinfo is None
+    run(backend, tmp_path, scenario)
+
+
+def test_sessions_by_user_and_range(backend, tmp_path):
+    async def scenario(storage):
+        old, mid, new = session(created_at=at(30)), session(created_at=at(10)), session(created_at=at(1))
+        other = session(user_id="u2")
+        for doc in (old, mid, new, other):
+            await storage.cbt_sessions.insert(doc)
+
+        assert by_id(await storage.cbt_sessions.find_by_user("u1")) == by_id(
+            [await storage.cbt_sessions.get(doc["id"]) for doc in (old, mid, new)]
+        )
+        ranged = await storage.cbt_sessions.find_by_user("u1", since=at(20), until=at(5))
+        assert [doc["id"] for doc in ranged] == [mid["id"]]
+        assert {doc["id"] for doc in await storage.cbt_sessions.find_by_user("u1", since=at(20))} == {mid["id"], new["id"]}
+        assert {doc["id"] for doc in await storage.cbt_sessions.find_by_user("u1", until=at(20))} == {old["id"]}
+        assert await storage.cbt_sessions.find_by_user("nobody") == []
+        assert len(await storage.cbt_sessions.find_by_user("u1", limit=2)) == 2
+        # Kinds are separate collections
+        assert await storage.zen_sessions.find_by_user("u1") == []
+        assert storage.sessions("cbt") is storage.cbt_sessions
+    run(backend, tmp_path, scenario)
+
+
+def test_session_timestamps_by_user(backend, tmp_path):
+    async def scenario(storage):
+        old, mid, new = session(created_at=at(30)), session(created_at=at(10)), session(created_at=at(1))
+        for doc in (new, old, session(user_id="u2", created_at=at(5)), mid):
+            await storage.zen_sessions.insert(doc)
+        stored = [(await storage.zen_sessions.get(doc["id"]))["created_at"] for doc in (old, mid, new)]
+        # Oldest first, naive UTC like the documents
+        assert await storage.zen_sessions.created_at_by_user("u1") == stored
+        assert await storage.zen_sessions.created_at_by_user("u1", since=at(20)) == stored[1:]
+        assert await storage.zen_sessions.created_at_by_user("u1", limit=1) == stored[:1]
+        assert await storage.zen_sessions.created_at_by_user("nobody") == []
+        assert await storage.cbt_sessions.created_at_by_user("u1") == []
+    run(backend, tmp_path, scenario)
+
+
+def test_session_range_boundaries_are_inclusive(backend, tmp_path):
+    async def scenario(storage):
+        created = datetime(2026, 5, 4, 8, 0, 0, tzinfo=timezone.utc)
+        doc = session(created_at=created)
+        await storage.zen_sessions.insert(doc)
+        assert len(await storage.zen_sessions.find_by_user("u1", since=created, until=created)) == 1
+        assert await storage.zen_sessions.find_by_user("u1", since=created + timedelta(milliseconds=1)) == []
+    run(backend, tmp_path, scenario)
+
+
+def test_session_delete_is_scoped_to_user(backend, tmp_path):
+    async def scenario(storage):
+        doc = session()
+        await storage.cbt_sessions.insert(doc)
+        assert await storage.cbt_sessions.delete("u2", doc["id"]) is False
+        assert await storage.cbt_sessions.delete("u1", doc["id"]) is True
+        assert await storage.cbt_sessions.delete("u1", doc["id"]) is False
+        assert await storage.cbt_sessions.get(doc["id"]) is None
+    run(backend, tmp_path, scenario)
+
+
+def test_session_update_is_scoped_to_user(backend, tmp_path):
+    async def scenario(storage):
+        doc = session()
+        await storage.zen_sessions.insert(doc)
+        assert await storage.zen_sessions.update("u2", doc["id"], {"completed": False}) is False
+        assert await storage.zen_sessions.update("u1", doc["id"], {"telemetry": {"samples": 3, "signal": "AAA="}}) is True
+        stored = await storage.zen_sessions.get(doc["id"])
+        assert stored["telemetry"] == {"samples": 3, "signal": "AAA="}
+        assert stored["created_at"] == (await storage.zen_sessions.find_by_user("u1"))[0]["created_at"]
+        assert await storage.zen_sessions.update("u1", "missing", {"completed": False}) is False
+    run(backend, tmp_path, scenario)
+
+
+def test_session_search_by_terms(backend, tmp_path):
+    async def scenario(storage):
+        exam = session(created_at=at(3), search_terms=["exam", "fail"])
+        work = session(created_at=at(2), search_terms=["work"])
+        both = session(created_at=at(1), search_terms=["exam", "work"])
+        other = session(user_id="u2", search_terms=["exam"])
+        for doc in (exam, work, both, other):
+            await storage.cbt_sessions.insert(doc)
+
+        found = await storage.cbt_sessions.search("u1", ["exam"])
+        assert [doc["id"] for doc in found] == [both["id"], exam["id"]]
+        # The terms are index-only and never come back with a session
+        assert all("search_terms" not in doc for doc in found)
+        assert "search_terms" not in await storage.cbt_sessions.get(exam["id"])
+        assert all("search_terms" not in doc for doc in await storage.cbt_sessions.find_by_user("u1"))
+
+        assert {doc["id"] for doc in await storage.cbt_sessions.search("u1", ["exam", "work"])} == {exam["id"], work["id"], both["id"]}
+        assert [doc["id"] for doc in await storage.cbt_sessions.search("u1", ["exam"], until=at(2))] == [exam["id"]]
+        assert [doc["id"] for doc in await storage.cbt_sessions.search("u1", ["exam", "work"], limit=1)] == [both["id"]]
+        assert await storage.cbt_sessions.search("u1", []) == []
+
+        await storage.cbt_sessions.delete("u1", both["id"])
+        assert [doc["id"] for doc in await storage.cbt_sessions.search("u1", ["exam"])] == [exam["id"]]
+    run(backend, tmp_path, scenario)
+
+
+def test_session_search_terms_backfill_replaces_terms(backend, tmp_path):
+    async def scenario(storage):
+        old = session(created_at=at(2))
+        indexed = session(created_at=at(1), search_terms=["work"])
+        for doc in (old, indexed):
+            await storage.cbt_sessions.insert(doc)
+        assert await storage.cbt_sessions.search("u1", ["exam"]) == []
+
+        await storage.cbt_sessions.set_search_terms({old["id"]: ["exam"], indexed["id"]: ["exam", "study"], "missing": ["exam"]})
+        assert [doc["id"] for doc in await storage.cbt_sessions.search("u1", ["exam"])] == [indexed["id"], old["id"]]
+        assert await storage.cbt_sessions.search("u1", ["work"]) == []
+        assert "search_terms" not in await storage.cbt_sessions.get(old["id"])
+        await storage.cbt_sessions.set_search_terms({})
+    run(backend, tmp_path, scenario)
+
+
+def test_job_state_roundtrip(backend, tmp_path):
+    async def scenario(storage):
+        assert await storage.job_state.get("search_backfill") is None
+        await storage.job_state.save("search_backfill", {"until": datetime(2026, 1, 2), "indexed_until": None})
+        await storage.job_state.save("search_backfill", {"until": datetime(2026, 1, 2), "indexed_until": datetime(2026, 1, 1, 12)})
+        assert await storage.job_state.get("search_backfill") == {
+            "until": datetime(2026, 1, 2), "indexed_until": datetime(2026, 1, 1, 12),
+        }
+        assert await storage.job_state.get("other") is None
+    run(backend, tmp_path, scenario)
+
+
+def test_articles(backend, tmp_path):
+    async def scenario(storage):
+        articles = [
+            {"id": f"a{i}", "title": f"Article {i}", "content": "...", "category": "Mindfulness", "author": "Serenity Team", "created_at": at(0)}
+            for i in range(3)
+        ]
+        await storage.articles.insert_many(articles)
+        assert [article["id"] for article in await storage.articles.list()] == ["a0", "a1", "a2"]
+        assert (await storage.articles.get("a1"))["title"] == "Article 1"
+        assert await storage.articles.get("missing") is None
+    run(backend, tmp_path, scenario)
+
+
+def test_favorites(backend, tmp_path):
+    async def scenario(storage):
+        await storage.favorites.insert({"id": "f1", "user_id": "u1", "article_id": "a1", "created_at": at(0)})
+        await storage.favorites.insert({"id": "f2", "user_id": "u1", "article_id": "a2", "created_at": at(0)})
+        await storage.favorites.insert({"id": "f3", "user_id": "u2", "article_id": "a1", "created_at": at(0)})
+
+        assert (await storage.favorites.get("u1", "a1"))["id"] == "f1"
+        assert await storage.favorites.get("u1", "a3") is None
+        assert sorted(fav["article_id"] for fav in await storage.favorites.list("u1")) == ["a1", "a2"]
+        assert await storage.favorites.delete("u1", "a1") is True
+        assert await storage.favorites.delete("u1", "a1") is False
+        assert [fav["article_id"] for fav in await storage.favorites.list("u1")] == ["a2"]
+        assert [fav["id"] for fav in await storage.favorites.list("u2")] == ["f3"]
+        assert await storage.favorites.counts_by_article() == {"a1": 1, "a2": 1}
+    run(backend, tmp_path, scenario)
+
+
+def test_delete_user_batch_is_bounded_and_scoped(backend, tmp_path):
+    async def scenario(storage):
+        for _ in range(5):
+            await storage.cbt_sessions.insert(session(search_terms=["t1"]))
+        await storage.cbt_sessions.insert(session(user_id="u2", search_terms=["t1"]))
+        await storage.favorites.insert({"id": "f1", "user_id": "u1", "article_id": "a1", "created_at": at(0)})
+        await storage.analytics.insert({"id": "e1", "user_id": "u1", "feature": "zen", "action": "complete", "created_at": at(0)})
+        await storage.preferences.insert({"id": "p1", "user_id": "u1", "current_mood": "Calm", "created_at": at(0)})
+
+        assert await storage.cbt_sessions.delete_user_batch("u1", 3) == 3
+        assert await storage.cbt_sessions.delete_user_batch("u1", 3) == 2
+        assert await storage.cbt_sessions.delete_user_batch("u1", 3) == 0
+        assert await storage.cbt_sessions.search("u1", ["t1"]) == []
+        assert len(await storage.cbt_sessions.search("u2", ["t1"])) == 1
+        for repository in (storage.favorites, storage.analytics, storage.preferences):
+            assert await repository.delete_user_batch("u1", 10) == 1
+        assert await storage.favorites.list("u1") == []
+        assert await storage.preferences.find_by_user("u1") == []
+    run(backend, tmp_path, scenario)
+
+
+def test_erasure_jobs_are_leased(backend, tmp_path):
+    async def scenario(storage):
+        assert await storage.erasures.claim("w1", 60) is None
+        for user_id, minutes in (("u2", 1), ("u1", 0)):
+            await storage.erasures.save({
+                "id": user_id, "user_id": user_id, "status": "queued", "deleted": {},
+                "requested_at": datetime(2026, 1, 1, 0, minutes), "owner": None, "lease_until": None,
+            })
+        first = await storage.erasures.claim("w1", 60)
+        assert first["user_id"] == "u1" and first["owner"] == "w1"
+        # w1 keeps its job; w2 gets the next one
+        assert (await storage.erasures.claim("w1", 60))["user_id"] == "u1"
+        assert (await storage.erasures.claim("w2", 60))["user_id"] == "u2"
+        assert await storage.erasures.claim("w3", 60) is None
+
+        await storage.erasures.save({**first, "status": "completed", "deleted": {"cbt_sessions": 2}})
+        assert (await storage.erasures.get("u1"))["deleted"] == {"cbt_sessions": 2}
+        await storage.erasures.save({**(await storage.erasures.get("u2")), "lease_until": at(1)})
+        # An expired lease can be taken over
+        taken = await storage.erasures.claim("w3", 60)
+        assert taken["user_id"] == "u2"
+        # ...after which the previous owner's saves are refused
+        assert await storage.erasures.save({**taken, "owner": "w2", "deleted": {"zen_sessions": 1}}, owner="w2") is False
+        assert await storage.erasures.save({**taken, "deleted": {"zen_sessions": 1}}, owner="w3") is True
+        assert (await storage.erasures.get("u2"))["deleted"] == {"zen_sessions": 1}
+        assert await storage.erasures.save({"user_id": "u9", "status": "running"}, owner="w3") is False
+        assert await storage.erasures.get("u9") is None
+    run(backend, tmp_path, scenario)
+
+
+def test_data_keys_first_writer_wins(backend, tmp_path):
+    async def scenario(storage):
+        assert await storage.data_keys.get_many(["u1"]) == {}
+        assert await storage.data_keys.create("u1", b"\x00first") == b"\x00first"
+        assert await storage.data_keys.create("u1", b"\x00second") == b"\x00first"
+        await storage.data_keys.create("u2", b"other")
+        assert await storage.data_keys.get_many(["u1", "u2", "u3"]) == {"u1": b"\x00first", "u2": b"other"}
+        assert await storage.data_keys.delete("u1") is True
+        assert await storage.data_keys.delete("u1") is False
+        assert await storage.data_keys.get_many(["u1"]) == {}
+    run(backend, tmp_path, scenario)
+
+
+def test_analytics_feature_stats_and_recent(backend, tmp_path):
+    async def scenario(storage):
+        events = [
+            ("zen", 60, at(1)),
+            ("zen", 30, at(2)),
+            ("zen", None, at(3)),
+            ("cbt", None, at(4)),
+            ("music", 10, at(10)),
+        ]
+        for feature, duration, created_at in events:
+            await storage.analytics.insert({
+                "id": str(uuid.uuid4()), "user_id": "u1", "feature": feature, "action": "view",
+                "duration": duration, "metadata": None, "created_at": created_at,
+            })
+        await storage.analytics.insert({
+            "id": str(uuid.uuid4()), "user_id": "u2", "feature": "zen", "action": "view",
+            "duration": 999, "metadata": None, "created_at": at(0),
+        })
+
+        stats = {row["_id"]: (row["total_sessions"], row["total_duration"]) for row in await storage.analytics.feature_stats("u1")}
+        assert stats == {"zen": (3, 90), "cbt": (1, 0), "music": (1, 10)}
+
+        recent = await storage.analytics.recent("u1", at(7))
+        assert [event["feature"] for event in recent] == ["zen", "zen", "zen", "cbt"]
+        assert recent[0]["created_at"] > recent[1]["created_at"]
+        assert len(await storage.analytics.recent("u1", at(7), limit=2)) == 2
+    run(backend, tmp_path, scenario)
+
+
+def test_concurrent_writes_and_reads(backend, tmp_path):
+    async def scenario(storage):
+        docs = [session(user_id=f"user{i % 5}") for i in range(100)]
+        await asyncio.gather(*(storage.zen_sessions.insert(doc) for doc in docs))
+        counts = await asyncio.gather(*(storage.zen_sessions.find_by_user(f"user{i}") for i in range(5)))
+        assert [len(found) for found in counts] == [20] * 5
+    run(backend, tmp_path, scenario)
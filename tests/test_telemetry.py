@@ -0,0 +1,129 @@
+"""
+Breathing telemetry reduction: downsampling, phase runs, summaries and resuming.
+
+Usage: python -m pytest tests/test_telemetry.py
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from telemetry import BreathTelemetry, decode  # noqa: E402
+
+PATTERN_478 = (4, 7, 8, 2)
+
+
+def breathing(breaths, hz=20, scale=1.0, start_ms=0.0):
+    """Columnar samples following the 4-7-8 cycle, each phase stretched by ``scale``"""
+    t, phase, value = [], [], []
+    now = start_ms
+    for _ in range(breaths):
+        for code, seconds in enumerate(PATTERN_478):
+            n = int(seconds * scale * hz)
+            t.append(now + np.arange(n) * 1000 / hz)
+            phase.append(np.full(n, code))
+            value.append(np.full(n, float(code)))
+            now += seconds * scale * 1000
+    return {"t": np.concatenate(t).tolist(), "phase": np.concatenate(phase).tolist(), "value": np.concatenate(value).tolist()}
+
+
+def in_batches(samples, size):
+    for i in range(0, len(samples["t"]), size):
+        yield {key: values[i:i + size] for key, values in samples.items()}
+
+
+def test_exact_pattern_scores_full_adherence():
+    telemetry = BreathTelemetry("478")
+    telemetry.add(breathing(6))
+    summary = telemetry.summary()
+    # Six inhales give five complete breaths of 21 seconds each
+    assert summary["breaths"] == 5
+    assert summary["breath_rate"] == pytest.approx(60 / 21, abs=0.01)
+    assert summary["interval_sd"] == pytest.approx(0, abs=1e-6)
+    assert summary["adherence"] == pytest.approx(1.0)
+    assert summary["phase_mean_seconds"]["exhale"] == 8.0
+
+
+def test_slow_breathing_lowers_adherence():
+    telemetry = BreathTelemetry("478")
+    telemetry.add(breathing(4, scale=1.5))
+    assert telemetry.summary()["adherence"] == pytest.approx(0.5)
+    assert BreathTelemetry("box").add(breathing(1)) > 0
+
+
+def test_batch_boundaries_do_not_change_the_result():
+    samples = breathing(5)
+    whole = BreathTelemetry("478")
+    whole.add(samples)
+    split = BreathTelemetry("478")
+    for batch in in_batches(samples, 37):
+        split.add(batch)
+    assert split.summary() == whole.summary()
+    assert np.array_equal(split.runs()[1], whole.runs()[1])
+    first, signal = split.signal()
+    assert first == whole.signal()[0] and np.allclose(signal, whole.signal()[1], equal_nan=True)
+    # 20 Hz into 250 ms bins, holding each phase's constant value
+    assert signal.size == int(split.last_ms // 250) + 1
+    assert set(np.unique(signal)) == {0.0, 1.0, 2.0, 3.0}
+
+
+def test_resume_from_stored_document_and_drop_replays():
+    samples = breathing(6)
+    batches = list(in_batches(samples, 500))
+    telemetry = BreathTelemetry("478")
+    for batch in batches[:3]:
+        telemetry.add(batch)
+    resumed = BreathTelemetry.resume(telemetry.to_document(), "478")
+    # The client replays its last batch after reconnecting
+    assert resumed.add(batches[2]) == 0
+    for batch in batches[3:]:
+        resumed.add(batch)
+    whole = BreathTelemetry("478")
+    whole.add(samples)
+    assert resumed.summary() == whole.summary()
+
+    decoded = decode(resumed.to_document())
+    assert decoded["phases"][:4] == ["inhale", "hold", "exhale", "holdOut"]
+    assert decoded["phase_ms"][:4] == [4000, 7000, 8000, 2000]
+
+
+def test_invalid_batches_are_rejected():
+    telemetry = BreathTelemetry("478")
+    with pytest.raises(ValueError):
+        telemetry.add({"t": [0, 1], "phase": [0]})
+    with pytest.raises(ValueError):
+        telemetry.add({"t": [0, 1], "phase": [0, 7]})
+    with pytest.raises(ValueError):
+        telemetry.add({"t": [5, 1], "phase": [0, 0]})
+    with pytest.raises(ValueError):
+        BreathTelemetry("unknown")
+    with pytest.raises(OverflowError):
+        BreathTelemetry("478", max_samples=10).add(breathing(1))
+
+
+def test_non_finite_and_negative_t_are_rejected():
+    telemetry = BreathTelemetry("478")
+    with pytest.raises(ValueError):
+        telemetry.add({"t": [0, float("nan")], "phase": [0, 1], "value": [1, 2]})
+    with pytest.raises(ValueError):
+        telemetry.add({"t": [0, float("inf")], "phase": [0, 1]})
+    with pytest.raises(ValueError):
+        telemetry.add({"t": [-250, 0], "phase": [0, 1]})
+    assert telemetry.samples == 0
+
+
+def test_t_beyond_the_longest_session_is_rejected_before_allocating():
+    telemetry = BreathTelemetry("478", resolution_ms=250, max_samples=1000)
+    with pytest.raises(OverflowError):
+        telemetry.add({"t": [0, 9e11], "phase": [0, 1], "value": [1, 2]})
+    telemetry.add({"t": [0, 1000], "phase": [0, 1], "value": [1, 2]})
+    with pytest.raises(OverflowError):
+        telemetry.add({"t": [250 * 1000], "phase": [1], "value": [3]})
+    resumed = BreathTelemetry.resume(telemetry.to_document(), "478", resolution_ms=250, max_samples=1000)
+    resumed.add({"t": [250 * 1000 - 1], "phase": [1], "value": [3]})
+    first_bin, signal = resumed.signal()
+    assert first_bin == 0 and signal.size == 1000
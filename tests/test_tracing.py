@@ -0,0 +1,110 @@
+"""
+Tracing: tail sampler decisions, request and manual spans, and OTLP/JSON export.
+
+Usage: python -m pytest tests/test_tracing.py
+"""
+
+import asyncio
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from tracing import BatchExporter, Span, TailSampler, Trace, Tracer, TracingMiddleware, to_otlp  # noqa: E402
+
+
+def root(duration_ms, error=False):
+    span = Span(Trace(), "GET /api/articles", None, {})
+    span.end_ns = span.start_ns + int(duration_ms * 1e6)
+    span.error = error
+    return span
+
+
+class Collect:
+    def __init__(self):
+        self.traces = []
+
+    def submit(self, spans):
+        self.traces.append(spans)
+
+
+def test_sampler_keeps_the_slowest_traces_and_all_errors():
+    sampler = TailSampler(keep_ratio=0.1, baseline_rate=0.0, window=100)
+    durations = list(range(1, 101))
+    random.Random(7).shuffle(durations)
+    for ms in durations:
+        sampler.keep(root(ms))
+    # The threshold sits at the slowest 10% of the recent window
+    assert 85 <= sampler.threshold_ms <= 95
+    assert not sampler.keep(root(50))
+    assert sampler.keep(root(99))
+    assert not sampler.keep(root(5))
+    assert sampler.keep(root(5, error=True))
+    assert sampler.keep(root(500))
+
+
+def test_sampler_keeps_a_random_baseline(monkeypatch):
+    sampler = TailSampler(keep_ratio=0.01, baseline_rate=0.5, window=100)
+    for ms in range(100, 200):
+        sampler.keep(root(ms))
+    monkeypatch.setattr("tracing.random.random", lambda: 0.4)
+    assert sampler.keep(root(1))
+    monkeypatch.setattr("tracing.random.random", lambda: 0.6)
+    assert not sampler.keep(root(1))
+
+
+def test_request_spans_nest_and_record_errors():
+    exporter = Collect()
+    tracer = Tracer(TailSampler(keep_ratio=1.0, baseline_rate=1.0), exporter)
+
+    def endpoint(status):
+        async def app(scope, receive, send):
+            with tracer.span("summary.feature_stats", user="u1") as span:
+                span.attributes["rows"] = 3
+            await send({"type": "http.response.start", "status": status, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+        return app
+
+    async def call(app):
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            pass
+
+        await TracingMiddleware(app, tracer)({"type": "http", "method": "GET", "path": "/api/analytics/summary"}, receive, send)
+
+    asyncio.run(call(endpoint(200)))
+    asyncio.run(call(endpoint(503)))
+    (child, request), (_, failed) = exporter.traces
+    assert child.parent_id == request.span_id and child.trace is request.trace
+    assert child.attributes == {"user": "u1", "rows": 3}
+    assert request.attributes["http.status_code"] == 200 and not request.error
+    assert failed.error
+    # Outside a request manual spans are no-ops
+    with tracer.span("orphan") as span:
+        assert span is None
+
+
+def test_spans_export_as_otlp_json(tmp_path):
+    trace = Trace()
+    request = Span(trace, "GET /api/articles", None, {"http.status_code": 200})
+    command = Span(trace, "mongo.find", request.span_id, {"db.collection": "articles", "cached": False, "ms": 1.5})
+    command.end()
+    request.end()
+    encoded = to_otlp(trace.spans)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [span["kind"] for span in encoded] == [3, 2]
+    assert encoded[0]["parentSpanId"] == request.span_id and "parentSpanId" not in encoded[1]
+    assert {a["key"]: a["value"] for a in encoded[0]["attributes"]} == {
+        "db.collection": {"stringValue": "articles"}, "cached": {"boolValue": False}, "ms": {"doubleValue": 1.5},
+    }
+
+    target = tmp_path / "traces.jsonl"
+    exporter = BatchExporter(str(target), flush_interval=0.05)
+    exporter.start()
+    exporter.submit(trace.spans)
+    exporter.stop()
+    lines = target.read_text().splitlines()
+    assert len(lines) == 1 and len(json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]) == 2